@@ -1,13 +1,16 @@
 __version__ = '0.2.5'
 __app_name__ = 'imdupes'
 
-__prog_usage__ = f'{__app_name__} {{info,scan,clean}} ...'
+__prog_usage__ = f'{__app_name__} {{info,scan,clean,watch,serve,merge}} ...'
 __prog_desc__ = \
-    'Quickly detects and removes identical images. Has 3 modes:\n' \
+    'Quickly detects and removes identical images. Has 6 modes:\n' \
     "\t- 'info' collects and displays statistics and information of images in a directory\n" \
     "\t- 'scan' scans and console prints detected identical image paths/filenames\n" \
-    "\t- 'clean' scans and removes detected identical images (keeping only the first copy by default)\n" \
-    f'See "{__app_name__} {{info,scan,clean}} --help" for more information'
+    "\t- 'clean' scans and removes (or links) detected identical images (keeping only the first copy by default)\n" \
+    "\t- 'watch' keeps watching a directory and reports (or removes) new identical images as they arrive\n" \
+    "\t- 'serve' answers identical image queries over HTTP from a hash index saved by scan mode\n" \
+    "\t- 'merge' joins hash indexes saved by sharded scans into one duplicate report, without rehashing\n" \
+    f'See "{__app_name__} {{info,scan,clean,watch,serve,merge}} --help" for more information'
 __prog_epilog__ = \
     'Note: This program ignores any non-image file in the target directory\n' \
     'Algorithm: Average Hash (https://www.hackerfactor.com/blog/index.php?/archives/432-Looks-Like-It.html)'
@@ -29,6 +32,36 @@ __scan_epilog__ = \
 
 __clean_usage__ = f'{__app_name__} clean [options] input'
 __clean_desc__ = \
-    'scan and remove detected identical images (keeping only the first copy by default); deleted files are not\n' \
-    'recoverable, proceed with caution'
+    'scan and remove detected identical images (keeping only the first copy by default), or replace them with\n' \
+    'links to the kept copy; deleted files are not recoverable (unless the clean is journaled and rolled back before\n' \
+    'it completes), proceed with caution'
 __clean_epilog__ = __scan_epilog__
+
+__watch_usage__ = f'{__app_name__} watch [options] directory -s HASH_SIZE'
+__watch_desc__ = \
+    'hash the images of a directory once, then keep watching it and report (or remove, with --clean) new and changed\n' \
+    'images that are identical to other images as soon as they arrive'
+__watch_epilog__ = \
+    __scan_epilog__ + '\n' \
+    'Changes are detected through inotify on Linux, and by walking the directory every --poll-interval seconds\n' \
+    'elsewhere (or with --poll, e.g. on network filesystems); press Ctrl+C to stop watching'
+
+__serve_usage__ = f'{__app_name__} serve [options] index'
+__serve_desc__ = \
+    'load a hash index saved by scan mode (--save-index) once, and answer queries for the indexed duplicates of image\n' \
+    'files or raw image data over HTTP, on a localhost port or a Unix socket'
+__serve_epilog__ = \
+    'Endpoints:\n' \
+    '  POST /query   JSON body {"paths": [...], "images": [{"name": ..., "data": BASE64}], "threshold": N,\n' \
+    '                "add": false} to query a batch of image files and raw images at once, or raw image data body\n' \
+    '                with optional ?threshold=N&add=1&name=NAME query parameters; with add, queried images are\n' \
+    '                added to the index (and saved to the index file)\n' \
+    '  GET /stats    index and query statistics'
+
+__merge_usage__ = f'{__app_name__} merge [options] index [index ...] [-o OUTPUT]'
+__merge_desc__ = \
+    'join hash indexes saved by scan mode (--save-index), e.g. by the shards of a sharded scan (--shard), and console\n' \
+    'print the identical images across all of them, without rehashing any image'
+__merge_epilog__ = \
+    'Note: Every index must be hashed with the same hashing method and hash size; images indexed by several indexes\n' \
+    'are only kept once'
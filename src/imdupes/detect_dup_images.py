@@ -1,6 +1,15 @@
+import os
 import sys
+import time
+import random
 from sys import exit
 import warnings
+import functools
+from collections import deque
+from collections.abc import Iterable, Sized
+from typing import BinaryIO
+from concurrent.futures import ProcessPoolExecutor, Future
+import numpy
 from PIL import Image
 from tqdm.auto import tqdm
 from termcolor import colored
@@ -9,7 +18,22 @@ from utils import loop_errprint
 from utils.globs import HashingMethod
 from utils.globs import DEFAULT_HASH_SIZE
 from utils.globs import PROGRESS_BAR_LEVELS
-from utils.imutils import hash_image, ImageFileWrapper
+from utils.globs import MAX_JOB_CHUNK_SIZE
+from utils.globs import ValidationPolicy
+from utils.globs import HASH_DIGEST_SIZE
+from utils.globs import REDUCED_DECODING_GAP
+from utils.globs import PREFETCH_DEPTH, PREFETCH_MEMORY_BUDGET
+from utils.globs import TUNE_HASH_SIZES, TUNE_SAMPLE_SIZE, TUNE_SAMPLE_SEED
+from utils.globs import TUNE_MAX_COST_INCREASE, TUNE_MAX_CHANGED
+from utils.imutils import open_image, set_validation_policy, reduce_image, hash_target_size, fold_hash, HashBatch, add_to_batches
+from utils.results import DupResults
+from utils.extsort import DupRuns
+from utils.cache import HashCache
+from utils.prefilter import IdenticalFileFilter
+from utils.prefetch import Prefetcher
+from utils.futils import map_file, MappedFile
+from utils.hamming import cluster_hashes
+from utils.profiling import Profiler, FileTimings, BatchTimings, NULL_PROFILER
 from utils.globs import PathFormat, format_path
 
 
@@ -17,111 +41,884 @@ Image.MAX_IMAGE_PIXELS = 846_071_539_488  # Kuala Lumpur 846 gigapixels: https:/
 warnings.simplefilter('ignore', Image.DecompressionBombWarning)
 
 
-def detect_dup_images(
-        img_paths: list[str],
+HashResult = tuple[bytes | None, bytes | None, tuple[int, int] | None, str | None, str | None, bool]
+# Same as HashResult, with the digests and full hashes of each of several hashing methods
+MethodsHashResult = tuple[
+    list[bytes] | None, list[bytes | None] | None, tuple[int, int] | None, str | None, str | None, bool
+]
+
+
+def _decode_image_file(
+        img_path: str | BinaryIO,
+        batches: list[HashBatch],
+        validation: ValidationPolicy,
+        reduced_decoding: bool,
+        timings: FileTimings | None,
+        source: BinaryIO | None = None
+) -> MethodsHashResult:
+    """
+    Decodes an image file once and adds it to every batch of @batches, returning its partial result (size and format),
+    or its error result if it could not be decoded, in which case it is not added to @batches. The image is read from
+    @source if given (e.g. a read-ahead buffer or a memory mapping of the file), instead of from @img_path.
+    """
+
+    im = None
+    if source is None:
+        source = img_path
+    try:
+        start_time = time.perf_counter()
+        im = open_image(source, validation)
+        size = im.size
+        file_format = im.format
+        open_time = time.perf_counter()
+
+        # Keep a margin above the hashing resize target, so that the final resize still averages over several pixels
+        target_size = tuple(
+            REDUCED_DECODING_GAP * max(dims)
+            for dims in zip(*[hash_target_size(batch.method, batch.hash_size) for batch in batches])
+        )
+        if reduced_decoding and reduce_image(im, target_size):
+            try:
+                im.load()
+            except OSError:
+                # Not every file supports every reduction, e.g. JPEG 2000 code streams with fewer resolution levels
+                im.close()
+                im = open_image(source, validation)
+        im.load()
+        decode_time = time.perf_counter()
+
+        if im.format == 'PNG' and im.mode != 'RGBA':
+            im = im.convert('RGBA')
+        convert_time = time.perf_counter()
+
+        add_to_batches(batches, im)
+        if timings is not None:
+            timings['open'] = open_time - start_time
+            timings['decode'] = decode_time - open_time
+            timings['convert'] = convert_time - decode_time
+            timings['resize'] = time.perf_counter() - convert_time
+        return None, None, size, file_format, None, False
+
+    except (
+            ValueError, TypeError,
+            Image.DecompressionBombError,
+            OSError, EOFError, PermissionError,
+            MemoryError
+    ) as error:
+        # Errors name the file rather than the object it was read from
+        message = error.__str__() if source is img_path else error.__str__().replace(repr(source), repr(img_path))
+        # Permission and memory errors are transient, so they are not worth remembering in the hash cache
+        return None, None, None, None, message, not isinstance(error, (PermissionError, MemoryError))
+
+    finally:
+        if im is not None:
+            im.close()
+
+
+def _hash_image_files(
+        img_paths: list[str | BinaryIO],
+        methods: list[HashingMethod],
+        hash_size: int,
+        validation: ValidationPolicy,
+        full_hash: bool,
+        reduced_decoding: bool,
+        profile: bool = False,
+        prefetch: int = 0,
+        prefetch_memory: int = PREFETCH_MEMORY_BUDGET,
+        use_mmap: bool = False
+) -> tuple[list[tuple[MethodsHashResult, FileTimings | None]], BatchTimings]:
+    """
+    Decodes a chunk of image files one by one, then hashes all of them at once with each of @methods. Returns the result
+    of each file, along with the time spent hashing each batch of images and their number when @profile is enabled,
+    since the hashing time of a batch cannot be attributed to the files it hashed. With @prefetch,
+    up to @prefetch files are read ahead of decoding within @prefetch_memory bytes (see Prefetcher), and the time spent
+    waiting for each of them to be read is timed as their "io wait" step. With @use_mmap, files are decoded from a
+    memory mapping of their content (see futils.map_file()) where possible, rather than through read() calls.
+    """
+
+    batches = [HashBatch(method, hash_size) for method in methods]
+    results = []
+    image_hashes = []
+    batch_timings = []
+    prefetcher = Prefetcher(
+        img_paths, depth=prefetch, memory_budget=prefetch_memory, use_mmap=use_mmap
+    ) if prefetch > 0 else None
+    try:
+        sources = iter(prefetcher) if prefetcher is not None else ((img_path, None) for img_path in img_paths)
+        for i, (source, io_wait) in enumerate(sources):
+            img_path = img_paths[i]
+            timings = {} if profile else None
+            if timings is not None and io_wait is not None:
+                timings['io wait'] = io_wait
+            if use_mmap and prefetcher is None and isinstance(source, str):
+                mapped = map_file(source)
+                if mapped is not None:
+                    source = MappedFile(mapped)
+            try:
+                results.append((
+                    _decode_image_file(
+                        img_path, batches, validation, reduced_decoding, timings,
+                        source=source if source is not img_path else None
+                    ),
+                    timings
+                ))
+            finally:
+                if source is not img_path:
+                    source.close()
+            if any(batch.is_full for batch in batches) or i == len(img_paths) - 1:
+                batch_size = len(batches[0])
+                start_time = time.perf_counter()
+                image_hashes += zip(*[batch.hash() for batch in batches])
+                if profile and batch_size > 0:
+                    batch_timings.append((time.perf_counter() - start_time, batch_size))
+    finally:
+        if prefetcher is not None:
+            prefetcher.close()
+    image_hashes = iter(image_hashes)
+
+    # Only the fixed-size digests are sent back to the parent process, unless the full hashes are needed
+    hashed_results = []
+    for (digests, method_hashes, size, file_format, error, error_cacheable), timings in results:
+        if error is None:
+            method_hashes = next(image_hashes)
+            digests = [fold_hash(image_hash) for image_hash in method_hashes]
+            method_hashes = list(method_hashes) if full_hash else [None] * len(methods)
+        hashed_results.append(((digests, method_hashes, size, file_format, error, error_cacheable), timings))
+    return hashed_results, batch_timings
+
+
+def hash_image_file(
+        img_path: str,
+        method: HashingMethod,
+        hash_size: int,
+        validation: ValidationPolicy,
+        full_hash: bool,
+        reduced_decoding: bool,
+        timings: FileTimings | None = None
+) -> HashResult:
+    """
+    Hashes an image file, reporting errors as part of the result instead of raising them.
+
+    @timings, if given, is filled with the time spent opening (and verifying), decoding, converting, resizing and
+    hashing the image.
+    """
+
+    results, batch_timings = _hash_image_files(
+        [img_path], [method], hash_size, validation, full_hash, reduced_decoding, profile=timings is not None
+    )
+    (digests, method_hashes, *result), file_timings = results[0]
+    if timings is not None:
+        timings.update(file_timings)
+        if len(batch_timings) > 0:
+            timings['hash'] = batch_timings[0][0]  # The image is hashed in a batch of its own
+    if digests is None:
+        return None, None, *result
+    return digests[0], method_hashes[0], *result
+
+
+def hash_image_files(
+        img_paths: list[str | BinaryIO],
         method: HashingMethod,
         hash_size: int = DEFAULT_HASH_SIZE,
-        root_dir: str = None,
-        output_path_format: PathFormat = PathFormat.DIR_RELATIVE,
+        validation: ValidationPolicy = ValidationPolicy.HEADER,
+        full_hash: bool = False,
+        reduced_decoding: bool = False
+) -> list[HashResult]:
+    """
+    Hashes several image files (or binary file objects of image data) at once in the current process, which is faster
+    than hashing them one by one, reporting errors as part of the results instead of raising them.
+    """
+
+    return [
+        (None, None, *result) if digests is None else (digests[0], method_hashes[0], *result)
+        for (digests, method_hashes, *result), _ in _hash_image_files(
+            img_paths, [method], hash_size, validation, full_hash, reduced_decoding
+        )[0]
+    ]
+
+
+def _group_digests(digests: bytes, min_group_size: int = 2) -> list[numpy.ndarray]:
+    """
+    Groups identical HASH_DIGEST_SIZE bytes digests by sorting them, rather than through a dictionary.
+
+    Returns the indices of the digests of each group with at least @min_group_size members, with groups ordered by
+    their first index, and indices in increasing order within each group.
+    """
+
+    if len(digests) == 0:
+        return []
+
+    keys = numpy.frombuffer(digests, dtype=numpy.uint64).reshape(-1, HASH_DIGEST_SIZE // 8)
+    _, first_indices, inverse, counts = numpy.unique(
+        keys, axis=0, return_index=True, return_inverse=True, return_counts=True
+    )
+    order = numpy.argsort(inverse.reshape(-1), kind='stable')
+    groups = numpy.split(order, numpy.cumsum(counts)[:-1])
+    return [groups[group] for group in numpy.argsort(first_indices, kind='stable') if counts[group] >= min_group_size]
+
+
+def _group_digests_near(digests: bytes, full_hashes: list[bytes], threshold: int) -> list[numpy.ndarray]:
+    """
+    Same as _group_digests(), but also merges groups whose full hashes are within @threshold bits (Hamming distance)
+    of each other.
+    """
+
+    groups = _group_digests(digests, min_group_size=1)
+    if len(groups) == 0:
+        return []
+
+    clusters = cluster_hashes(
+        [int.from_bytes(full_hashes[group[0]], 'big') for group in groups],
+        bit_length=len(full_hashes[0]) * 8,
+        threshold=threshold
+    )
+    merged_groups = [numpy.concatenate([groups[i] for i in cluster]) for cluster in clusters]
+    return [group for group in merged_groups if len(group) > 1]
+
+
+def group_dups(scanned_images: DupResults, threshold: int = 0, profiler: Profiler = NULL_PROFILER) -> DupResults:
+    """
+    Groups hashed images (see detect_dup_images_methods() with grouping disabled) into duplications. With a @threshold,
+    @scanned_images must keep the full hashes of its images.
+    """
+
+    # Group images by the digests of their hashes, keyed by the digest of the first image of each group, and sort
+    # duplications in order of decreasing resolution (width * height) so that the highest resolution image is kept
+    # during cleaning step
+    digests = bytes(scanned_images.digests)
+    with profiler.stage('group'):
+        if threshold > 0:
+            groups = _group_digests_near(digests, scanned_images.hashes, threshold)
+        else:
+            groups = _group_digests(digests)
+    with profiler.stage('resolution sort'):
+        return scanned_images.clustered(
+            [digests[group[0] * HASH_DIGEST_SIZE:(group[0] + 1) * HASH_DIGEST_SIZE] for group in groups],
+            groups
+        )
+
+
+def tune_hash_size(
+        img_paths: list[str | os.DirEntry],
+        methods: list[HashingMethod],
         verbose: int = 0,
-        progress_bar: int = PROGRESS_BAR_LEVELS[2]
-) -> dict[str, list[ImageFileWrapper]]:
-    hashed_images: dict[str, list[ImageFileWrapper]] = {}
-    has_errors = False
-    pbar = None
+        progress_bar: int = PROGRESS_BAR_LEVELS[2],
+        validation: ValidationPolicy = ValidationPolicy.HEADER,
+        reduced_decoding: bool = False,
+        candidates: list[int] = None,
+        sample_size: int = TUNE_SAMPLE_SIZE,
+        max_cost_increase: float = TUNE_MAX_COST_INCREASE,
+        max_changed: float = TUNE_MAX_CHANGED,
+        seed: int = TUNE_SAMPLE_SEED
+) -> tuple[int, list[dict]]:
+    """
+    Picks a hash size by hashing a random sample of @sample_size images with each of @methods at every candidate hash
+    size (TUNE_HASH_SIZES by default), each image being decoded once.
+
+    Candidate hash sizes that take more than (1 + @max_cost_increase) times as long to decode and hash each image as
+    the smallest one are not considered. Of the others, the smallest hash size that groups at most a @max_changed
+    fraction of the sampled images into different duplications than the largest one is picked.
 
+    Returns the hash size, and the hashing time per image, throughput (images/s, decoding included) and number of
+    sampled images assigned to a different duplication than at the next larger size, of each candidate hash size.
+    """
+
+    candidates = sorted(candidates if candidates is not None else TUNE_HASH_SIZES)
+    sample = sorted(random.Random(seed).sample(range(len(img_paths)), min(sample_size, len(img_paths))))
+    batches = {hash_size: [HashBatch(method, hash_size) for method in methods] for hash_size in candidates}
+    hash_times = dict.fromkeys(candidates, 0.0)
+    decode_time = 0.0
+    decoded_count = 0
+    pbar = None
     try:
         if verbose > 0:
             if progress_bar == PROGRESS_BAR_LEVELS[1]:
                 pbar = tqdm(
-                    total=len(img_paths),
-                    desc='Scanning for identical images',
+                    total=len(sample),
+                    desc='Tuning hash size',
                     bar_format='{desc}: {percentage:3.0f}% {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}]',
                     file=sys.stdout, leave=False
                 )
             elif progress_bar == PROGRESS_BAR_LEVELS[2]:
-                pbar = tqdm(total=len(img_paths), desc='Scanning for identical images', file=sys.stdout, leave=False)
+                pbar = tqdm(total=len(sample), desc='Tuning hash size', file=sys.stdout, leave=False)
             elif progress_bar not in PROGRESS_BAR_LEVELS:
                 raise ValueError('Invalid progress bar level')
         if progress_bar == PROGRESS_BAR_LEVELS[0]:
-            print(
-                'Scanning for identical images...', end='\n' if verbose > 1 else '', flush=True
-            )
-        for img_path in img_paths:
+            print('Tuning hash size...', end='', flush=True)
+
+        target_size = tuple(
+            REDUCED_DECODING_GAP * max(dims)
+            for dims in zip(*[hash_target_size(method, candidates[-1]) for method in methods])
+        )
+        for i in sample:
             if pbar is not None:
                 pbar.update()
 
-            if verbose > 1:
-                if progress_bar == PROGRESS_BAR_LEVELS[0]:
-                    print(f'Scanning "{format_path(img_path, output_path_format, root_dir)}"')
-                else:
-                    pbar.write(f'Scanning "{format_path(img_path, output_path_format, root_dir)}"')
-
             im = None
             try:
-                im = Image.open(img_path)
-                im.verify()
-                im = Image.open(img_path)
-
+                start_time = time.perf_counter()
+                im = open_image(img_paths[i], validation)
+                if reduced_decoding and reduce_image(im, target_size):
+                    try:
+                        im.load()
+                    except OSError:
+                        im.close()
+                        im = open_image(img_paths[i], validation)
+                im.load()
                 if im.format == 'PNG' and im.mode != 'RGBA':
                     im = im.convert('RGBA')
+                decode_time += time.perf_counter() - start_time
 
-                image_hash = hash_image(im, method=method, hash_size=hash_size)
-                if image_hash in hashed_images:
-                    hashed_images[image_hash].append(ImageFileWrapper(im, img_path))
-                else:
-                    hashed_images[image_hash] = [ImageFileWrapper(im, img_path)]
-
-                im.close()
-
+                # Conversions are not shared between hash sizes, so that each one is timed with all of its hashing work
+                normalized = {}
+                for hash_size, size_batches in batches.items():
+                    start_time = time.perf_counter()
+                    shared = {}
+                    normalized[hash_size] = [batch.normalize(im, shared) for batch in size_batches]
+                    hash_times[hash_size] += time.perf_counter() - start_time
+                # Images are only added once they are normalized at every hash size, so that all batches keep the same
+                # images if one of them fails
+                for hash_size, size_batches in batches.items():
+                    for batch, image_normalized in zip(size_batches, normalized[hash_size]):
+                        batch.append(image_normalized)
+                decoded_count += 1
             except (
                     ValueError, TypeError,
                     Image.DecompressionBombError,
                     OSError, EOFError, PermissionError,
                     MemoryError
-            ) as error:
-                has_errors = True
-                loop_errprint(
-                    f"Error scanning '{format_path(img_path, output_path_format, root_dir)}': "
-                    f'{error.__str__()}. '
-                    f'File skipped.',
-                    pbar=pbar
-                )
+            ):
+                continue  # Reported when the images are scanned
+            finally:
                 if im is not None:
                     im.close()
-                continue
 
         if pbar is not None:
             pbar.close()
 
-        # Remove hashes with a single path
-        hashed_dups: dict[str, list[ImageFileWrapper]] = {
-            hash_val: dup_imgs for hash_val, dup_imgs in hashed_images.items() if len(dup_imgs) > 1
-        }
+        if decoded_count == 0:
+            hash_size, stats = candidates[0], []
+        else:
+            # Duplications of each method, as the set of sampled images each sampled image is grouped with
+            assignments = {}
+            for hash_size, size_batches in batches.items():
+                start_time = time.perf_counter()
+                method_hashes = [batch.hash() for batch in size_batches]
+                hash_times[hash_size] += time.perf_counter() - start_time
+                assignments[hash_size] = []
+                for image_hashes in method_hashes:
+                    groups = _group_digests(b''.join(fold_hash(image_hash) for image_hash in image_hashes))
+                    group_sets = [frozenset(group.tolist()) for group in groups]
+                    assignments[hash_size].append({i: group for group in group_sets for i in group})
+
+            def changed_count(size: int, other_size: int) -> int:
+                return sum(
+                    1 for size_groups, other_groups in zip(assignments[size], assignments[other_size])
+                    for i in range(decoded_count) if size_groups.get(i) != other_groups.get(i)
+                )
 
-        # Sort duplications in order of decreasing resolution (width * height) so that the highest resolution image is
-        # kept during cleaning step
-        image_hashes = list(hashed_dups.keys())
-        for i in range(len(image_hashes)):
-            hashed_dups[image_hashes[i]] = sorted(
-                hashed_dups[image_hashes[i]],
-                key=lambda img: img.image.size[0] * img.image.size[1],
-                reverse=True
+            stats = [
+                {
+                    'hash_size': hash_size,
+                    'hash_time': hash_times[hash_size] / decoded_count,
+                    'images_per_sec': decoded_count / max(decode_time + hash_times[hash_size], 1e-9),
+                    'changed': changed_count(hash_size, next_size) if next_size is not None else None
+                }
+                for hash_size, next_size in zip(candidates, candidates[1:] + [None])
+            ]
+
+            max_cost = (1 + max_cost_increase) * (decode_time + hash_times[candidates[0]])
+            affordable = candidates[:1] + [
+                hash_size for hash_size in candidates[1:] if decode_time + hash_times[hash_size] <= max_cost
+            ]
+            hash_size = next(
+                size for size in affordable
+                if changed_count(size, affordable[-1]) <= max_changed * decoded_count
             )
 
         if verbose > 0:
             print(
-                f'{"Scanning for identical images..." if progress_bar != PROGRESS_BAR_LEVELS[0] else ""}'
-                f'{"" if (progress_bar == PROGRESS_BAR_LEVELS[0]) and (verbose > 1 or has_errors) else " "}'
-                f'Found {colored(str(len(hashed_dups.values())), attrs=["bold"])} duplication(s) '
-                f'across {colored(str(sum(len(lst) for lst in hashed_dups.values())), attrs=["bold"])} file(s) '
+                f'{"Tuning hash size..." if progress_bar != PROGRESS_BAR_LEVELS[0] else ""} '
+                f'Tuned hash size: {colored(str(hash_size), attrs=["bold"])} '
+                f'(sampled {colored(str(decoded_count), attrs=["bold"])} image(s)) '
                 f'{colored("[DONE]", color="green", attrs=["bold"])}',
                 flush=True
             )
+            if verbose > 1:
+                for stat in stats:
+                    print(
+                        f'  hash size {stat["hash_size"]:>4}: {stat["hash_time"] * 1000:8.2f}ms hashing per image, '
+                        f'{stat["images_per_sec"]:8.1f} images/s'
+                        + (
+                            f', {stat["changed"]} image(s) grouped differently at the next size'
+                            if stat['changed'] is not None else ''
+                        ),
+                        flush=True
+                    )
 
-        return hashed_dups
+        return hash_size, stats
 
     except KeyboardInterrupt:
         if pbar is not None:
             pbar.close()
         exit()
+
+
+def detect_dup_images(img_paths: Iterable[str | os.DirEntry], method: HashingMethod, **kwargs) -> DupResults:
+    """
+    Hashes images and groups them into duplications, see detect_dup_images_methods().
+    """
+
+    return detect_dup_images_methods(img_paths, [method], **kwargs)[method]
+
+
+def _scan_progress_bar(total: int | None, verbose: int, progress_bar: int) -> tqdm | None:
+    pbar = None
+    if verbose > 0:
+        if progress_bar == PROGRESS_BAR_LEVELS[1]:
+            pbar = tqdm(
+                total=total,
+                desc='Scanning for identical images',
+                bar_format='{desc}: {percentage:3.0f}% {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}]'
+                if total is not None else '{desc}: {n_fmt} [{elapsed}, {rate_fmt}]',
+                file=sys.stdout, leave=False
+            )
+        elif progress_bar == PROGRESS_BAR_LEVELS[2]:
+            pbar = tqdm(total=total, desc='Scanning for identical images', file=sys.stdout, leave=False)
+        elif progress_bar not in PROGRESS_BAR_LEVELS:
+            raise ValueError('Invalid progress bar level')
+    if progress_bar == PROGRESS_BAR_LEVELS[0]:
+        print(
+            'Scanning for identical images...', end='\n' if verbose > 1 else '', flush=True
+        )
+    return pbar
+
+
+def _print_scan_summary(
+        summary: str,
+        verbose: int,
+        progress_bar: int,
+        has_errors: bool
+) -> None:
+    print(
+        f'{"Scanning for identical images..." if progress_bar != PROGRESS_BAR_LEVELS[0] else ""}'
+        f'{"" if (progress_bar == PROGRESS_BAR_LEVELS[0]) and (verbose > 1 or has_errors) else " "}'
+        f'{summary + " " if summary else ""}'
+        f'{colored("[DONE]", color="green", attrs=["bold"])}',
+        flush=True
+    )
+
+
+def _print_dups_summary(
+        method_dups: dict[HashingMethod, DupResults],
+        identical_filter: IdenticalFileFilter | None,
+        verbose: int,
+        progress_bar: int,
+        has_errors: bool
+) -> None:
+    found = [
+        f'{f"{method.value}: " if len(method_dups) > 1 else ""}'
+        f'Found {colored(str(len(hashed_dups)), attrs=["bold"])} duplication(s) '
+        f'across {colored(str(hashed_dups.file_count), attrs=["bold"])} file(s)'
+        for method, hashed_dups in method_dups.items()
+    ]
+    _print_scan_summary(found[0] if len(found) == 1 else '', verbose, progress_bar, has_errors)
+    if len(found) > 1:
+        print('\n'.join(found), flush=True)
+    if identical_filter is not None:
+        print(
+            f'Decoded {colored(str(identical_filter.identical_count), attrs=["bold"])} byte-identical file(s) '
+            f'and {colored(str(identical_filter.hardlink_count), attrs=["bold"])} hardlink(s) only once',
+            flush=True
+        )
+
+
+def _close_runs(scanned_images: list[DupResults | DupRuns]) -> None:
+    # Runs on disk are only handed over once every image is hashed
+    for method_images in scanned_images:
+        if isinstance(method_images, DupRuns):
+            method_images.close()
+
+
+class _MethodsScan:
+    """
+    Scanning state of detect_dup_images_methods(): hashes images one by one as they are added, from the hash cache, the
+    result of a byte-identical image (see IdenticalFileFilter), or chunks of images submitted to the hashing workers,
+    and records their results into @scanned_images (one per method) in input order.
+
+    Chunks start small for a short time to first result, and grow up to @max_chunk_size images to reduce inter-process
+    overhead and to hash more images at once. Without an @executor, chunks are hashed in the current process.
+    """
+
+    def __init__(
+            self,
+            methods: list[HashingMethod],
+            scanned_images: list[DupResults | DupRuns],
+            hash_size: int,
+            hash_worker: functools.partial,
+            executor: ProcessPoolExecutor | None,
+            jobs: int,
+            max_chunk_size: int,
+            cache: HashCache | None,
+            identical_filter: IdenticalFileFilter | None,
+            validation: ValidationPolicy,
+            verified: set[str] | None,
+            keep_hashes: bool,
+            reduced_decoding: bool,
+            profiler: Profiler,
+            pbar: tqdm | None,
+            verbose: int,
+            progress_bar: int,
+            output_path_format: PathFormat,
+            root_dir: str | None
+    ):
+        self.methods = methods
+        self.scanned_images = scanned_images
+        self.hash_size = hash_size
+        self.hash_worker = hash_worker
+        self.executor = executor
+        self.jobs = jobs
+        self.max_chunk_size = max_chunk_size
+        self.cache = cache
+        self.identical_filter = identical_filter
+        self.validation = validation
+        self.verified = verified
+        self.keep_hashes = keep_hashes
+        self.reduced_decoding = reduced_decoding
+        self.profiler = profiler
+        self.pbar = pbar
+        self.verbose = verbose
+        self.progress_bar = progress_bar
+        self.output_path_format = output_path_format
+        self.root_dir = root_dir
+        self.has_errors = False
+
+        # Images wait here in input order until their results are available, so that the output is the same regardless
+        # of the number of jobs. Each one has either its (cached) result, the path of the byte-identical image whose
+        # result it reuses, or None while it is being hashed by the workers.
+        self.pending: deque[tuple[str, os.stat_result | None, MethodsHashResult | str | None, bool]] = deque()
+        self.in_flight: deque[Future] = deque()
+        self.worker_results: deque[tuple[MethodsHashResult, FileTimings | None]] = deque()
+        self.chunk: list[str] = []
+        self.chunk_size = 1
+        self.chunk_validation = validation
+        self.rep_entries: dict[str, int] = {}  # Scanned image entry (or -1 - rep_errors index) identical files reuse
+        self.rep_errors: list[tuple[str, bool]] = []
+
+    def lookup_cache(self, img_path: str, st: os.stat_result) -> MethodsHashResult | None:
+        # An image is only decoded again if any of the methods misses the cache, in which case it is hashed with all
+        cached_hashes = []
+        for method in self.methods:
+            cached_hash = self.cache.get_hash(
+                img_path, st, method, self.hash_size,
+                full_hash=self.keep_hashes, reduced_decoding=self.reduced_decoding, validation=self.validation
+            )
+            if cached_hash is None:
+                break
+            cached_hashes.append(cached_hash)
+        else:
+            _, _, size, file_format = cached_hashes[0]
+            return (
+                [cached_hash[0] for cached_hash in cached_hashes],
+                [cached_hash[1] for cached_hash in cached_hashes],
+                size, file_format, None, False
+            )
+        cached_error = self.cache.get_error(img_path, st, self.validation)
+        if cached_error is not None:
+            return None, None, None, None, cached_error, False
+        return None
+
+    def identical_result(self, rep_path: str) -> tuple[MethodsHashResult, bool]:
+        entry = self.rep_entries[rep_path]
+        if entry < 0:
+            error, is_cached = self.rep_errors[-1 - entry]
+            return (None, None, None, None, error, False), is_cached
+        return (
+            [method_images.digest(entry) for method_images in self.scanned_images],
+            [method_images.hash(entry) for method_images in self.scanned_images],
+            self.scanned_images[0].size(entry), self.scanned_images[0].file_format(entry), None, False
+        ), False
+
+    def add(self, img_path: str | os.DirEntry) -> None:
+        """
+        Adds an image to the scan, dispatching it to the prefilter, the hash cache or the hashing workers, then records
+        the results that are available so far.
+        """
+
+        try:
+            st = img_path.stat() if isinstance(img_path, os.DirEntry) else os.stat(img_path)
+        except OSError:
+            st = None  # Reported by the hashing worker
+        img_path = os.fspath(img_path)
+        if self.cache is not None:
+            img_path = os.path.abspath(img_path)
+
+        rep_path = None
+        if self.identical_filter is not None and st is not None:
+            with self.profiler.stage('prefilter'):
+                rep_path = self.identical_filter.find(img_path, st)
+        cached_result = None
+        if rep_path is None and self.cache is not None and st is not None:
+            with self.profiler.stage('cache lookup'):
+                cached_result = self.lookup_cache(img_path, st)
+        if rep_path is not None:
+            self.pending.append((img_path, st, rep_path, False))
+        elif cached_result is not None:
+            self.pending.append((img_path, st, cached_result, True))
+        else:
+            self.pending.append((img_path, st, None, False))
+            self._add_to_chunk(img_path)
+
+        # Bound the number of images waiting for their results, so that memory usage does not grow with the input
+        self.drain(block=len(self.in_flight) > 2 * self.jobs)
+
+    def _add_to_chunk(self, img_path: str) -> None:
+        # Chunks are decoded with a single validation policy, so already verified images go in chunks of their own
+        img_validation = self.validation
+        if self.verified and self.validation == ValidationPolicy.FULL and os.path.abspath(img_path) in self.verified:
+            img_validation = ValidationPolicy.HEADER
+        if len(self.chunk) > 0 and img_validation != self.chunk_validation:
+            self._submit()
+        self.chunk_validation = img_validation
+        self.chunk.append(img_path)
+        if len(self.chunk) >= self.chunk_size:
+            self._submit()
+            self.chunk_size = min(self.max_chunk_size, self.chunk_size * 2)
+
+    def _submit(self) -> None:
+        if self.executor is None:
+            with self.profiler.stage('hash'):
+                self._collect(self.hash_worker(self.chunk, validation=self.chunk_validation))
+        else:
+            self.in_flight.append(self.executor.submit(self.hash_worker, self.chunk, validation=self.chunk_validation))
+        self.chunk = []
+
+    def _collect(self, output: tuple[list[tuple[MethodsHashResult, FileTimings | None]], BatchTimings]) -> None:
+        results, batch_timings = output
+        self.worker_results.extend(results)
+        for hash_time, batch_size in batch_timings:
+            self.profiler.record_batch('hash', hash_time, batch_size)
+
+    def _worker_result(self) -> MethodsHashResult:
+        img_path, st = self.pending[0][:2]
+        result, timings = self.worker_results.popleft()
+        if timings:
+            self.profiler.record_file(img_path, timings, st.st_size if st is not None else 0)
+        return result
+
+    def drain(self, block: bool) -> None:
+        """
+        Records pending images in input order, for as long as their results are available. @block first waits for the
+        oldest chunk of images submitted to the hashing workers.
+        """
+
+        if block and len(self.in_flight) > 0:
+            self._collect(self.in_flight.popleft().result())
+        while len(self.pending) > 0:
+            img_path, st, source, is_cached = self.pending[0]
+            is_identical = isinstance(source, str)
+            if source is None:
+                if len(self.worker_results) == 0:
+                    if len(self.in_flight) == 0 or not self.in_flight[0].done():
+                        return
+                    self._collect(self.in_flight.popleft().result())
+                result = self._worker_result()
+            elif is_identical:
+                result, is_cached = self.identical_result(source)
+            else:
+                result = source
+            self.pending.popleft()
+            self._record(img_path, st, result, is_cached, is_identical)
+
+    def finish(self) -> None:
+        """
+        Hashes the last chunk of images, and waits until the results of every image are recorded.
+        """
+
+        if len(self.chunk) > 0:
+            self._submit()
+        while len(self.pending) > 0:
+            self.drain(block=True)
+
+    def _record(
+            self, img_path: str, st: os.stat_result | None, result: MethodsHashResult, is_cached: bool, is_identical: bool
+    ) -> None:
+        if self.pbar is not None:
+            self.pbar.update()
+
+        if self.verbose > 1:
+            message = f'Scanning "{format_path(img_path, self.output_path_format, self.root_dir)}"'
+            if self.progress_bar == PROGRESS_BAR_LEVELS[0]:
+                print(message)
+            else:
+                self.pbar.write(message)
+
+        if result[4] is not None:
+            self._record_error(img_path, st, result, is_cached, is_identical)
+        else:
+            self._record_hashes(img_path, st, result, is_cached, is_identical)
+
+    def _record_error(
+            self, img_path: str, st: os.stat_result | None, result: MethodsHashResult, is_cached: bool, is_identical: bool
+    ) -> None:
+        *_, error, error_cacheable = result
+        self.has_errors = True
+        loop_errprint(
+            f"Error scanning '{format_path(img_path, self.output_path_format, self.root_dir)}': "
+            f'{error}. '
+            f'File skipped{" (cached)" if is_cached else ""}.',
+            pbar=self.pbar
+        )
+        if self.cache is not None and error_cacheable and st is not None and not is_identical:
+            self.cache.put_error(img_path, st, error, self.validation)
+        if self.identical_filter is not None and not is_identical:
+            self.rep_entries[img_path] = -1 - len(self.rep_errors)
+            self.rep_errors.append((error, is_cached))
+
+    def _record_hashes(
+            self, img_path: str, st: os.stat_result | None, result: MethodsHashResult, is_cached: bool, is_identical: bool
+    ) -> None:
+        digests, method_hashes, size, file_format, *_ = result
+        is_cacheable = self.cache is not None and not is_cached and st is not None and not is_identical
+        entry = None
+        for method, method_images, digest, image_hash in zip(
+                self.methods, self.scanned_images, digests, method_hashes
+        ):
+            entry = method_images.add(
+                img_path, *size,
+                file_size=st.st_size if st is not None else 0, file_format=file_format,
+                mtime_ns=st.st_mtime_ns if st is not None else 0, digest=digest,
+                image_hash=image_hash if self.keep_hashes else None
+            )
+            if is_cacheable:
+                self.cache.put_hash(
+                    img_path, st, method, self.hash_size, digest, image_hash, size, file_format,
+                    reduced_decoding=self.reduced_decoding, validation=self.validation
+                )
+        if self.identical_filter is not None and not is_identical:
+            self.rep_entries[img_path] = entry
+
+
+def detect_dup_images_methods(
+        img_paths: Iterable[str | os.DirEntry],
+        methods: list[HashingMethod],
+        hash_size: int = DEFAULT_HASH_SIZE,
+        root_dir: str = None,
+        output_path_format: PathFormat = PathFormat.DIR_RELATIVE,
+        verbose: int = 0,
+        progress_bar: int = PROGRESS_BAR_LEVELS[2],
+        cache: HashCache = None,
+        jobs: int = 1,
+        validation: ValidationPolicy = ValidationPolicy.HEADER,
+        prefilter: bool = True,
+        threshold: int = 0,
+        reduced_decoding: bool = False,
+        profiler: Profiler = NULL_PROFILER,
+        group: bool = True,
+        keep_hashes: bool = False,
+        prefetch: int = PREFETCH_DEPTH,
+        prefetch_memory: int = PREFETCH_MEMORY_BUDGET,
+        use_mmap: bool = False,
+        memory_limit: int = 0,
+        tmp_dir: str = None,
+        verified: set[str] = None
+) -> dict[HashingMethod, DupResults | DupRuns]:
+    """
+    Hashes images with each of @methods and groups them into duplications, returning the duplications found by each
+    method. Every image is decoded only once, however many methods it is hashed with. With @group disabled, all the
+    hashed images of each method are returned instead, without grouping them (see group_dups()). With @keep_hashes, the
+    full hash of each image is kept in the results, which is always the case with a @threshold. With @prefetch, every
+    hashing process reads up to @prefetch files ahead of decoding, within its share of @prefetch_memory bytes. With
+    @use_mmap, files are digested by the prefilter and decoded through memory mappings where possible. Images whose
+    absolute path is in @verified have already been verified with ValidationPolicy.FULL in this run (see
+    imutils.calc_hash_size()), so they are decoded with ValidationPolicy.HEADER instead, while their results are still
+    cached under @validation.
+
+    With a @memory_limit (bytes, shared by all methods), the hashed images of each method are spilled to sorted runs on
+    disk (in @tmp_dir) instead, and returned as DupRuns whose grouped() emits the duplications progressively, so that
+    memory usage does not grow with the number of images. The prefilter is disabled, as it keeps track of every file,
+    and @group, @keep_hashes and @threshold are ignored.
+
+    @img_paths may be lazily evaluated (e.g. futils.iter_images()), in which case images are hashed while they are still
+    being indexed. The cached stat() results of os.DirEntry items are reused.
+    """
+
+    # Every image is added to the scanned images of all methods at once, so their entries share the same indices
+    if memory_limit > 0:
+        prefilter, group, keep_hashes, threshold = False, False, False, 0
+        scanned_images = [
+            DupRuns(method, hash_size, reduced_decoding, memory_limit=memory_limit // len(methods), tmp_dir=tmp_dir)
+            for method in methods
+        ]
+    else:
+        keep_hashes = keep_hashes or threshold > 0
+        scanned_images = [
+            DupResults(method, hash_size, reduced_decoding, keep_hashes=keep_hashes) for method in methods
+        ]
+    pbar = None
+    executor = None
+
+    try:
+        # Byte-identical files and hardlinks reuse the result of the first file with the same content
+        identical_filter = IdenticalFileFilter(use_mmap=use_mmap) if prefilter else None
+
+        hash_worker = functools.partial(
+            _hash_image_files,
+            methods=methods, hash_size=hash_size, validation=validation,
+            full_hash=keep_hashes, reduced_decoding=reduced_decoding, profile=profiler.enabled,
+            prefetch=prefetch, prefetch_memory=prefetch_memory // max(jobs, 1), use_mmap=use_mmap
+        )
+        total = len(img_paths) if isinstance(img_paths, Sized) else None
+        if jobs > 1:
+            executor = ProcessPoolExecutor(
+                max_workers=jobs, initializer=set_validation_policy, initargs=(validation,)
+            )
+        max_chunk_size = MAX_JOB_CHUNK_SIZE if total is None else max(1, min(MAX_JOB_CHUNK_SIZE, total // (jobs * 4)))
+
+        pbar = _scan_progress_bar(total, verbose, progress_bar)
+        scan = _MethodsScan(
+            methods, scanned_images, hash_size, hash_worker, executor, jobs, max_chunk_size, cache, identical_filter,
+            validation, verified, keep_hashes, reduced_decoding, profiler, pbar, verbose, progress_bar,
+            output_path_format, root_dir
+        )
+        for img_path in img_paths:
+            scan.add(img_path)
+        with profiler.stage('wait for workers'):
+            scan.finish()
+        if identical_filter is not None:
+            profiler.add_bytes_digested(identical_filter.bytes_read)
+
+        if pbar is not None:
+            pbar.close()
+
+        if not group:
+            if verbose > 0:
+                _print_scan_summary(
+                    f'Hashed {colored(str(scanned_images[0].entry_count), attrs=["bold"])} file(s)',
+                    verbose, progress_bar, scan.has_errors
+                )
+            return dict(zip(methods, scanned_images))
+
+        method_dups = {
+            method: group_dups(method_images, threshold=threshold, profiler=profiler)
+            for method, method_images in zip(methods, scanned_images)
+        }
+        if verbose > 0:
+            _print_dups_summary(method_dups, identical_filter, verbose, progress_bar, scan.has_errors)
+        return method_dups
+
+    except KeyboardInterrupt:
+        if pbar is not None:
+            pbar.close()
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        _close_runs(scanned_images)
+        exit()
+
+    except (Exception,):
+        _close_runs(scanned_images)
+        raise
+
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
@@ -1,42 +1,135 @@
 import os.path
+import stat
 from sys import exit
 import re
 import json
 from PIL import Image
 from termcolor import cprint, colored
 
+from detect_dup_images import hash_image_file
 from utils.globs import PathFormat, format_path
-from utils.imutils import ImageFileWrapper
+from utils.globs import HashingMethod
+from utils.globs import ValidationPolicy
+from utils.globs import DUPFILE_VERSION
+from utils.imutils import open_image
+from utils.results import DupResults
+
+
+class DupfileWriter:
+    """
+    Writes a dupfile progressively, a chunk of duplications at a time (e.g. those emitted by DupRuns.grouped()), so
+    that the whole of the duplications never needs to be in memory at once. The written file is the same as if every
+    duplication had been saved at once by save().
+
+    Writing errors are fatal, as with save().
+    """
+
+    def __init__(
+            self,
+            file: str,
+            method: HashingMethod | None,
+            hash_size: int | None,
+            reduced_decoding: bool = False
+    ):
+        self.file = file
+        self.duplication_count = 0
+        self.file_count = 0
+        try:
+            self._f = open(file, 'wt')
+            header = json.dumps(
+                {
+                    'version': DUPFILE_VERSION,
+                    'hashing_method': method.value if method is not None else None,
+                    'hash_size': hash_size,
+                    'reduced_decoding': reduced_decoding,
+                    'duplications': []
+                },
+                indent=2
+            )
+            self._f.write(header[:-len(']\n}')])
+        except (
+                ValueError,
+                OSError, EOFError, PermissionError,
+                MemoryError
+        ) as error:
+            self._fail(error)
+
+    def _fail(self, error: Exception) -> None:
+        cprint(f"Error writing file '{self.file}': {error.__str__()}\nProgram terminated.", 'red')
+        exit()
+
+    def write(self, dups: DupResults) -> None:
+        try:
+            for cluster_id in range(len(dups)):
+                duplication = {
+                    'hash': dups.cluster_keys[cluster_id].hex(),
+                    'files': [
+                        {
+                            'path': format_path(dups.path(entry), PathFormat.ABSOLUTE),
+                            'width': dups.widths[entry],
+                            'height': dups.heights[entry],
+                            'format': dups.file_format(entry),
+                            'size': dups.file_sizes[entry],
+                            'mtime_ns': dups.mtimes_ns[entry],
+                            'hash': dups.digest(entry).hex()
+                        }
+                        for entry in dups.cluster(cluster_id)
+                    ]
+                }
+                # Indented as a member of the duplications list of the top-level object
+                self._f.write(
+                    f'{"," if self.duplication_count > 0 else ""}\n    '
+                    + json.dumps(duplication, indent=2).replace('\n', '\n    ')
+                )
+                self.duplication_count += 1
+            self.file_count += dups.file_count
+        except (
+                ValueError,
+                OSError, EOFError, PermissionError,
+                MemoryError
+        ) as error:
+            self._fail(error)
+
+    def close(self, verbose: int = 0) -> None:
+        try:
+            self._f.write('\n  ]\n}' if self.duplication_count > 0 else ']\n}')
+            self._f.close()
+        except (
+                ValueError,
+                OSError, EOFError, PermissionError,
+                MemoryError
+        ) as error:
+            self._fail(error)
+
+        if verbose > 0:
+            cprint(f'Output saved to "{self.file}"', 'blue', attrs=['bold'])
 
 
 def save(
-        dups: list[list[ImageFileWrapper]],
+        dups: DupResults,
         file: str,
         verbose: int = 0
 ) -> None:
-    try:
-        f = open(file, 'wt')
-        data = [[format_path(img.path, PathFormat.ABSOLUTE) for img in dup_imgs] for dup_imgs in dups]
-        json.dump(data, f, indent=2)
-        f.close()
-    except (
-            ValueError,
-            OSError, EOFError, PermissionError,
-            MemoryError
-    ) as error:
-        cprint(f"Error writing file '{file}': {error.__str__()}\nProgram terminated.", 'red')
-        exit()
-
-    if verbose > 0:
-        cprint(f'Output saved to "{file}"', 'blue', attrs=['bold'])
+    writer = DupfileWriter(file, dups.method, dups.hash_size, dups.reduced_decoding)
+    writer.write(dups)
+    writer.close(verbose=verbose)
 
 
 def load(
         file: str,
         exclude: str = None,
         verbose: int = 0
-) -> list[list[ImageFileWrapper]]:
-    dups = []
+) -> DupResults:
+    """
+    Loads a dupfile, skipping entries that no longer exist, are excluded, or cannot be read.
+
+    Dupfiles saved by the current version record the image metadata and hash of each entry, which are reused as long as
+    the size and modification time of the file are unchanged. Changed files are rehashed, and skipped if their hash no
+    longer matches. Entries of dupfiles saved by earlier versions (lists of paths only) are all reopened.
+    """
+
+    clusters: list[list[int]] = []
+    cluster_keys: list[bytes] = []
     exclude_pattern = None if exclude is None else re.compile(exclude)
     excluded_count = 0
     has_err = False
@@ -48,10 +141,34 @@ def load(
         f = open(file, 'rt', errors='backslashreplace')
         data = json.load(f)
         f.close()
-        for duplication in data:
+
+        if isinstance(data, dict):
+            if data['version'] > DUPFILE_VERSION:
+                cprint(
+                    f'Error reading file "{file}": '
+                    f'Unsupported dupfile version {data["version"]}\nProgram terminated.',
+                    'red'
+                )
+                exit()
+            images = DupResults(
+                HashingMethod(data['hashing_method']) if data['hashing_method'] is not None else None,
+                data['hash_size'],
+                data['reduced_decoding']
+            )
+            duplications = [
+                (bytes.fromhex(duplication['hash']), duplication['files']) for duplication in data['duplications']
+            ]
+        else:
+            images = DupResults()
+            duplications = [(b'', [{'path': file_path} for file_path in duplication]) for duplication in data]
+
+        for cluster_key, duplication in duplications:
             curr_dups = []
-            for file_path in duplication:
-                if not os.path.exists(file_path):
+            for file_entry in duplication:
+                file_path = file_entry['path']
+                try:
+                    st = os.stat(file_path)
+                except OSError:
                     if not has_err:
                         has_err = True
                         if (verbose == 1) or (verbose > 1 and excluded_count == 0):
@@ -62,7 +179,7 @@ def load(
                             flush=True
                         )
                     continue
-                if not os.path.isfile(file_path):
+                if not stat.S_ISREG(st.st_mode):
                     cprint(
                         f'Error reading file "{file}": '
                         f'"{file_path}" is not a file\nProgram terminated.',
@@ -85,41 +202,71 @@ def load(
                         print(f'Excluded entry: "{file_path}"')
                     continue
 
-                im = None
-                try:
-                    im = Image.open(file_path)
-                    im.verify()
-                    im = Image.open(file_path)
-
-                    if im.format == 'PNG' and im.mode != 'RGBA':
-                        im = im.convert('RGBA')
-
-                    curr_dups.append(ImageFileWrapper(im, file_path))
-
-                    im.close()
-                except (
-                        ValueError, TypeError,
-                        Image.DecompressionBombError,
-                        OSError, EOFError, PermissionError,
-                        MemoryError
-                ) as error:
+                # Unchanged since the scan, so the recorded image metadata is still valid
+                if 'mtime_ns' in file_entry \
+                        and (file_entry['size'], file_entry['mtime_ns']) == (st.st_size, st.st_mtime_ns):
+                    curr_dups.append(images.add(
+                        file_path, file_entry['width'], file_entry['height'],
+                        file_size=st.st_size, file_format=file_entry['format'],
+                        mtime_ns=st.st_mtime_ns, digest=bytes.fromhex(file_entry['hash'])
+                    ))
+                    continue
+
+                if images.method is not None:
+                    digest, _, size, file_format, error, _ = hash_image_file(
+                        file_path, images.method, images.hash_size, ValidationPolicy.HEADER,
+                        full_hash=False, reduced_decoding=images.reduced_decoding
+                    )
+                    if error is None and digest != bytes.fromhex(file_entry['hash']):
+                        if not has_err:
+                            has_err = True
+                            if (verbose == 1) or (verbose > 1 and excluded_count == 0):
+                                print()
+                        if verbose > 0:
+                            print(
+                                f'"{file_path}" has changed since it was scanned, entry skipped.',
+                                flush=True
+                            )
+                        continue
+                else:
+                    digest = None
+                    im = None
+                    try:
+                        im = open_image(file_path, ValidationPolicy.FULL)
+                        size, file_format, error = im.size, im.format, None
+                    except (
+                            ValueError, TypeError,
+                            Image.DecompressionBombError,
+                            OSError, EOFError, PermissionError,
+                            MemoryError
+                    ) as open_error:
+                        size, file_format, error = None, None, open_error.__str__()
+                    finally:
+                        if im is not None:
+                            im.close()
+
+                if error is not None:
                     print(
                         f"Error scanning '{file_path}': "
-                        f'{error.__str__()}. '
+                        f'{error}. '
                         f'File skipped.',
                         flush=True
                     )
-                    if im is not None:
-                        im.close()
                     continue
 
+                curr_dups.append(images.add(
+                    file_path, *size,
+                    file_size=st.st_size, file_format=file_format, mtime_ns=st.st_mtime_ns, digest=digest
+                ))
+
             # Skip all duplication groups with length < 2, which can happen if all files within them are excluded, or
             # are skipped because of error when loading the image file
             if len(curr_dups) > 1:
-                dups.append(curr_dups)
+                clusters.append(curr_dups)
+                cluster_keys.append(cluster_key)
 
     except (
-            ValueError,
+            ValueError, KeyError, TypeError,
             OSError, EOFError, PermissionError,
             MemoryError
     ) as error:
@@ -128,12 +275,7 @@ def load(
 
     # Sort duplications in order of decreasing resolution (width * height) so that the highest resolution image is kept
     # during cleaning step
-    for i in range(len(dups)):
-        dups[i] = sorted(
-            dups[i],
-            key=lambda img: img.image.size[0] * img.image.size[1],
-            reverse=True
-        )
+    dups = images.clustered(cluster_keys, clusters)
 
     if excluded_count == 0 and verbose > 1:
         cprint(f'{"" if has_err else " "}No file(s) excluded. ', 'yellow', end='')
@@ -142,7 +284,7 @@ def load(
         print(
             f'{"" if (verbose > 1) or (verbose > 1 and excluded_count > 0) or (verbose > 0 and has_err) else " "}'
             f'Loaded {colored(str(len(dups)), attrs=["bold"])} duplication(s) '
-            f'across {colored(str(sum(len(lst) for lst in dups)), attrs=["bold"])} file(s) '
+            f'across {colored(str(dups.file_count), attrs=["bold"])} file(s) '
             f'{colored("[DONE]", color="green", attrs=["bold"])}',
             flush=True
         )
@@ -0,0 +1,354 @@
+import os
+import sqlite3
+from urllib.request import pathname2url
+from sys import exit
+from collections.abc import Iterable
+from termcolor import cprint, colored
+
+from utils.globs import PathFormat, format_path
+from utils.globs import HashingMethod
+from utils.globs import INDEX_VERSION
+from utils.results import DupResults
+from utils.hamming import HammingIndex
+
+
+class IndexWriter:
+    """
+    Writes hashed images to a hash index file (SQLite formatted .imidx), which records the path, image metadata, digest
+    and full hash of every image, along with the hashing parameters they were hashed with. Images that are already
+    indexed are replaced.
+
+    Raises ValueError if the existing index file was hashed with other hashing parameters, or saved by a newer version.
+    """
+
+    def __init__(
+            self,
+            file: str,
+            method: HashingMethod,
+            hash_size: int,
+            reduced_decoding: bool = False,
+            overwrite: bool = False
+    ):
+        self.file = file
+        if overwrite and os.path.exists(file):
+            os.remove(file)
+        # The dedup service writes from its request threads, one at a time
+        self._conn = sqlite3.connect(file, check_same_thread=False)
+        try:
+            self._conn.executescript(
+                '''
+                CREATE TABLE IF NOT EXISTS meta (
+                    version INTEGER NOT NULL,
+                    hashing_method TEXT NOT NULL,
+                    hash_size INTEGER NOT NULL,
+                    reduced_decoding INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS images (
+                    path TEXT PRIMARY KEY,
+                    width INTEGER NOT NULL,
+                    height INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    format TEXT,
+                    mtime_ns INTEGER NOT NULL,
+                    digest BLOB NOT NULL,
+                    hash BLOB
+                );
+                CREATE INDEX IF NOT EXISTS images_digest ON images (digest);
+                '''
+            )
+            row = self._conn.execute(
+                'SELECT version, hashing_method, hash_size, reduced_decoding FROM meta'
+            ).fetchone()
+            if row is None:
+                self._conn.execute(
+                    'INSERT INTO meta VALUES (?, ?, ?, ?)', (INDEX_VERSION, method.value, hash_size, reduced_decoding)
+                )
+                self._conn.commit()
+            elif row[0] > INDEX_VERSION:
+                raise ValueError(f'Unsupported index version {row[0]}')
+            elif (row[1], row[2], bool(row[3])) != (method.value, hash_size, reduced_decoding):
+                raise ValueError(
+                    f'Index was hashed with {row[1]} at hash size {row[2]}'
+                    f'{" with reduced-resolution decoding" if row[3] else ""}'
+                )
+        except (ValueError, sqlite3.Error):
+            self._conn.close()
+            raise
+
+    def put(
+            self,
+            path: str,
+            width: int,
+            height: int,
+            file_size: int,
+            file_format: str | None,
+            mtime_ns: int,
+            digest: bytes,
+            image_hash: bytes | None
+    ) -> None:
+        self._conn.execute(
+            'INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (path, width, height, file_size, file_format, mtime_ns, digest, image_hash)
+        )
+
+    def put_results(self, images: DupResults, entries: Iterable[int] = None) -> None:
+        """
+        Writes the @entries of @images (all of them if None), with absolute paths.
+        """
+
+        for entry in entries if entries is not None else range(images.entry_count):
+            self.put(
+                format_path(images.path(entry), PathFormat.ABSOLUTE), *images.size(entry),
+                file_size=images.file_sizes[entry], file_format=images.file_format(entry),
+                mtime_ns=images.mtimes_ns[entry], digest=images.digest(entry), image_hash=images.hash(entry)
+            )
+
+    def commit(self) -> None:
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.commit()
+        self._conn.close()
+
+
+def _connect_read_only(file: str) -> tuple[sqlite3.Connection, tuple[HashingMethod, int, bool]]:
+    """
+    Opens a hash index file read-only, so that a mistyped path does not create an empty index, and returns the
+    connection along with the hashing parameters of the index (hashing method, hash size and reduced decoding).
+    """
+
+    if not os.path.isfile(file):
+        raise FileNotFoundError(f'No such file: \'{file}\'')
+    conn = sqlite3.connect(f'file:{pathname2url(os.path.abspath(file))}?mode=ro', uri=True)
+    try:
+        row = conn.execute('SELECT version, hashing_method, hash_size, reduced_decoding FROM meta').fetchone()
+        if row is None:
+            raise ValueError('Missing index metadata')
+        if row[0] > INDEX_VERSION:
+            raise ValueError(f'Unsupported index version {row[0]}')
+        return conn, (HashingMethod(row[1]), row[2], bool(row[3]))
+    except (ValueError, sqlite3.Error):
+        conn.close()
+        raise
+
+
+def _add_rows(images: DupResults, rows: Iterable[tuple]) -> None:
+    for path, width, height, file_size, file_format, mtime_ns, digest, image_hash in rows:
+        images.add(
+            path, width, height,
+            file_size=file_size, file_format=file_format, mtime_ns=mtime_ns, digest=digest, image_hash=image_hash
+        )
+
+
+def save(
+        images: DupResults,
+        file: str,
+        verbose: int = 0
+) -> None:
+    """
+    Saves every hashed image of @images (see detect_dup_images_methods() with grouping disabled) to a hash index file,
+    overwriting it if it already exists.
+    """
+
+    try:
+        writer = IndexWriter(file, images.method, images.hash_size, images.reduced_decoding, overwrite=True)
+        writer.put_results(images)
+        writer.close()
+    except (
+            ValueError, sqlite3.Error,
+            OSError, EOFError, PermissionError,
+            MemoryError
+    ) as error:
+        cprint(f"Error writing file '{file}': {error.__str__()}\nProgram terminated.", 'red')
+        exit()
+
+    if verbose > 0:
+        cprint(f'Index saved to "{file}"', 'blue', attrs=['bold'])
+
+
+def load(
+        file: str,
+        verbose: int = 0
+) -> DupResults:
+    """
+    Loads every image of a hash index file, with their full hashes, without checking whether they still exist.
+    """
+
+    if verbose > 0:
+        print(f'Reading "{file}"...', end='', flush=True)
+
+    try:
+        conn, hashing_params = _connect_read_only(file)
+        try:
+            images = DupResults(*hashing_params, keep_hashes=True)
+            _add_rows(images, conn.execute(
+                'SELECT path, width, height, size, format, mtime_ns, digest, hash FROM images ORDER BY rowid'
+            ))
+        finally:
+            conn.close()
+    except (
+            ValueError, sqlite3.Error,
+            OSError, EOFError, PermissionError,
+            MemoryError
+    ) as error:
+        if verbose > 0:
+            print()
+        cprint(f"Error reading file '{file}': {error.__str__()}\nProgram terminated.", 'red')
+        exit()
+
+    if verbose > 0:
+        print(
+            f' Loaded {colored(str(images.entry_count), attrs=["bold"])} image(s) '
+            f'{colored("[DONE]", color="green", attrs=["bold"])}',
+            flush=True
+        )
+
+    return images
+
+
+def merge(
+        files: list[str],
+        verbose: int = 0
+) -> DupResults:
+    """
+    Loads several hash index files hashed with the same hashing parameters (e.g. the indexes saved by each shard of a
+    sharded scan) into one, without rehashing any image. Images are ordered by path, so that merged results do not
+    depend on the order of @files, and images indexed by several files are only kept once.
+    """
+
+    merged_images = None
+    indexed: dict[str, tuple[DupResults, int]] = {}
+    for file in files:
+        images = load(file, verbose=verbose)
+        if merged_images is None:
+            merged_images = DupResults(images.method, images.hash_size, images.reduced_decoding, keep_hashes=True)
+        elif (images.method, images.hash_size, images.reduced_decoding) != (
+                merged_images.method, merged_images.hash_size, merged_images.reduced_decoding
+        ):
+            cprint(
+                f'Error reading file "{file}": '
+                f'Hashed with other hashing parameters (method, hash size or reduced-resolution decoding) '
+                f'than "{files[0]}"\nProgram terminated.',
+                'red'
+            )
+            exit()
+        for entry in range(images.entry_count):
+            indexed.setdefault(images.path(entry), (images, entry))
+
+    for path in sorted(indexed):
+        images, entry = indexed[path]
+        merged_images.add(
+            path, *images.size(entry),
+            file_size=images.file_sizes[entry], file_format=images.file_format(entry),
+            mtime_ns=images.mtimes_ns[entry], digest=images.digest(entry), image_hash=images.hash(entry)
+        )
+
+    if verbose > 0 and len(files) > 1:
+        print(
+            f'Merged {colored(str(merged_images.entry_count), attrs=["bold"])} image(s) '
+            f'from {colored(str(len(files)), attrs=["bold"])} index(es) '
+            f'{colored("[DONE]", color="green", attrs=["bold"])}',
+            flush=True
+        )
+
+    return merged_images
+
+
+def read_hashing_params(file: str) -> tuple[HashingMethod, int, bool]:
+    """
+    Returns the hashing method, hash size and whether reduced-resolution decoding was used of a hash index file.
+    """
+
+    try:
+        conn, hashing_params = _connect_read_only(file)
+        conn.close()
+    except (
+            ValueError, sqlite3.Error,
+            OSError, EOFError, PermissionError,
+            MemoryError
+    ) as error:
+        cprint(f"Error reading file '{file}': {error.__str__()}\nProgram terminated.", 'red')
+        exit()
+    return hashing_params
+
+
+def add_matches(
+        file: str,
+        images: DupResults,
+        threshold: int = 0,
+        verbose: int = 0
+) -> int:
+    """
+    Adds to @images (see detect_dup_images_methods() with grouping disabled) the images of a hash index file, hashed
+    with the same hashing parameters, that are duplicates of any of them, so that grouping @images also groups them
+    with the indexed images they duplicate. Indexed images are neither opened nor checked for existence, and images of
+    @images that are also indexed are only kept once. Returns the number of added images.
+
+    Without a @threshold, only the indexed images with the same digests as @images are read, through the digest index
+    of the file, so that the cost depends on the number of @images rather than on the size of the index. With a
+    @threshold, every full hash of the index is compared to a HammingIndex of the (few) full hashes of @images instead,
+    which only reads the hash column of the index.
+    """
+
+    if verbose > 0:
+        print(f'Matching against "{file}"...', end='', flush=True)
+
+    columns = 'path, width, height, size, format, mtime_ns, digest, hash'
+    chunk_size = 500  # Below the limit of 999 host parameters of older SQLite versions
+
+    def fetch_rows(conn: sqlite3.Connection, column: str, values: list) -> list[tuple]:
+        rows = []
+        for i in range(0, len(values), chunk_size):
+            chunk = values[i:i + chunk_size]
+            rows += conn.execute(
+                f'SELECT rowid, {columns} FROM images WHERE {column} IN ({", ".join("?" * len(chunk))})', chunk
+            ).fetchall()
+        return sorted(rows)
+
+    scanned_paths = {os.path.abspath(images.path(entry)) for entry in range(images.entry_count)}
+    try:
+        conn, hashing_params = _connect_read_only(file)
+        try:
+            if hashing_params != (images.method, images.hash_size, images.reduced_decoding):
+                raise ValueError(
+                    f'Index was hashed with {hashing_params[0].value} at hash size {hashing_params[1]}'
+                    f'{" with reduced-resolution decoding" if hashing_params[2] else ""}'
+                )
+            if images.entry_count == 0:
+                rows = []
+            elif threshold == 0:
+                rows = fetch_rows(
+                    conn, 'digest', list(dict.fromkeys(images.digest(entry) for entry in range(images.entry_count)))
+                )
+            else:
+                hamming = HammingIndex(len(images.hash(0)) * 8, threshold)
+                for entry in range(images.entry_count):
+                    hamming.add(int.from_bytes(images.hash(entry), 'big'))
+                rows = fetch_rows(conn, 'rowid', [
+                    row_id for row_id, image_hash in conn.execute('SELECT rowid, hash FROM images')
+                    if image_hash is not None and len(hamming.query(int.from_bytes(image_hash, 'big'))) > 0
+                ])
+        finally:
+            conn.close()
+    except (
+            ValueError, sqlite3.Error,
+            OSError, EOFError, PermissionError,
+            MemoryError
+    ) as error:
+        if verbose > 0:
+            print()
+        cprint(f"Error reading file '{file}': {error.__str__()}\nProgram terminated.", 'red')
+        exit()
+
+    added_count = images.entry_count
+    _add_rows(images, (row[1:] for row in rows if row[1] not in scanned_paths))
+    added_count = images.entry_count - added_count
+
+    if verbose > 0:
+        print(
+            f' Matched {colored(str(added_count), attrs=["bold"])} reference image(s) '
+            f'{colored("[DONE]", color="green", attrs=["bold"])}',
+            flush=True
+        )
+
+    return added_count
@@ -3,188 +3,819 @@ from _version import __prog_usage__, __prog_desc__, __prog_epilog__
 from _version import __info_usage__, __info_desc__, __info_epilog__
 from _version import __scan_usage__, __scan_desc__, __scan_epilog__
 from _version import __clean_usage__, __clean_desc__, __clean_epilog__
+from _version import __watch_usage__, __watch_desc__, __watch_epilog__
+from _version import __serve_usage__, __serve_desc__, __serve_epilog__
+from _version import __merge_usage__, __merge_desc__, __merge_epilog__
 
 import os
 import sys
 from sys import exit
 import traceback
 import argparse
-from termcolor import cprint
+import multiprocessing
+from collections.abc import Iterable
+from termcolor import cprint, colored
 from PIL import Image
 
 import dupfile
-from detect_dup_images import detect_dup_images
-from utils.futils import index_images, clean
-from utils.imutils import report_info, calc_hash_size
-from utils.imutils import ImageFileWrapper
+import hashindex
+from detect_dup_images import detect_dup_images_methods, group_dups, tune_hash_size
+from utils.futils import index_images, iter_images, clean, resume_clean, rollback_clean
+from utils.imutils import report_info, calc_hash_size, set_validation_policy
+from utils.results import DupResults
+from utils.extsort import DupRuns
+from utils.cache import HashCache, default_cache_dir
+from utils.profiling import Profiler, NULL_PROFILER
+from utils.watcher import create_watcher
+from watch import DupWatcher
+from service import QueryIndex, create_server, serve
 from utils.output import print_dups
 from utils.globs import PathFormat
 from utils.globs import HashingMethod
 from utils.globs import AutoHashSize
-from utils.globs import DUPFILE_EXT
+from utils.globs import ValidationPolicy
+from utils.globs import CleanAction
+from utils.globs import DUPFILE_EXT, INDEX_EXT, JOURNAL_EXT
+from utils.globs import DEFAULT_INDEX_THREADS, DEFAULT_INFO_JOBS, DEFAULT_CLEAN_THREADS
+from utils.globs import PREFETCH_DEPTH, PREFETCH_MEMORY_BUDGET
+from utils.globs import TUNE_MAX_COST_INCREASE
+from utils.globs import WATCH_POLL_INTERVAL
+from utils.globs import SERVE_PORT
+from utils.globs import CACHE_DIR_NAME, CACHE_FILENAME
 from utils.globs import VERBOSE_LEVELS, PROGRESS_BAR_LEVELS
 
 
-def validate_args(argument_parser: argparse.ArgumentParser) -> argparse.Namespace:
-    arguments = argument_parser.parse_args()
+def validate_serve_args(argument_parser: argparse.ArgumentParser, arguments: argparse.Namespace) -> None:
+    if arguments.threshold < 0:
+        argument_parser.error(
+            f'invalid Hamming distance threshold {arguments.threshold}, '
+            f'see "{argument_parser.prog} serve --help" for more info'
+        )
+    if not 0 <= arguments.port <= 65535:
+        argument_parser.error(
+            f'invalid port {arguments.port}, '
+            f'see "{argument_parser.prog} serve --help" for more info'
+        )
+    if not os.path.isfile(arguments.index):
+        argument_parser.error(f'invalid path "{arguments.index}"')
+    if arguments.index.split('.')[-1].lower() != INDEX_EXT:
+        ext = arguments.index.split('.')[-1]
+        argument_parser.error(
+            f'index "{arguments.index}": invalid extension ".{ext}" (must be ".{INDEX_EXT}"), '
+            f'see "{argument_parser.prog} serve --help" for more info'
+        )
 
-    if arguments.mode in ['scan', 'clean']:
-        if arguments.hash_size is not None and arguments.hash_size < 8:
+
+def validate_merge_args(argument_parser: argparse.ArgumentParser, arguments: argparse.Namespace) -> None:
+    if arguments.threshold < 0:
+        argument_parser.error(
+            f'invalid Hamming distance threshold {arguments.threshold}, '
+            f'see "{argument_parser.prog} merge --help" for more info'
+        )
+    if arguments.silent and arguments.output is None and arguments.save_index is None:
+        argument_parser.error(
+            f'merge mode -S/--silent flag requires -o/--output or --save-index to be specified, '
+            f'see "{argument_parser.prog} merge --help" for more info'
+        )
+    for index in arguments.indexes:
+        if not os.path.isfile(index):
+            argument_parser.error(f'invalid path "{index}"')
+        if index.split('.')[-1].lower() != INDEX_EXT:
+            ext = index.split('.')[-1]
             argument_parser.error(
-                f'hash size of {arguments.hash_size} is too small, '
-                f'see "{argument_parser.prog} {{scan,clean}} --help" for more info'
+                f'index "{index}": invalid extension ".{ext}" (must be ".{INDEX_EXT}"), '
+                f'see "{argument_parser.prog} merge --help" for more info'
             )
-        if (arguments.verbose == 0) and any(argv.startswith(('-p', '--progress-bar')) for argv in sys.argv[1:]):
+    if arguments.output is not None and arguments.output.split('.')[-1].lower() != DUPFILE_EXT:
+        ext = arguments.output.split('.')[-1]
+        argument_parser.error(
+            f'output "{arguments.output}": invalid extension ".{ext}" (must be ".{DUPFILE_EXT}"), '
+            f'see "{argument_parser.prog} merge --help" for more info'
+        )
+    if arguments.save_index is not None and arguments.save_index.split('.')[-1].lower() != INDEX_EXT:
+        ext = arguments.save_index.split('.')[-1]
+        argument_parser.error(
+            f'index "{arguments.save_index}": invalid extension ".{ext}" (must be ".{INDEX_EXT}"), '
+            f'see "{argument_parser.prog} merge --help" for more info'
+        )
+
+
+def validate_jobs_args(argument_parser: argparse.ArgumentParser, arguments: argparse.Namespace) -> None:
+    if arguments.index_threads < 1:
+        argument_parser.error(
+            f'invalid number of index threads {arguments.index_threads}, '
+            f'see "{argument_parser.prog} {arguments.mode} --help" for more info'
+        )
+    if arguments.mode in ['scan', 'clean', 'watch'] and (arguments.prefetch < 0 or arguments.prefetch_memory < 0):
+        argument_parser.error(
+            f'invalid read-ahead depth {arguments.prefetch} or memory {arguments.prefetch_memory}, '
+            f'see "{argument_parser.prog} {arguments.mode} --help" for more info'
+        )
+    if arguments.jobs < 0:
+        argument_parser.error(
+            f'invalid number of jobs {arguments.jobs}, '
+            f'see "{argument_parser.prog} {arguments.mode} --help" for more info'
+        )
+
+
+def validate_hashing_args(argument_parser: argparse.ArgumentParser, arguments: argparse.Namespace) -> None:
+    arguments.hashing_methods = []
+    for method in arguments.hashing_method.split(','):
+        if method not in [m.value for m in HashingMethod]:
             argument_parser.error(
-                f'-p/--progress-bar flag requires -V/--verbose to be specified, '
+                f'invalid hashing method "{method}" (choose from {", ".join(m.value for m in HashingMethod)}), '
                 f'see "{argument_parser.prog} {{scan,clean}} --help" for more info'
             )
+        if HashingMethod(method) not in arguments.hashing_methods:
+            arguments.hashing_methods.append(HashingMethod(method))
+    if arguments.mode in ['clean', 'watch'] and len(arguments.hashing_methods) > 1:
+        argument_parser.error(
+            f'{arguments.mode} mode does not support more than one hashing method, '
+            f'see "{argument_parser.prog} {arguments.mode} --help" for more info'
+        )
+    if arguments.hash_size is not None and arguments.hash_size < 8:
+        argument_parser.error(
+            f'hash size of {arguments.hash_size} is too small, '
+            f'see "{argument_parser.prog} {{scan,clean}} --help" for more info'
+        )
+    if arguments.threshold < 0:
+        argument_parser.error(
+            f'invalid Hamming distance threshold {arguments.threshold}, '
+            f'see "{argument_parser.prog} {{scan,clean}} --help" for more info'
+        )
+    if (arguments.verbose == 0) and any(argv.startswith(('-p', '--progress-bar')) for argv in sys.argv[1:]):
+        argument_parser.error(
+            f'-p/--progress-bar flag requires -V/--verbose to be specified, '
+            f'see "{argument_parser.prog} {{scan,clean}} --help" for more info'
+        )
 
-        if arguments.mode == 'scan':
-            if arguments.silent and arguments.output is None:
-                argument_parser.error(
-                    f'scan mode -S/--silent flag requires -o/--output to be specified, '
-                    f'see "{argument_parser.prog} scan --help" for more info'
-                )
 
-            if not os.path.exists(arguments.directory):
-                argument_parser.error(f'invalid path "{arguments.directory}"')
-            if not os.path.isdir(arguments.directory):
-                argument_parser.error(f'"{arguments.directory}" is not a directory')
-            if len(os.listdir(arguments.directory)) == 0:
-                cprint(f'"{arguments.directory}" is empty. Program terminated.', 'red')
-                exit()
+def validate_shard_args(argument_parser: argparse.ArgumentParser, arguments: argparse.Namespace) -> None:
+    shard, _, shard_count = arguments.shard.partition('/')
+    if not (shard.isdigit() and shard_count.isdigit() and 1 <= int(shard) <= int(shard_count)):
+        argument_parser.error(
+            f'invalid shard "{arguments.shard}" (must be I/N, with 1 <= I <= N), '
+            f'see "{argument_parser.prog} scan --help" for more info'
+        )
+    if arguments.hash_size is None:
+        argument_parser.error(
+            f'scan mode --shard flag requires -s/--hash-size to be specified, so that every shard is '
+            f'hashed at the same hash size, see "{argument_parser.prog} scan --help" for more info'
+        )
+    if arguments.save_index is None:
+        argument_parser.error(
+            f'scan mode --shard flag requires --save-index to be specified, '
+            f'see "{argument_parser.prog} scan --help" for more info'
+        )
+    # Shards are numbered from 1 on the command line, and from 0 internally
+    arguments.shard = (int(shard) - 1, int(shard_count))
+
 
-            if arguments.output is not None and arguments.output.split('.')[-1].lower() != DUPFILE_EXT:
-                ext = arguments.output.split('.')[-1]
+def validate_memory_limit_args(argument_parser: argparse.ArgumentParser, arguments: argparse.Namespace) -> None:
+    if arguments.memory_limit < 0:
+        argument_parser.error(
+            f'invalid memory limit {arguments.memory_limit}, '
+            f'see "{argument_parser.prog} scan --help" for more info'
+        )
+    if arguments.memory_limit > 0:
+        if arguments.hash_size is None:
+            argument_parser.error(
+                f'scan mode --memory-limit flag requires -s/--hash-size to be specified, so that images are '
+                f'streamed instead of listed, see "{argument_parser.prog} scan --help" for more info'
+            )
+        for flag in (('-t', '--threshold'), ('--save-index',), ('--reference',)):
+            if any(argv.startswith(flag) for argv in sys.argv[1:]):
                 argument_parser.error(
-                    f'output "{arguments.output}": invalid extension ".{ext}" (must be ".{DUPFILE_EXT}"), '
+                    f'scan mode --memory-limit flag does not support {"/".join(flag)} flag, '
                     f'see "{argument_parser.prog} scan --help" for more info'
                 )
+    if arguments.tmp_dir is not None and not os.path.isdir(arguments.tmp_dir):
+        argument_parser.error(f'invalid path "{arguments.tmp_dir}"')
 
-        if arguments.mode == 'clean':
-            if not os.path.exists(arguments.input):
-                argument_parser.error(f'invalid path "{arguments.input}"')
-            if os.path.isfile(arguments.input) and arguments.recursive:
-                argument_parser.error('cleaning from dupfile does not support -r/--recursive flag')
-            if os.path.isfile(arguments.input) and any(argv.startswith(('-f', '--format')) for argv in sys.argv[1:]):
-                argument_parser.error('cleaning from dupfile does not support -f/--format flag')
-            if os.path.isfile(arguments.input) and any(argv.startswith(('-s', '--hash-size')) for argv in sys.argv[1:]):
-                argument_parser.error('cleaning from dupfile does not support -s/--hash-size flag')
-            if os.path.isfile(arguments.input) \
-                    and any(argv.startswith(('-p', '--progress-bar')) for argv in sys.argv[1:]):
-                argument_parser.error('cleaning from dupfile does not support -p/--progress-bar flag')
-            if os.path.isfile(arguments.input) and arguments.input.split('.')[-1].lower() != DUPFILE_EXT:
-                ext = arguments.input.split('.')[-1]
-                cprint(
-                    f'"{arguments.input}": Invalid input file type ".{ext}". '
-                    f'Program terminated.', 'red'
-                )
-                exit()
-            if os.path.isdir(arguments.input) and len(os.listdir(arguments.input)) == 0:
-                cprint(f'"{arguments.input}" is empty. Program terminated.', 'red')
-                exit()
+
+def validate_reference_args(argument_parser: argparse.ArgumentParser, arguments: argparse.Namespace) -> None:
+    if arguments.reference.split('.')[-1].lower() != INDEX_EXT:
+        ext = arguments.reference.split('.')[-1]
+        argument_parser.error(
+            f'reference "{arguments.reference}": invalid extension ".{ext}" (must be ".{INDEX_EXT}"), '
+            f'see "{argument_parser.prog} scan --help" for more info'
+        )
+    if not os.path.isfile(arguments.reference):
+        argument_parser.error(f'invalid path "{arguments.reference}"')
+    for flag in (
+            ('-m', '--hashing-method'), ('-a', '--auto-hash-size'), ('-s', '--hash-size'),
+            ('--reduced-decoding',)
+    ):
+        if any(argv.startswith(flag) for argv in sys.argv[1:]):
+            argument_parser.error(
+                f'scan mode --reference flag does not support {"/".join(flag)} flag, the hashing '
+                f'parameters of the reference index are used'
+            )
+    if arguments.shard is not None:
+        argument_parser.error('scan mode --reference flag does not support --shard flag')
+    # New images are hashed the same way as the reference images, to compare their digests
+    method, arguments.hash_size, arguments.reduced_decoding = hashindex.read_hashing_params(
+        arguments.reference
+    )
+    arguments.hashing_methods = [method]
+
+
+def validate_directory_args(argument_parser: argparse.ArgumentParser, arguments: argparse.Namespace) -> None:
+    if not os.path.exists(arguments.directory):
+        argument_parser.error(f'invalid path "{arguments.directory}"')
+    if not os.path.isdir(arguments.directory):
+        argument_parser.error(f'"{arguments.directory}" is not a directory')
+
+
+def validate_scan_args(argument_parser: argparse.ArgumentParser, arguments: argparse.Namespace) -> None:
+    if arguments.silent and arguments.output is None and arguments.save_index is None:
+        argument_parser.error(
+            f'scan mode -S/--silent flag requires -o/--output or --save-index to be specified, '
+            f'see "{argument_parser.prog} scan --help" for more info'
+        )
+    if arguments.save_index is not None and arguments.save_index.split('.')[-1].lower() != INDEX_EXT:
+        ext = arguments.save_index.split('.')[-1]
+        argument_parser.error(
+            f'index "{arguments.save_index}": invalid extension ".{ext}" (must be ".{INDEX_EXT}"), '
+            f'see "{argument_parser.prog} scan --help" for more info'
+        )
+    if arguments.shard is not None:
+        validate_shard_args(argument_parser, arguments)
+    validate_memory_limit_args(argument_parser, arguments)
+    if arguments.reference is not None:
+        validate_reference_args(argument_parser, arguments)
+
+    validate_directory_args(argument_parser, arguments)
+    if len(os.listdir(arguments.directory)) == 0:
+        cprint(f'"{arguments.directory}" is empty. Program terminated.', 'red')
+        exit()
+
+    if arguments.output is not None and arguments.output.split('.')[-1].lower() != DUPFILE_EXT:
+        ext = arguments.output.split('.')[-1]
+        argument_parser.error(
+            f'output "{arguments.output}": invalid extension ".{ext}" (must be ".{DUPFILE_EXT}"), '
+            f'see "{argument_parser.prog} scan --help" for more info'
+        )
+
+
+def validate_watch_args(argument_parser: argparse.ArgumentParser, arguments: argparse.Namespace) -> None:
+    if arguments.hash_size is None:
+        argument_parser.error(
+            f'watch mode requires -s/--hash-size to be specified, '
+            f'see "{argument_parser.prog} watch --help" for more info'
+        )
+    if any(argv.startswith(('-a', '--auto-hash-size')) for argv in sys.argv[1:]):
+        argument_parser.error('watch mode does not support -a/--auto-hash-size flag')
+    if arguments.threshold > 0:
+        argument_parser.error('watch mode does not support -t/--threshold flag')
+    if arguments.interactive and not arguments.clean:
+        argument_parser.error(
+            f'watch mode -i/--interactive flag requires --clean to be specified, '
+            f'see "{argument_parser.prog} watch --help" for more info'
+        )
+    if arguments.poll_interval <= 0:
+        argument_parser.error(
+            f'invalid poll interval {arguments.poll_interval}, '
+            f'see "{argument_parser.prog} watch --help" for more info'
+        )
+
+    validate_directory_args(argument_parser, arguments)
+
+
+def validate_clean_input_args(argument_parser: argparse.ArgumentParser, arguments: argparse.Namespace) -> None:
+    if not os.path.exists(arguments.input):
+        argument_parser.error(f'invalid path "{arguments.input}"')
+    if os.path.isfile(arguments.input) and arguments.recursive:
+        argument_parser.error('cleaning from dupfile does not support -r/--recursive flag')
+    if os.path.isfile(arguments.input) and any(argv.startswith(('-f', '--format')) for argv in sys.argv[1:]):
+        argument_parser.error('cleaning from dupfile does not support -f/--format flag')
+    if os.path.isfile(arguments.input) and any(argv.startswith(('-s', '--hash-size')) for argv in sys.argv[1:]):
+        argument_parser.error('cleaning from dupfile does not support -s/--hash-size flag')
+    if os.path.isfile(arguments.input) \
+            and any(argv.startswith(('-p', '--progress-bar')) for argv in sys.argv[1:]):
+        argument_parser.error('cleaning from dupfile does not support -p/--progress-bar flag')
+    if os.path.isfile(arguments.input) \
+            and arguments.input.split('.')[-1].lower() not in [DUPFILE_EXT, JOURNAL_EXT]:
+        ext = arguments.input.split('.')[-1]
+        cprint(
+            f'"{arguments.input}": Invalid input file type ".{ext}". '
+            f'Program terminated.', 'red'
+        )
+        exit()
+    if os.path.isdir(arguments.input) and len(os.listdir(arguments.input)) == 0:
+        cprint(f'"{arguments.input}" is empty. Program terminated.', 'red')
+        exit()
+
+
+def validate_journal_args(argument_parser: argparse.ArgumentParser, arguments: argparse.Namespace) -> None:
+    if arguments.interactive:
+        argument_parser.error('clean mode --journal flag does not support -i/--interactive flag')
+    if arguments.journal.split('.')[-1].lower() != JOURNAL_EXT:
+        ext = arguments.journal.split('.')[-1]
+        argument_parser.error(
+            f'journal "{arguments.journal}": invalid extension ".{ext}" (must be ".{JOURNAL_EXT}"), '
+            f'see "{argument_parser.prog} clean --help" for more info'
+        )
+    if os.path.exists(arguments.journal):
+        argument_parser.error(
+            f'journal "{arguments.journal}" already exists, clean it to resume the interrupted clean, or '
+            f'roll it back with --rollback flag'
+        )
+
+
+def validate_clean_args(argument_parser: argparse.ArgumentParser, arguments: argparse.Namespace) -> None:
+    validate_clean_input_args(argument_parser, arguments)
+
+    if arguments.clean_threads < 1:
+        argument_parser.error(
+            f'invalid number of clean threads {arguments.clean_threads}, '
+            f'see "{argument_parser.prog} clean --help" for more info'
+        )
+    is_journal = os.path.isfile(arguments.input) and arguments.input.split('.')[-1].lower() == JOURNAL_EXT
+    if arguments.rollback and not is_journal:
+        argument_parser.error(
+            f'clean mode --rollback flag requires a .{JOURNAL_EXT} journal input, '
+            f'see "{argument_parser.prog} clean --help" for more info'
+        )
+    if is_journal:
+        for flag in (('--action',), ('--journal',), ('-i', '--interactive'), ('-e', '--exclude')):
+            if any(argv.startswith(flag) for argv in sys.argv[1:]):
+                argument_parser.error(f'resuming a clean from journal does not support {"/".join(flag)} flag')
+    if arguments.interactive and CleanAction(arguments.action) != CleanAction.DELETE:
+        argument_parser.error(
+            f'clean mode -i/--interactive flag only supports "{CleanAction.DELETE.value}" action, '
+            f'see "{argument_parser.prog} clean --help" for more info'
+        )
+    if arguments.journal is not None:
+        validate_journal_args(argument_parser, arguments)
+
+
+def validate_args(argument_parser: argparse.ArgumentParser) -> argparse.Namespace:
+    arguments = argument_parser.parse_args()
+
+    if arguments.mode == 'serve':
+        validate_serve_args(argument_parser, arguments)
+        return arguments
+    if arguments.mode == 'merge':
+        validate_merge_args(argument_parser, arguments)
+        return arguments
+
+    validate_jobs_args(argument_parser, arguments)
+    if arguments.mode in ['scan', 'clean', 'watch']:
+        validate_hashing_args(argument_parser, arguments)
+    if arguments.mode == 'scan':
+        validate_scan_args(argument_parser, arguments)
+    elif arguments.mode == 'watch':
+        validate_watch_args(argument_parser, arguments)
+    elif arguments.mode == 'clean':
+        validate_clean_args(argument_parser, arguments)
 
     return arguments
 
 
-def main(arguments: argparse.Namespace) -> None:
-    def find_dups() -> dict[str, list[ImageFileWrapper]]:
-        directory = arguments.input if arguments.mode == 'clean' else arguments.directory
+def open_cache(arguments: argparse.Namespace) -> HashCache | None:
+    if arguments.no_cache:
+        return None
+    cache_dir = arguments.cache_dir if arguments.cache_dir is not None else default_cache_dir()
+    return HashCache(os.path.join(cache_dir, CACHE_FILENAME), rebuild=arguments.rebuild_cache)
 
-        image_paths = index_images(
-            directory,
-            exclude=arguments.exclude,
-            recursive=arguments.recursive,
+
+def method_output_path(output: str, method: HashingMethod) -> str:
+    """
+    Returns the path of the dupfile of @method when scanning with several hashing methods, e.g. "dups.imdup" becomes
+    "dups.rgb-hashing.imdup".
+    """
+
+    root, ext = os.path.splitext(output)
+    return f'{root}.{method.value}{ext}'
+
+
+def run_serve(arguments: argparse.Namespace) -> None:
+    images = hashindex.load(arguments.index, verbose=arguments.verbose)
+    writer = hashindex.IndexWriter(arguments.index, images.method, images.hash_size, images.reduced_decoding)
+    try:
+        server = create_server(
+            QueryIndex(
+                images,
+                threshold=arguments.threshold,
+                validation=ValidationPolicy(arguments.validate),
+                writer=writer
+            ),
+            socket_path=arguments.socket,
+            port=arguments.port,
             verbose=arguments.verbose
         )
+        serve(server, verbose=arguments.verbose)
+    finally:
+        writer.close()
 
-        if arguments.hash_size is None:
-            hash_size, image_paths = calc_hash_size(
-                image_paths,
-                auto_hash_size=AutoHashSize(arguments.auto_hash_size),
+
+def run_merge(arguments: argparse.Namespace) -> None:
+    images = hashindex.merge(arguments.indexes, verbose=arguments.verbose)
+    if arguments.threshold > 0 and any(image_hash is None for image_hash in images.hashes):
+        cprint('-t/--threshold requires indexes of full hashes. Program terminated.', 'red')
+        exit()
+    if arguments.save_index is not None:
+        hashindex.save(images, arguments.save_index, verbose=arguments.verbose)
+    dups = group_dups(images, threshold=arguments.threshold)
+    if arguments.verbose > 0:
+        print(
+            f'Found {colored(str(len(dups)), attrs=["bold"])} duplication(s) '
+            f'across {colored(str(dups.file_count), attrs=["bold"])} file(s)',
+            flush=True
+        )
+    if not arguments.silent:
+        print()
+        print_dups(
+            dups,
+            output_path_format=PathFormat(arguments.format),
+            colored_cluster_header=True,
+            show_hash_cluster_header=arguments.show_hash
+        )
+    if arguments.output is not None:
+        dupfile.save(dups, file=arguments.output, verbose=arguments.verbose)
+
+
+def find_image_paths(arguments: argparse.Namespace, profiler: Profiler, directory: str) -> Iterable[str | os.DirEntry]:
+    shard = arguments.shard if arguments.mode == 'scan' else None
+    if arguments.hash_size is None:
+        with profiler.stage('index'):
+            return index_images(
+                directory,
+                exclude=arguments.exclude,
+                recursive=arguments.recursive,
                 verbose=arguments.verbose,
-                progress_bar=arguments.progress_bar,
                 output_path_format=PathFormat(arguments.format),
-                root_dir=directory
+                threads=arguments.index_threads,
+                shard=shard
             )
-        else:
-            hash_size = arguments.hash_size
 
-        return detect_dup_images(
+    # With a fixed hash size, images are hashed while the directory is still being indexed
+    return profiler.iterate('index', iter_images(
+        directory,
+        exclude=arguments.exclude,
+        recursive=arguments.recursive,
+        verbose=arguments.verbose,
+        output_path_format=PathFormat(arguments.format),
+        threads=arguments.index_threads,
+        shard=shard
+    ))
+
+
+def find_hash_size(
+        arguments: argparse.Namespace,
+        profiler: Profiler,
+        image_paths: Iterable[str | os.DirEntry],
+        directory: str,
+        cache: HashCache | None,
+        verified: set[str]
+) -> tuple[int, Iterable[str | os.DirEntry]]:
+    """
+    Returns the hash size to scan @image_paths with, and the images to scan. Images verified while computing an
+    automatic hash size are added to @verified (see imutils.calc_hash_size()).
+    """
+
+    if arguments.hash_size is not None:
+        return arguments.hash_size, image_paths
+    if AutoHashSize(arguments.auto_hash_size) == AutoHashSize.SAMPLED:
+        with profiler.stage('tune_hash_size'):
+            hash_size, _ = tune_hash_size(
+                image_paths,
+                methods=arguments.hashing_methods,
+                verbose=arguments.verbose,
+                progress_bar=arguments.progress_bar,
+                validation=ValidationPolicy(arguments.validate),
+                reduced_decoding=arguments.reduced_decoding
+            )
+        return hash_size, image_paths
+    with profiler.stage('calc_hash_size'):
+        return calc_hash_size(
             image_paths,
-            method=HashingMethod(arguments.hashing_method),
-            hash_size=hash_size,
-            root_dir=directory,
-            output_path_format=PathFormat(arguments.format),
+            auto_hash_size=AutoHashSize(arguments.auto_hash_size),
             verbose=arguments.verbose,
-            progress_bar=arguments.progress_bar
+            progress_bar=arguments.progress_bar,
+            output_path_format=PathFormat(arguments.format),
+            root_dir=directory,
+            cache=cache,
+            validation=ValidationPolicy(arguments.validate),
+            verified=verified
         )
 
-    if arguments.mode == 'info':
+
+def find_dups(
+        arguments: argparse.Namespace,
+        profiler: Profiler,
+        group: bool = True
+) -> dict[HashingMethod, DupResults | DupRuns]:
+    directory = arguments.input if arguments.mode == 'clean' else arguments.directory
+    memory_limit = arguments.memory_limit * 1024 * 1024 if arguments.mode == 'scan' else 0
+    image_paths = find_image_paths(arguments, profiler, directory)
+
+    cache = open_cache(arguments)
+    try:
+        verified = set()
+        hash_size, image_paths = find_hash_size(arguments, profiler, image_paths, directory, cache, verified)
+        with profiler.stage('scan'):
+            return detect_dup_images_methods(
+                image_paths,
+                methods=arguments.hashing_methods,
+                hash_size=hash_size,
+                root_dir=directory,
+                output_path_format=PathFormat(arguments.format),
+                verbose=arguments.verbose,
+                progress_bar=arguments.progress_bar,
+                cache=cache,
+                jobs=arguments.jobs if arguments.jobs > 0 else os.cpu_count(),
+                validation=ValidationPolicy(arguments.validate),
+                prefilter=not arguments.no_prefilter,
+                threshold=arguments.threshold,
+                reduced_decoding=arguments.reduced_decoding,
+                profiler=profiler,
+                group=group,
+                keep_hashes=not group,
+                prefetch=arguments.prefetch,
+                prefetch_memory=arguments.prefetch_memory * 1024 * 1024,
+                use_mmap=arguments.mmap,
+                memory_limit=memory_limit,
+                tmp_dir=arguments.tmp_dir if arguments.mode == 'scan' else None,
+                verified=verified
+            )
+    finally:
+        if cache is not None:
+            with profiler.stage('cache close'):
+                cache.close()
+
+
+def run_info(arguments: argparse.Namespace, profiler: Profiler) -> None:
+    with profiler.stage('index'):
         img_paths = index_images(
             arguments.directory,
             exclude=arguments.exclude,
             recursive=arguments.recursive,
-            verbose=arguments.verbose
-        )
-
-        report_info(
-            img_paths,
             verbose=arguments.verbose,
-            progress_bar=arguments.progress_bar,
             output_path_format=PathFormat(arguments.format),
-            root_dir=arguments.directory
+            threads=arguments.index_threads
         )
 
-    elif arguments.mode == 'scan':
-        hashed_dups = find_dups()
+    cache = open_cache(arguments)
+    try:
+        with profiler.stage('info'):
+            report_info(
+                img_paths,
+                verbose=arguments.verbose,
+                progress_bar=arguments.progress_bar,
+                output_path_format=PathFormat(arguments.format),
+                root_dir=arguments.directory,
+                validation=ValidationPolicy(arguments.validate),
+                jobs=arguments.jobs if arguments.jobs > 0 else os.cpu_count(),
+                cache=cache
+            )
+    finally:
+        if cache is not None:
+            with profiler.stage('cache close'):
+                cache.close()
 
+
+def output_dup_runs(
+        arguments: argparse.Namespace,
+        profiler: Profiler,
+        method: HashingMethod,
+        dup_runs: DupRuns,
+        method_count: int
+) -> None:
+    if not arguments.silent and method_count > 1:
+        cprint(f'Hashing method: {method.value}\n', attrs=['bold'])
+    writer = dupfile.DupfileWriter(
+        method_output_path(arguments.output, method) if method_count > 1 else arguments.output,
+        dup_runs.method, dup_runs.hash_size, dup_runs.reduced_decoding
+    ) if arguments.output is not None else None
+    dup_count, file_count = 0, 0
+    for hashed_dups in profiler.iterate('group', dup_runs.grouped()):
+        with profiler.stage('output'):
+            if not arguments.silent:
+                print_dups(
+                    hashed_dups,
+                    root_dir=arguments.directory,
+                    output_path_format=PathFormat(arguments.format),
+                    colored_cluster_header=True,
+                    show_hash_cluster_header=arguments.show_hash,
+                    flush=True,
+                    start=dup_count + 1
+                )
+            if writer is not None:
+                writer.write(hashed_dups)
+        dup_count += len(hashed_dups)
+        file_count += hashed_dups.file_count
+    if arguments.verbose > 0:
+        print(
+            f'{f"{method.value}: " if method_count > 1 else ""}'
+            f'Found {colored(str(dup_count), attrs=["bold"])} duplication(s) '
+            f'across {colored(str(file_count), attrs=["bold"])} file(s) '
+            f'(spilled {colored(str(dup_runs.run_count), attrs=["bold"])} sorted run(s) to disk)',
+            flush=True
+        )
+    if writer is not None:
+        writer.close(verbose=arguments.verbose)
+
+
+def run_scan_runs(arguments: argparse.Namespace, profiler: Profiler) -> None:
+    # Duplications are grouped from the sorted runs of hashed images on disk, and output a chunk at a time
+    method_runs = find_dups(arguments, profiler)
+    try:
         if not arguments.silent:
             print()
-            print_dups(
-                hashed_dups,
-                root_dir=arguments.directory,
-                output_path_format=PathFormat(arguments.format),
-                colored_cluster_header=True,
-                show_hash_cluster_header=arguments.show_hash
+        for method, dup_runs in method_runs.items():
+            output_dup_runs(arguments, profiler, method, dup_runs, len(method_runs))
+    finally:
+        for dup_runs in method_runs.values():
+            dup_runs.close()
+
+
+def find_indexed_dups(arguments: argparse.Namespace, profiler: Profiler) -> dict[HashingMethod, DupResults]:
+    # The index keeps every hashed image, not only duplicated ones, so images are grouped once it is saved
+    method_dups = find_dups(arguments, profiler, group=False)
+    if arguments.save_index is not None:
+        with profiler.stage('hashindex.save'):
+            for method, scanned_images in method_dups.items():
+                hashindex.save(
+                    scanned_images,
+                    file=method_output_path(arguments.save_index, method) if len(method_dups) > 1
+                    else arguments.save_index,
+                    verbose=arguments.verbose
+                )
+    if arguments.reference is not None:
+        # Only the new images are hashed, and only the reference images they duplicate are read from the index
+        with profiler.stage('hashindex.add_matches'):
+            for scanned_images in method_dups.values():
+                hashindex.add_matches(
+                    arguments.reference, scanned_images,
+                    threshold=arguments.threshold, verbose=arguments.verbose
+                )
+    method_dups = {
+        method: group_dups(scanned_images, threshold=arguments.threshold, profiler=profiler)
+        for method, scanned_images in method_dups.items()
+    }
+    if arguments.verbose > 0:
+        for method, hashed_dups in method_dups.items():
+            print(
+                f'{f"{method.value}: " if len(method_dups) > 1 else ""}'
+                f'Found {colored(str(len(hashed_dups)), attrs=["bold"])} duplication(s) '
+                f'across {colored(str(hashed_dups.file_count), attrs=["bold"])} file(s)',
+                flush=True
             )
+    return method_dups
 
-        if arguments.output is not None:
-            dupfile.save(
-                [dup_imgs for dup_imgs in hashed_dups.values()],
-                file=arguments.output,
-                verbose=arguments.verbose
+
+def run_scan(arguments: argparse.Namespace, profiler: Profiler) -> None:
+    if arguments.save_index is not None or arguments.reference is not None:
+        method_dups = find_indexed_dups(arguments, profiler)
+    else:
+        method_dups = find_dups(arguments, profiler)
+
+    if not arguments.silent:
+        print()
+        with profiler.stage('output'):
+            for method, hashed_dups in method_dups.items():
+                if len(method_dups) > 1:
+                    cprint(f'Hashing method: {method.value}\n', attrs=['bold'])
+                print_dups(
+                    hashed_dups,
+                    root_dir=arguments.directory,
+                    output_path_format=PathFormat(arguments.format),
+                    colored_cluster_header=True,
+                    show_hash_cluster_header=arguments.show_hash
+                )
+
+    if arguments.output is not None:
+        with profiler.stage('dupfile.save'):
+            for method, hashed_dups in method_dups.items():
+                dupfile.save(
+                    hashed_dups,
+                    file=method_output_path(arguments.output, method) if len(method_dups) > 1 else arguments.output,
+                    verbose=arguments.verbose
+                )
+
+
+def run_clean(arguments: argparse.Namespace, profiler: Profiler) -> None:
+    if os.path.isfile(arguments.input) and arguments.input.split('.')[-1].lower() == JOURNAL_EXT:
+        with profiler.stage('clean'):
+            (rollback_clean if arguments.rollback else resume_clean)(
+                arguments.input,
+                verbose=arguments.verbose,
+                threads=arguments.clean_threads
             )
 
-    elif arguments.mode == 'clean':
-        if os.path.isfile(arguments.input):
+    elif os.path.isfile(arguments.input):
+        with profiler.stage('dupfile.load'):
             dups = dupfile.load(
                 arguments.input,
                 exclude=arguments.exclude,
                 verbose=arguments.verbose
             )
 
+        with profiler.stage('clean'):
             clean(
                 dups,
                 interactive=arguments.interactive,
                 verbose=arguments.verbose,
-                output_path_format=PathFormat.ABSOLUTE
+                output_path_format=PathFormat.ABSOLUTE,
+                action=CleanAction(arguments.action),
+                threads=arguments.clean_threads,
+                journal_file=arguments.journal
             )
 
-        else:
-            hashed_dups = find_dups()
+    else:
+        hashed_dups = find_dups(arguments, profiler)[arguments.hashing_methods[0]]
 
+        with profiler.stage('clean'):
             clean(
-                [dup_imgs for dup_imgs in hashed_dups.values()],
+                hashed_dups,
                 root_dir=arguments.input,
                 interactive=arguments.interactive,
                 verbose=arguments.verbose,
-                output_path_format=PathFormat(arguments.format)
+                output_path_format=PathFormat(arguments.format),
+                action=CleanAction(arguments.action),
+                threads=arguments.clean_threads,
+                journal_file=arguments.journal
             )
 
 
+def run_watch(arguments: argparse.Namespace) -> None:
+    # Watch before the index is built, so that images arriving in the meantime are not missed
+    watcher = create_watcher(
+        os.path.abspath(arguments.directory),
+        exclude=arguments.exclude,
+        recursive=arguments.recursive,
+        polling=arguments.poll,
+        poll_interval=arguments.poll_interval,
+        threads=arguments.index_threads
+    )
+    cache = open_cache(arguments)
+    try:
+        DupWatcher(
+            arguments.directory,
+            method=arguments.hashing_methods[0],
+            hash_size=arguments.hash_size,
+            exclude=arguments.exclude,
+            recursive=arguments.recursive,
+            clean_dups=arguments.clean,
+            interactive=arguments.interactive,
+            verbose=arguments.verbose,
+            progress_bar=arguments.progress_bar,
+            output_path_format=PathFormat(arguments.format),
+            show_hash=arguments.show_hash,
+            cache=cache,
+            jobs=arguments.jobs if arguments.jobs > 0 else os.cpu_count(),
+            validation=ValidationPolicy(arguments.validate),
+            prefilter=not arguments.no_prefilter,
+            reduced_decoding=arguments.reduced_decoding,
+            index_threads=arguments.index_threads,
+            prefetch=arguments.prefetch,
+            prefetch_memory=arguments.prefetch_memory * 1024 * 1024,
+            use_mmap=arguments.mmap
+        ).run(watcher)
+    finally:
+        watcher.close()
+        if cache is not None:
+            cache.close()
+
+
+def report_profile(arguments: argparse.Namespace, profiler: Profiler) -> None:
+    if arguments.profile:
+        profiler.print_summary()
+    if arguments.profile_output is not None:
+        profiler.save(arguments.profile_output)
+
+
+def main(arguments: argparse.Namespace) -> None:
+    if hasattr(arguments, 'validate'):
+        set_validation_policy(ValidationPolicy(arguments.validate))
+
+    if arguments.mode == 'serve':
+        run_serve(arguments)
+        return
+    if arguments.mode == 'merge':
+        run_merge(arguments)
+        return
+
+    profiler = Profiler() if arguments.profile or arguments.profile_output is not None else NULL_PROFILER
+    if arguments.mode == 'info':
+        run_info(arguments, profiler)
+    elif arguments.mode == 'scan' and arguments.memory_limit > 0:
+        run_scan_runs(arguments, profiler)
+    elif arguments.mode == 'scan':
+        run_scan(arguments, profiler)
+    elif arguments.mode == 'clean':
+        run_clean(arguments, profiler)
+    elif arguments.mode == 'watch':
+        run_watch(arguments)
+
+    if profiler.enabled:
+        report_profile(arguments, profiler)
+
+
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
     try:
         ap_top_level = argparse.ArgumentParser(
             prog=__app_name__,
@@ -206,51 +837,135 @@ if __name__ == '__main__':
             '-r', '--recursive', action='store_true',
             help='recursively search for images in subdirectories in addition to the specified parent directory'
         )
+        ap_common_args.add_argument(
+            '--index-threads', type=int, default=DEFAULT_INDEX_THREADS, metavar='N',
+            help='specify the number of threads listing directories ahead of the recursive (-r/--recursive) directory\n'
+                 f'walk, higher values help on network filesystems (default: {DEFAULT_INDEX_THREADS})'
+        )
         ap_common_args.add_argument(
             '-V', '--verbose', type=int, choices=VERBOSE_LEVELS, default=0,
             help='explain what is being done'
         )
+        ap_common_args.add_argument(
+            '--profile', action='store_true',
+            help='print the wall and CPU time of each stage, per-file decoding and per-batch hashing latencies, the\n'
+                 'slowest files and peak memory usage at the end of the run'
+        )
+        ap_common_args.add_argument(
+            '--profile-output', required=False, metavar='JSON', default=None,
+            help='save the profiling report (see --profile) to the specified JSON file'
+        )
         ap_common_args.add_argument(
             '-p', '--progress-bar', type=int, choices=PROGRESS_BAR_LEVELS, default=PROGRESS_BAR_LEVELS[-1],
             help=f'specify verbose mode (-V/--verbose) progress bar detail level, 0 disables the progress bar\n'
                  f'entirely (default: {PROGRESS_BAR_LEVELS[-1]})'
         )
 
+        ap_image_read_args = argparse.ArgumentParser(add_help=False)
+        ap_image_read_args.add_argument(
+            '--validate', choices=[v.value for v in ValidationPolicy], default=ValidationPolicy.HEADER.value,
+            help='specify how thoroughly image files are validated before being read: "none" hashes truncated images\n'
+                 'as far as they can be decoded, "header" skips images whose header or data cannot be decoded (only\n'
+                 'headers are read in info mode), "full" also verifies the integrity of each file beforehand\n'
+                 f'(default: {ValidationPolicy.HEADER.value})'
+        )
+        ap_cache_args = ap_image_read_args.add_mutually_exclusive_group()
+        ap_cache_args.add_argument(
+            '--no-cache', action='store_true',
+            help='do not read from or write to the persistent image cache'
+        )
+        ap_cache_args.add_argument(
+            '--rebuild-cache', action='store_true',
+            help='discard the persistent image cache and rebuild it from this run'
+        )
+        ap_image_read_args.add_argument(
+            '--cache-dir', required=False, metavar='DIR', default=None,
+            help='specify the persistent image cache directory (default: the user cache directory of the\n'
+                 f'current platform, e.g. ~/.cache/{CACHE_DIR_NAME} on Linux)'
+        )
+
         ap_scan_clean_specific_args = argparse.ArgumentParser(add_help=False)
         ap_scan_clean_specific_args.add_argument(
-            '-m', '--hashing-method', choices=[m.value for m in HashingMethod], default=HashingMethod.HIST.value,
-            help=f'specify a hashing method (default: {HashingMethod.HIST.value})'
+            '-m', '--hashing-method', metavar='{' + ','.join(m.value for m in HashingMethod) + '}',
+            default=HashingMethod.HIST.value,
+            help='specify a hashing method, or several comma-separated hashing methods in scan mode to compare their\n'
+                 'duplications with a single decoding pass over the images (with -o/--output, one dupfile is saved\n'
+                 f'per method, named after the method) (default: {HashingMethod.HIST.value})'
         )
         ap_scan_clean_specific_hash_size_args = ap_scan_clean_specific_args.add_mutually_exclusive_group()
         ap_scan_clean_specific_hash_size_args.add_argument(
             '-a', '--auto-hash-size', choices=[a.value for a in AutoHashSize], default=AutoHashSize.MAX_DIMS_MEAN.value,
-            help=f'automatic hash size calculation (default: {AutoHashSize.MAX_DIMS_MEAN.value})'
+            help='automatic hash size calculation, '
+                 f'"{AutoHashSize.SAMPLED.value}" hashes a random sample of images at several hash sizes and\n'
+                 'picks the smallest one that groups them the same way as larger ones, without slowing scans down by more\n'
+                 f'than {TUNE_MAX_COST_INCREASE:.0%}% (default: {AutoHashSize.MAX_DIMS_MEAN.value})'
         )
         ap_scan_clean_specific_hash_size_args.add_argument(
             '-s', '--hash-size', required=False, type=int, default=None,
             help=f'specify a preferred hash size (integer)*'
         )
+        ap_scan_clean_specific_args.add_argument(
+            '--no-prefilter', action='store_true',
+            help='decode and hash byte-identical files and hardlinks separately instead of only hashing one of them'
+        )
+        ap_scan_clean_specific_args.add_argument(
+            '-j', '--jobs', type=int, default=1,
+            help='specify the number of worker processes used for hashing images, 0 uses all CPU cores (default: 1)'
+        )
+        ap_scan_clean_specific_args.add_argument(
+            '--prefetch', type=int, default=PREFETCH_DEPTH, metavar='N',
+            help='read up to N files ahead of decoding in each hashing process, so that reads overlap with decoding,\n'
+                 f'which mostly helps on spinning disks and network filesystems, 0 disables read-ahead (default:\n'
+                 f'{PREFETCH_DEPTH})'
+        )
+        ap_scan_clean_specific_args.add_argument(
+            '--prefetch-memory', type=int, default=PREFETCH_MEMORY_BUDGET // (1024 * 1024), metavar='MIB',
+            help='specify the memory that read-ahead buffers may take, shared by all hashing processes; larger files\n'
+                 f'are only hinted to the operating system (default: {PREFETCH_MEMORY_BUDGET // (1024 * 1024)})'
+        )
+        ap_scan_clean_specific_args.add_argument(
+            '--mmap', action='store_true',
+            help='memory map files for decoding and digesting instead of reading them, which saves read() calls and\n'
+                 'copies; a file truncated while it is mapped (e.g. rewritten during the scan) crashes the scan'
+        )
+        ap_scan_clean_specific_args.add_argument(
+            '-t', '--threshold', type=int, default=0, metavar='N',
+            help='also group images whose hashes differ by at most N bits (Hamming distance) to detect near-duplicate\n'
+                 'images, 0 only groups identical hashes (default: 0)'
+        )
+        ap_scan_clean_specific_args.add_argument(
+            '--reduced-decoding', action='store_true',
+            help='decode JPEG, JPEG 2000 and pyramid TIFF images at a reduced resolution that is still at least 4\n'
+                 'times the size images are resized to for hashing, which is much faster for large images and small\n'
+                 'hash sizes; hashes may differ from full resolution hashes by a few percent of their bits, consider\n'
+                 'combining it with -t/--threshold'
+        )
 
         subparsers = ap_top_level.add_subparsers(
-            title='run modes', metavar='{info,scan,clean}',
+            title='run modes', metavar='{info,scan,clean,watch,serve,merge}',
             dest='mode', required=True
         )
 
         ap_info = subparsers.add_parser(
-            'info', parents=[ap_common_args],
+            'info', parents=[ap_image_read_args, ap_common_args],
             usage=__info_usage__,
             description=__info_desc__,
             epilog=__info_epilog__,
             formatter_class=argparse.RawTextHelpFormatter
         )
         ap_info.add_argument('directory', help='target image directory')
+        ap_info.add_argument(
+            '-j', '--jobs', type=int, default=DEFAULT_INFO_JOBS,
+            help=f'specify the number of threads reading image headers, 0 uses as many threads as CPU cores\n'
+                 f'(default: {DEFAULT_INFO_JOBS})'
+        )
         ap_info.add_argument(
             '-f', '--format', choices=[f.value for f in PathFormat], default=PathFormat.DIR_RELATIVE.value,
             help=f'console output file path format, (default: {PathFormat.DIR_RELATIVE.value})'
         )
 
         ap_scan = subparsers.add_parser(
-            'scan', parents=[ap_scan_clean_specific_args, ap_common_args],
+            'scan', parents=[ap_scan_clean_specific_args, ap_image_read_args, ap_common_args],
             usage=__scan_usage__,
             description=__scan_desc__,
             epilog=__scan_epilog__,
@@ -259,7 +974,7 @@ if __name__ == '__main__':
         ap_scan.add_argument('directory', help='target image directory')
         ap_scan.add_argument(
             '-H', '--show-hash', action='store_true',
-            help='show hash value of each duplication in output'
+            help='show the hash digest of each duplication in output'
         )
         ap_scan.add_argument(
             '-f', '--format', choices=[f.value for f in PathFormat], default=PathFormat.DIR_RELATIVE.value,
@@ -267,16 +982,44 @@ if __name__ == '__main__':
         )
         ap_scan.add_argument(
             '-S', '--silent', action='store_true',
-            help=f'no console output, -o/--output must be specified'
+            help='no console output, -o/--output or --save-index must be specified'
         )
         ap_scan.add_argument(
             '-o', '--output', required=False, metavar='DUPFILE',
             help=f'save the output to the specified DUPFILE (JSON formatted .{DUPFILE_EXT}) file (overwriting if file\n'
                  'already exist)'
         )
+        ap_scan.add_argument(
+            '--save-index', required=False, metavar='INDEX',
+            help=f'save the hash of every scanned image to the specified INDEX (SQLite formatted .{INDEX_EXT}) file\n'
+                 '(overwriting if file already exist), which serve mode answers duplicate queries from'
+        )
+        ap_scan.add_argument(
+            '--shard', required=False, metavar='I/N', default=None,
+            help='only scan the I-th of N disjoint shards of the images (assigned by relative path), e.g. on each of\n'
+                 'N nodes or processes, and save their hashes with --save-index (required, along with\n'
+                 '-s/--hash-size); shard indexes are then joined by merge mode'
+        )
+        ap_scan.add_argument(
+            '--reference', required=False, metavar='INDEX', default=None,
+            help=f'also find the duplicates of the scanned images among the images of a reference .{INDEX_EXT} hash\n'
+                 'index (e.g. of a large library, saved by a scan with --save-index flag), without rehashing or\n'
+                 'opening them; the hashing method and hash size of the index are used'
+        )
+        ap_scan.add_argument(
+            '--memory-limit', type=int, default=0, metavar='MIB',
+            help='bound the memory of hashed images to MIB, spilling them to sorted runs on disk that are merged\n'
+                 'into duplications once every image is hashed, so that memory usage does not grow with the number\n'
+                 'of images; duplications are then output as they are found (requires -s/--hash-size, and disables\n'
+                 'the byte-identical file prefilter), 0 keeps every hashed image in memory (default: 0)'
+        )
+        ap_scan.add_argument(
+            '--tmp-dir', required=False, metavar='DIR', default=None,
+            help='write the sorted runs of --memory-limit flag to DIR (default: the system temporary directory)'
+        )
 
         ap_clean = subparsers.add_parser(
-            'clean', parents=[ap_scan_clean_specific_args, ap_common_args],
+            'clean', parents=[ap_scan_clean_specific_args, ap_image_read_args, ap_common_args],
             usage=__clean_usage__,
             description=__clean_desc__,
             epilog=__clean_epilog__,
@@ -291,18 +1034,157 @@ if __name__ == '__main__':
                  '  -e/--exclude\n'
                  '  -V/--verbose\n'
                  '  -i/--interactive\n'
+                 '  --action\n'
+                 '  --journal\n'
+                 '  --clean-threads\n'
+                 f'or a .{JOURNAL_EXT} journal file of an interrupted clean (see --journal flag), which is resumed\n'
+                 '(or rolled back with --rollback flag), in which case only -h/--help, -V/--verbose, --clean-threads\n'
+                 'and --rollback flags are available;\n'
                  'see options below for more information'
         )
         ap_clean.add_argument(
             '-i', '--interactive', action='store_true',
             help='prompt for every duplication and let the user choose which file to delete'
         )
+        ap_clean.add_argument(
+            '--action', choices=[a.value for a in CleanAction], default=CleanAction.DELETE.value,
+            help='"delete" duplicated images, or replace them with a "hardlink" or a "reflink" (copy-on-write clone,\n'
+                 'on filesystems that support it, e.g. Btrfs, XFS or APFS) to the kept image, so that their paths\n'
+                 f'remain valid (default: {CleanAction.DELETE.value})'
+        )
+        ap_clean.add_argument(
+            '--journal', required=False, metavar='JOURNAL', default=None,
+            help=f'record the clean to the specified JOURNAL (.{JOURNAL_EXT}) file, and keep the cleaned images in\n'
+                 'hidden backup files next to them until the whole clean is done, so that an interrupted clean can be\n'
+                 'resumed, or rolled back with --rollback flag, by cleaning the journal file'
+        )
+        ap_clean.add_argument(
+            '--rollback', action='store_true',
+            help='roll back the interrupted clean of a journal input, restoring every image it cleaned'
+        )
+        ap_clean.add_argument(
+            '--clean-threads', type=int, default=DEFAULT_CLEAN_THREADS, metavar='N',
+            help=f'specify the number of threads cleaning duplications at once (default: {DEFAULT_CLEAN_THREADS})'
+        )
         ap_clean.add_argument(
             '-f', '--format', choices=[f.value for f in PathFormat], default=PathFormat.DIR_RELATIVE.value,
             help=f'console output file path format, ignored if -V/--verbose and -i/--interactive are both not\n'
                  f'enabled (default: {PathFormat.DIR_RELATIVE.value})'
         )
 
+        ap_watch = subparsers.add_parser(
+            'watch', parents=[ap_scan_clean_specific_args, ap_image_read_args, ap_common_args],
+            usage=__watch_usage__,
+            description=__watch_desc__,
+            epilog=__watch_epilog__,
+            formatter_class=argparse.RawTextHelpFormatter
+        )
+        ap_watch.add_argument('directory', help='target image directory')
+        ap_watch.add_argument(
+            '--clean', action='store_true',
+            help='remove identical images as they are found, keeping the highest resolution one of each duplication;\n'
+                 'deleted files are not recoverable, proceed with caution'
+        )
+        ap_watch.add_argument(
+            '-i', '--interactive', action='store_true',
+            help='prompt for every duplication and let the user choose which file to delete (requires --clean)'
+        )
+        ap_watch.add_argument(
+            '--poll', action='store_true',
+            help='detect changes by walking the directory every --poll-interval seconds instead of through inotify'
+        )
+        ap_watch.add_argument(
+            '--poll-interval', type=float, default=WATCH_POLL_INTERVAL, metavar='SECONDS',
+            help=f'specify the seconds between directory walks when polling (default: {WATCH_POLL_INTERVAL})'
+        )
+        ap_watch.add_argument(
+            '-H', '--show-hash', action='store_true',
+            help='show the hash digest of each duplication in output'
+        )
+        ap_watch.add_argument(
+            '-f', '--format', choices=[f.value for f in PathFormat], default=PathFormat.DIR_RELATIVE.value,
+            help=f'console output file path format, (default: {PathFormat.DIR_RELATIVE.value})'
+        )
+
+        ap_serve = subparsers.add_parser(
+            'serve',
+            usage=__serve_usage__,
+            description=__serve_desc__,
+            epilog=__serve_epilog__,
+            formatter_class=argparse.RawTextHelpFormatter
+        )
+        ap_serve.add_argument(
+            'index', help=f'a .{INDEX_EXT} hash index file (can be generated using scan mode with --save-index flag)'
+        )
+        ap_serve.add_argument(
+            '-t', '--threshold', type=int, default=0, metavar='N',
+            help='also match images whose hashes differ by at most N bits (Hamming distance) from the queried image,\n'
+                 'which is the default and largest threshold of queries, 0 only matches identical hashes (default: 0)'
+        )
+        ap_serve_address_args = ap_serve.add_mutually_exclusive_group()
+        ap_serve_address_args.add_argument(
+            '--port', type=int, default=SERVE_PORT,
+            help=f'serve HTTP on the specified localhost port (default: {SERVE_PORT})'
+        )
+        ap_serve_address_args.add_argument(
+            '--socket', required=False, metavar='PATH', default=None,
+            help='serve HTTP on the specified Unix socket instead of a localhost port'
+        )
+        ap_serve.add_argument(
+            '--validate', choices=[v.value for v in ValidationPolicy], default=ValidationPolicy.HEADER.value,
+            help='specify how thoroughly queried image files are validated before being read, see scan mode\n'
+                 f'(default: {ValidationPolicy.HEADER.value})'
+        )
+        ap_serve.add_argument(
+            '-V', '--verbose', type=int, choices=VERBOSE_LEVELS, default=0,
+            help='explain what is being done, 2 also logs every request'
+        )
+
+        ap_merge = subparsers.add_parser(
+            'merge',
+            usage=__merge_usage__,
+            description=__merge_desc__,
+            epilog=__merge_epilog__,
+            formatter_class=argparse.RawTextHelpFormatter
+        )
+        ap_merge.add_argument(
+            'indexes', nargs='+', metavar='index',
+            help=f'.{INDEX_EXT} hash index files hashed with the same hashing parameters (can be generated using scan\n'
+                 'mode with --save-index flag, and --shard flag)'
+        )
+        ap_merge.add_argument(
+            '-t', '--threshold', type=int, default=0, metavar='N',
+            help='also group images whose hashes differ by at most N bits (Hamming distance) to detect near-duplicate\n'
+                 'images, 0 only groups identical hashes (default: 0)'
+        )
+        ap_merge.add_argument(
+            '-H', '--show-hash', action='store_true',
+            help='show the hash digest of each duplication in output'
+        )
+        ap_merge.add_argument(
+            '-f', '--format', choices=[f.value for f in PathFormat if f != PathFormat.DIR_RELATIVE],
+            default=PathFormat.ABSOLUTE.value,
+            help=f'console output file path format, (default: {PathFormat.ABSOLUTE.value})'
+        )
+        ap_merge.add_argument(
+            '-S', '--silent', action='store_true',
+            help='no console output, -o/--output or --save-index must be specified'
+        )
+        ap_merge.add_argument(
+            '-o', '--output', required=False, metavar='DUPFILE',
+            help=f'save the output to the specified DUPFILE (JSON formatted .{DUPFILE_EXT}) file (overwriting if file\n'
+                 'already exist)'
+        )
+        ap_merge.add_argument(
+            '--save-index', required=False, metavar='INDEX',
+            help=f'save the merged hash index to the specified INDEX (SQLite formatted .{INDEX_EXT}) file\n'
+                 '(overwriting if file already exist)'
+        )
+        ap_merge.add_argument(
+            '-V', '--verbose', type=int, choices=VERBOSE_LEVELS, default=0,
+            help='explain what is being done'
+        )
+
         args = validate_args(ap_top_level)
         main(arguments=args)
 
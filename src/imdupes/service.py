@@ -0,0 +1,355 @@
+import io
+import os
+import json
+import socket
+import base64
+import threading
+import http.client
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, quote
+from termcolor import colored
+
+from detect_dup_images import hash_image_files
+from hashindex import IndexWriter
+from utils.results import DupResults
+from utils.hamming import HammingIndex
+from utils.globs import ValidationPolicy
+from utils.globs import SERVE_HOST, SERVE_PORT, SERVE_MAX_REQUEST_SIZE
+
+
+class QueryIndex:
+    """
+    In-memory index of the images of a hash index file, answering "is this image already indexed?" queries.
+
+    Images are looked up by digest for identical images, and through a HammingIndex for near-duplicate images within
+    @threshold bits, which is the largest threshold queries may ask for. Images added while serving are written through
+    to @writer, if any, so that they are still indexed after a restart.
+    """
+
+    def __init__(
+            self,
+            images: DupResults,
+            threshold: int = 0,
+            validation: ValidationPolicy = ValidationPolicy.HEADER,
+            writer: IndexWriter = None
+    ):
+        if threshold > 0 and any(image_hash is None for image_hash in images.hashes):
+            raise ValueError('Near-duplicate queries require an index of full hashes')
+        self.images = images
+        self.threshold = threshold
+        self.validation = validation
+        self.writer = writer
+        self.query_count = 0
+        self._lock = threading.Lock()
+        self._digests: dict[bytes, list[int]] = {}  # Digest: entries with that digest
+        self._paths: dict[str, int] = {}  # Path: current entry, earlier entries of replaced images are stale
+        self._hamming: HammingIndex | None = None  # Hash ids are entries, as every entry is indexed in order
+        for entry in range(images.entry_count):
+            self._index(entry)
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    def _index(self, entry: int) -> None:
+        self._digests.setdefault(self.images.digest(entry), []).append(entry)
+        self._paths[self.images.path(entry)] = entry
+        if self.threshold > 0:
+            if self._hamming is None:
+                self._hamming = HammingIndex(len(self.images.hash(entry)) * 8, self.threshold)
+            self._hamming.add(int.from_bytes(self.images.hash(entry), 'big'))
+
+    def _match(self, entry: int, distance: int) -> dict:
+        return {
+            'path': self.images.path(entry),
+            'distance': distance,
+            'width': self.images.widths[entry],
+            'height': self.images.heights[entry],
+            'format': self.images.file_format(entry)
+        }
+
+    def _lookup(self, path: str | None, digest: bytes, image_hash: bytes, threshold: int) -> list[dict]:
+        if threshold == 0 or self._hamming is None:
+            candidates = [(entry, 0) for entry in self._digests.get(digest, [])]
+        else:
+            hash_value = int.from_bytes(image_hash, 'big')
+            candidates = sorted(
+                (
+                    (entry, (self._hamming.hashes[entry] ^ hash_value).bit_count())
+                    for entry in self._hamming.query(hash_value)
+                ),
+                key=lambda candidate: candidate[1]
+            )
+        return [
+            self._match(entry, distance) for entry, distance in candidates
+            if distance <= threshold and self._paths.get(self.images.path(entry)) == entry
+            and self.images.path(entry) != path
+        ]
+
+    def query(
+            self,
+            sources: list[str | bytes],
+            names: list[str | None] = None,
+            threshold: int = None,
+            add: bool = False
+    ) -> list[dict]:
+        """
+        Looks up the duplicates of a batch of images, each given as a file path or as raw image data (bytes), which are
+        hashed all at once. Returns the result of each image: its path (or @names entry for raw image data), size and
+        format, and its indexed duplicates as matches ordered by Hamming distance, or its error. With @add, hashed
+        images are then added to the index; raw image data can only be added under a name.
+        """
+
+        threshold = self.threshold if threshold is None else threshold
+        if not 0 <= threshold <= self.threshold:
+            raise ValueError(f'Threshold must be between 0 and {self.threshold}')
+        names = names if names is not None else [None] * len(sources)
+        paths = [
+            os.path.abspath(source) if isinstance(source, str) else name
+            for source, name in zip(sources, names)
+        ]
+        hashed = hash_image_files(
+            [source if isinstance(source, str) else io.BytesIO(source) for source in sources],
+            method=self.images.method,
+            hash_size=self.images.hash_size,
+            validation=self.validation,
+            full_hash=True,
+            reduced_decoding=self.images.reduced_decoding
+        )
+
+        results = []
+        with self._lock:
+            self.query_count += len(sources)
+            for source, path, (digest, image_hash, size, file_format, error, _) in zip(sources, paths, hashed):
+                if error is not None:
+                    results.append({'path': path, 'error': error})
+                    continue
+                result = {
+                    'path': path,
+                    'width': size[0],
+                    'height': size[1],
+                    'format': file_format,
+                    'hash': digest.hex(),
+                    'matches': self._lookup(path, digest, image_hash, threshold),
+                    'added': False
+                }
+                if add and path is not None:
+                    self._add(source, path, digest, image_hash, size, file_format)
+                    result['added'] = True
+                results.append(result)
+            if add and self.writer is not None:
+                self.writer.commit()
+        return results
+
+    def _add(
+            self,
+            source: str | bytes,
+            path: str,
+            digest: bytes,
+            image_hash: bytes,
+            size: tuple[int, int],
+            file_format: str | None
+    ) -> None:
+        file_size, mtime_ns = len(source), 0
+        if isinstance(source, str):
+            try:
+                st = os.stat(source)
+                file_size, mtime_ns = st.st_size, st.st_mtime_ns
+            except OSError:
+                file_size = 0  # Removed since it was hashed, its hash is still worth indexing
+        entry = self.images.add(
+            path, *size,
+            file_size=file_size, file_format=file_format, mtime_ns=mtime_ns, digest=digest, image_hash=image_hash
+        )
+        self._index(entry)
+        if self.writer is not None:
+            self.writer.put(path, *size, file_size, file_format, mtime_ns, digest, image_hash)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'images': len(self),
+                'hashing_method': self.images.method.value,
+                'hash_size': self.images.hash_size,
+                'reduced_decoding': self.images.reduced_decoding,
+                'threshold': self.threshold,
+                'queries': self.query_count
+            }
+
+
+class _QueryRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP API of the dedup service:
+        GET /stats returns the statistics of the index (see QueryIndex.stats())
+        POST /query with a JSON body {"paths": [...], "images": [{"name": ..., "data": base64}], "threshold": N,
+            "add": false} returns {"results": [...]} (see QueryIndex.query()), paths first
+        POST /query?threshold=N&add=1&name=NAME with raw image data as body returns {"results": [result]}
+    """
+
+    protocol_version = 'HTTP/1.1'  # Keep-alive, so that clients do not reconnect for every query
+    server: 'ThreadingHTTPServer | UnixHTTPServer'
+
+    def _send_json(self, status: int, data: dict) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if urlsplit(self.path).path == '/stats':
+            self._send_json(200, self.server.query_index.stats())
+        else:
+            self._send_json(404, {'error': f'Unknown endpoint {self.path}'})
+
+    def do_POST(self) -> None:
+        url = urlsplit(self.path)
+        if url.path != '/query':
+            self._send_json(404, {'error': f'Unknown endpoint {self.path}'})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            if length > SERVE_MAX_REQUEST_SIZE:
+                self.close_connection = True
+                self._send_json(413, {'error': f'Request body larger than {SERVE_MAX_REQUEST_SIZE} bytes'})
+                return
+            body = self.rfile.read(length)
+
+            if self.headers.get_content_type() == 'application/json':
+                request = json.loads(body)
+                paths = request.get('paths', [])
+                images = request.get('images', [])
+                results = self.server.query_index.query(
+                    [*paths, *(base64.b64decode(image['data']) for image in images)],
+                    names=[None] * len(paths) + [image.get('name') for image in images],
+                    threshold=request.get('threshold'),
+                    add=bool(request.get('add', False))
+                )
+            else:
+                params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                results = self.server.query_index.query(
+                    [body],
+                    names=[params.get('name')],
+                    threshold=int(params['threshold']) if 'threshold' in params else None,
+                    add=params.get('add', '0').lower() in ('1', 'true')
+                )
+        except (ValueError, TypeError, KeyError, AttributeError) as error:
+            self._send_json(400, {'error': error.__str__()})
+            return
+        self._send_json(200, {'results': results})
+
+    def address_string(self) -> str:
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def log_message(self, format: str, *args) -> None:
+        if self.server.verbose > 1:
+            super().log_message(format, *args)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, handler: type[BaseHTTPRequestHandler]):
+        if os.path.exists(path):
+            os.remove(path)  # Left behind by a previous instance
+        super().__init__(path, handler)
+
+    def server_close(self) -> None:
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+def create_server(
+        query_index: QueryIndex,
+        socket_path: str = None,
+        port: int = SERVE_PORT,
+        verbose: int = 0
+) -> ThreadingHTTPServer | UnixHTTPServer:
+    """
+    Creates the HTTP server of the dedup service, on the Unix socket @socket_path if given, or else on localhost @port
+    (an ephemeral port if 0).
+    """
+
+    if socket_path is not None:
+        server = UnixHTTPServer(socket_path, _QueryRequestHandler)
+    else:
+        server = ThreadingHTTPServer((SERVE_HOST, port), _QueryRequestHandler)
+    server.query_index = query_index
+    server.verbose = verbose
+    return server
+
+
+def serve(server: ThreadingHTTPServer | UnixHTTPServer, verbose: int = 0) -> None:
+    """
+    Serves queries until interrupted.
+    """
+
+    if verbose > 0:
+        address = server.server_address
+        print(
+            f'Serving {colored(str(len(server.query_index)), attrs=["bold"])} indexed image(s) on '
+            f'{f"http://{address[0]}:{address[1]}" if isinstance(address, tuple) else f"unix socket {address}"}, '
+            f'press Ctrl+C to stop...',
+            flush=True
+        )
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float = None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class ServiceClient:
+    """
+    Client of the dedup service, on the Unix socket @socket_path if given, or else on localhost @port. Keeps its
+    connection open across queries; not thread-safe, use one client per thread.
+    """
+
+    def __init__(self, socket_path: str = None, port: int = SERVE_PORT, timeout: float = None):
+        if socket_path is not None:
+            self._conn = _UnixHTTPConnection(socket_path, timeout=timeout)
+        else:
+            self._conn = http.client.HTTPConnection(SERVE_HOST, port, timeout=timeout)
+
+    def _request(self, method: str, url: str, body: bytes = None, content_type: str = None) -> dict:
+        headers = {'Content-Type': content_type} if content_type is not None else {}
+        self._conn.request(method, url, body=body, headers=headers)
+        response = self._conn.getresponse()
+        data = json.loads(response.read())
+        if response.status != 200:
+            raise ValueError(data.get('error', f'HTTP error {response.status}'))
+        return data
+
+    def query(self, paths: list[str], threshold: int = None, add: bool = False) -> list[dict]:
+        request = {'paths': paths, 'threshold': threshold, 'add': add}
+        return self._request('POST', '/query', json.dumps(request).encode(), 'application/json')['results']
+
+    def query_bytes(self, data: bytes, name: str = None, threshold: int = None, add: bool = False) -> dict:
+        params = [f'add={int(add)}']
+        if threshold is not None:
+            params.append(f'threshold={threshold}')
+        if name is not None:
+            params.append(f'name={quote(name)}')
+        return self._request(
+            'POST', f'/query?{"&".join(params)}', data, 'application/octet-stream'
+        )['results'][0]
+
+    def stats(self) -> dict:
+        return self._request('GET', '/stats')
+
+    def close(self) -> None:
+        self._conn.close()
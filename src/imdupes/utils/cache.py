@@ -0,0 +1,308 @@
+import os
+import sys
+import time
+import json
+import hashlib
+import sqlite3
+from collections.abc import Iterable
+
+from utils.globs import HashingMethod
+from utils.globs import ValidationPolicy
+from utils.globs import CACHE_DIR_NAME, CACHE_MAX_SIZE
+
+
+SCHEMA_VERSION = 5
+
+# Validation policies from the weakest to the strongest
+VALIDATION_LEVELS = [ValidationPolicy.NONE.value, ValidationPolicy.HEADER.value, ValidationPolicy.FULL.value]
+
+
+def default_cache_dir() -> str:
+    if sys.platform == 'win32':
+        base_dir = os.environ.get('LOCALAPPDATA', os.path.expanduser('~\\AppData\\Local'))
+    elif sys.platform == 'darwin':
+        base_dir = os.path.expanduser('~/Library/Caches')
+    else:
+        base_dir = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+    return os.path.join(base_dir, CACHE_DIR_NAME)
+
+
+def _method_key(method: HashingMethod, reduced_decoding: bool) -> str:
+    return f'{method.value}:reduced' if reduced_decoding else method.value
+
+
+def _validation_level(validation: ValidationPolicy | str) -> int:
+    return VALIDATION_LEVELS.index(validation.value if isinstance(validation, ValidationPolicy) else validation)
+
+
+def file_fingerprint(st: os.stat_result) -> tuple[int, int, int]:
+    return st.st_size, st.st_mtime_ns, st.st_ino
+
+
+def dir_fingerprint(files: Iterable[tuple[str, os.stat_result]]) -> bytes:
+    """
+    Digest of the names and file fingerprints of (the images of) a directory, which changes whenever one of them is
+    added, removed, renamed or modified.
+    """
+
+    digest = hashlib.blake2b(digest_size=16)
+    for name, st in files:
+        digest.update(f'{name}\0{st.st_size}\0{st.st_mtime_ns}\0{st.st_ino}\n'.encode(errors='surrogateescape'))
+    return digest.digest()
+
+
+class HashCache:
+    """
+    Persistent SQLite-backed cache of image dimensions, image hashes and known decoding errors, as well as of the image
+    information of whole directories.
+
+    Entries are keyed by absolute file path and are only considered valid while the file fingerprint (size, mtime and
+    inode) is unchanged. Hashes are additionally keyed by hashing method (and whether reduced-resolution decoding was
+    used) and hash size, and are stored as their folded digest, plus the full packed hash when it was needed by the run
+    that computed it. File entries and hashes record the validation policy they were made under: images and hashes are
+    only served to runs with the same or a weaker validation policy, and errors to runs with the same or a stronger
+    one, since a weaker policy may read files that a stronger one rejects. Directory entries are keyed by absolute
+    directory path and validation policy, and are only considered valid while the fingerprint of the images of the
+    directory is unchanged. Once the cache file grows past @max_size bytes, the least recently used entries are evicted
+    and the file is compacted when the cache is closed.
+    """
+
+    def __init__(self, file: str, max_size: int = CACHE_MAX_SIZE, rebuild: bool = False):
+        self.file = file
+        self.max_size = max_size
+        self._run_stamp = int(time.time())
+        self._used_files: list[str] = []
+        self._used_hashes: list[tuple[str, str, int]] = []
+        self._used_dirs: list[tuple[str, str]] = []
+
+        os.makedirs(os.path.dirname(os.path.abspath(file)), exist_ok=True)
+        self._conn = sqlite3.connect(file)
+        if rebuild or self._conn.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            self._conn.executescript(
+                'DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS hashes; DROP TABLE IF EXISTS dirs;'
+            )
+        self._conn.executescript(
+            f'''
+            PRAGMA user_version = {SCHEMA_VERSION};
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                width INTEGER,
+                height INTEGER,
+                format TEXT,
+                error TEXT,
+                validation TEXT NOT NULL,
+                last_used INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS hashes (
+                path TEXT NOT NULL,
+                method TEXT NOT NULL,
+                hash_size INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                width INTEGER NOT NULL,
+                height INTEGER NOT NULL,
+                format TEXT,
+                digest BLOB NOT NULL,
+                hash BLOB,
+                validation TEXT NOT NULL,
+                last_used INTEGER NOT NULL,
+                PRIMARY KEY (path, method, hash_size)
+            );
+            CREATE TABLE IF NOT EXISTS dirs (
+                path TEXT NOT NULL,
+                validation TEXT NOT NULL,
+                fingerprint BLOB NOT NULL,
+                images TEXT NOT NULL,
+                last_used INTEGER NOT NULL,
+                PRIMARY KEY (path, validation)
+            );
+            CREATE INDEX IF NOT EXISTS files_last_used ON files (last_used);
+            CREATE INDEX IF NOT EXISTS hashes_last_used ON hashes (last_used);
+            CREATE INDEX IF NOT EXISTS dirs_last_used ON dirs (last_used);
+            '''
+        )
+
+    def get_image(
+            self,
+            path: str,
+            st: os.stat_result,
+            validation: ValidationPolicy = ValidationPolicy.HEADER
+    ) -> tuple[int, int, str] | None:
+        row = self._conn.execute(
+            'SELECT size, mtime_ns, inode, width, height, format, validation FROM files '
+            'WHERE path = ? AND error IS NULL',
+            (path,)
+        ).fetchone()
+        if (
+                row is None or tuple(row[:3]) != file_fingerprint(st)
+                or _validation_level(row[6]) < _validation_level(validation)
+        ):
+            return None
+        self._used_files.append(path)
+        return row[3], row[4], row[5]
+
+    def get_error(
+            self,
+            path: str,
+            st: os.stat_result,
+            validation: ValidationPolicy = ValidationPolicy.HEADER
+    ) -> str | None:
+        row = self._conn.execute(
+            'SELECT size, mtime_ns, inode, error, validation FROM files WHERE path = ? AND error IS NOT NULL',
+            (path,)
+        ).fetchone()
+        if (
+                row is None or tuple(row[:3]) != file_fingerprint(st)
+                or _validation_level(row[4]) > _validation_level(validation)
+        ):
+            return None
+        self._used_files.append(path)
+        return row[3]
+
+    def get_hash(
+            self,
+            path: str,
+            st: os.stat_result,
+            method: HashingMethod,
+            hash_size: int,
+            full_hash: bool = False,
+            reduced_decoding: bool = False,
+            validation: ValidationPolicy = ValidationPolicy.HEADER
+    ) -> tuple[bytes, bytes | None, tuple[int, int], str | None] | None:
+        method_key = _method_key(method, reduced_decoding)
+        row = self._conn.execute(
+            'SELECT size, mtime_ns, inode, width, height, format, digest, hash, validation FROM hashes '
+            'WHERE path = ? AND method = ? AND hash_size = ?',
+            (path, method_key, hash_size)
+        ).fetchone()
+        if (
+                row is None or tuple(row[:3]) != file_fingerprint(st) or (full_hash and row[7] is None)
+                or _validation_level(row[8]) < _validation_level(validation)
+        ):
+            return None
+        self._used_hashes.append((path, method_key, hash_size))
+        return row[6], row[7], (row[3], row[4]), row[5]
+
+    def get_dir(
+            self,
+            path: str,
+            validation: ValidationPolicy,
+            fingerprint: bytes
+    ) -> list[tuple[int, int, str | None, str | None]] | None:
+        """
+        Returns the (width, height, format, error) of each image of a directory, in the order they were put in.
+        """
+
+        row = self._conn.execute(
+            'SELECT fingerprint, images FROM dirs WHERE path = ? AND validation = ?',
+            (path, validation.value)
+        ).fetchone()
+        if row is None or row[0] != fingerprint:
+            return None
+        self._used_dirs.append((path, validation.value))
+        return [tuple(image) for image in json.loads(row[1])]
+
+    def put_image(
+            self,
+            path: str,
+            st: os.stat_result,
+            width: int,
+            height: int,
+            file_format: str,
+            validation: ValidationPolicy = ValidationPolicy.HEADER
+    ) -> None:
+        self._conn.execute(
+            'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, NULL, ?, ?)',
+            (path, *file_fingerprint(st), width, height, file_format, validation.value, self._run_stamp)
+        )
+
+    def put_error(
+            self,
+            path: str,
+            st: os.stat_result,
+            error: str,
+            validation: ValidationPolicy = ValidationPolicy.HEADER
+    ) -> None:
+        self._conn.execute(
+            'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, NULL, NULL, NULL, ?, ?, ?)',
+            (path, *file_fingerprint(st), error, validation.value, self._run_stamp)
+        )
+
+    def put_hash(
+            self,
+            path: str,
+            st: os.stat_result,
+            method: HashingMethod,
+            hash_size: int,
+            digest: bytes,
+            image_hash: bytes | None,
+            size: tuple[int, int],
+            file_format: str | None,
+            reduced_decoding: bool = False,
+            validation: ValidationPolicy = ValidationPolicy.HEADER
+    ) -> None:
+        self._conn.execute(
+            'INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (
+                path, _method_key(method, reduced_decoding), hash_size, *file_fingerprint(st), *size, file_format,
+                digest, image_hash, validation.value, self._run_stamp
+            )
+        )
+
+    def put_dir(
+            self,
+            path: str,
+            validation: ValidationPolicy,
+            fingerprint: bytes,
+            images: list[tuple[int, int, str | None, str | None]]
+    ) -> None:
+        self._conn.execute(
+            'INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?, ?)',
+            (path, validation.value, fingerprint, json.dumps(images), self._run_stamp)
+        )
+
+    def close(self) -> None:
+        self._conn.executemany(
+            'UPDATE files SET last_used = ? WHERE path = ?',
+            ((self._run_stamp, path) for path in self._used_files)
+        )
+        self._conn.executemany(
+            'UPDATE hashes SET last_used = ? WHERE path = ? AND method = ? AND hash_size = ?',
+            ((self._run_stamp, *key) for key in self._used_hashes)
+        )
+        self._conn.executemany(
+            'UPDATE dirs SET last_used = ? WHERE path = ? AND validation = ?',
+            ((self._run_stamp, *key) for key in self._used_dirs)
+        )
+        self._conn.commit()
+        self._evict()
+        self._conn.close()
+
+    def _db_size(self) -> int:
+        page_count = self._conn.execute('PRAGMA page_count').fetchone()[0]
+        freelist_count = self._conn.execute('PRAGMA freelist_count').fetchone()[0]
+        page_size = self._conn.execute('PRAGMA page_size').fetchone()[0]
+        return (page_count - freelist_count) * page_size
+
+    def _evict(self) -> None:
+        db_size = self._db_size()
+        if db_size <= self.max_size:
+            return
+
+        # Evict down to 3/4 of the size limit so that eviction (and the following VACUUM) does not run on every close
+        keep_ratio = 0.75 * self.max_size / db_size
+        for table in ('files', 'hashes', 'dirs'):
+            row_count = self._conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+            evict_count = row_count - int(row_count * keep_ratio)
+            self._conn.execute(
+                f'DELETE FROM {table} WHERE rowid IN ('
+                f'SELECT rowid FROM {table} ORDER BY last_used LIMIT ?'
+                f')',
+                (evict_count,)
+            )
+        self._conn.commit()
+        self._conn.execute('VACUUM')
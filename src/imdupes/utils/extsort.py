@@ -0,0 +1,251 @@
+import os
+import heapq
+import shutil
+import struct
+import tempfile
+from collections.abc import Iterable, Iterator
+
+from utils.globs import HashingMethod
+from utils.globs import HASH_DIGEST_SIZE
+from utils.globs import EXTERNAL_MAX_MERGE_RUNS, EXTERNAL_CHUNK_SIZE, EXTERNAL_RECORD_OVERHEAD
+from utils.results import DupResults
+
+# Records are sorted as bytes, by a fixed-size key prefix: (digest, entry) while grouping identical digests, then
+# (first entry of the cluster, inverted resolution, entry) while ordering duplications like group_dups()
+_KEY_SIZE = HASH_DIGEST_SIZE + 8
+_CLUSTER_KEY_SIZE = 24
+_PAYLOAD = struct.Struct(f'<{HASH_DIGEST_SIZE}sQIIQqH')  # digest, entry, width, height, file size, mtime, format size
+_LENGTH = struct.Struct('<I')
+_NO_FORMAT = 0xFFFF
+_MAX_RESOLUTION = (1 << 64) - 1
+
+
+def _pack(
+        key: bytes,
+        digest: bytes,
+        entry: int,
+        width: int,
+        height: int,
+        file_size: int,
+        mtime_ns: int,
+        file_format: str | None,
+        path: str
+) -> bytes:
+    format_bytes = file_format.encode() if file_format is not None else b''
+    return b''.join((
+        key,
+        _PAYLOAD.pack(
+            digest, entry, width, height, file_size, mtime_ns,
+            len(format_bytes) if file_format is not None else _NO_FORMAT
+        ),
+        format_bytes,
+        path.encode(errors='surrogateescape')
+    ))
+
+
+def _unpack(record: bytes, key_size: int) -> tuple[bytes, int, int, int, int, int, str | None, str]:
+    digest, entry, width, height, file_size, mtime_ns, format_size = _PAYLOAD.unpack_from(record, key_size)
+    offset = key_size + _PAYLOAD.size
+    if format_size == _NO_FORMAT:
+        file_format = None
+    else:
+        file_format = record[offset:offset + format_size].decode()
+        offset += format_size
+    return (
+        digest, entry, width, height, file_size, mtime_ns, file_format,
+        record[offset:].decode(errors='surrogateescape')
+    )
+
+
+class _RunSorter:
+    """
+    Sorts records (bytes) that may not fit in memory: records are buffered until they take @memory_limit bytes, then
+    sorted and written to a run file of @tmp_dir. Sorted records are read back through a k-way merge of the runs,
+    merging at most @max_merge_runs runs at once (in several passes if needed), so that the number of open files is
+    bounded too.
+    """
+
+    def __init__(self, tmp_dir: str, memory_limit: int, max_merge_runs: int = EXTERNAL_MAX_MERGE_RUNS):
+        self.tmp_dir = tmp_dir
+        self.memory_limit = memory_limit
+        self.max_merge_runs = max(2, max_merge_runs)
+        self.run_count = 0
+        self._runs: list[str] = []
+        self._buffer: list[bytes] = []
+        self._buffer_size = 0
+
+    def add(self, record: bytes) -> None:
+        self._buffer.append(record)
+        self._buffer_size += len(record) + EXTERNAL_RECORD_OVERHEAD
+        if self._buffer_size >= self.memory_limit:
+            self._spill()
+
+    def _write_run(self, records: Iterable[bytes]) -> str:
+        fd, run = tempfile.mkstemp(prefix='run-', dir=self.tmp_dir)
+        self.run_count += 1
+        with open(fd, 'wb') as f:
+            for record in records:
+                f.write(_LENGTH.pack(len(record)))
+                f.write(record)
+        return run
+
+    def _spill(self) -> None:
+        self._buffer.sort()
+        self._runs.append(self._write_run(self._buffer))
+        self._buffer = []
+        self._buffer_size = 0
+
+    @staticmethod
+    def _read_run(run: str) -> Iterator[bytes]:
+        try:
+            with open(run, 'rb') as f:
+                while length_bytes := f.read(_LENGTH.size):
+                    yield f.read(_LENGTH.unpack(length_bytes)[0])
+        finally:
+            os.remove(run)
+
+    def sorted(self) -> Iterator[bytes]:
+        """
+        Returns every added record in sorted order. Records are only buffered in memory if none were written to runs.
+        """
+
+        if len(self._runs) == 0:
+            self._buffer.sort()
+            records, self._buffer, self._buffer_size = self._buffer, [], 0
+            return iter(records)
+        if len(self._buffer) > 0:
+            self._spill()
+        while len(self._runs) > self.max_merge_runs:
+            merged_runs, self._runs = self._runs[:self.max_merge_runs], self._runs[self.max_merge_runs:]
+            self._runs.append(self._write_run(heapq.merge(*(self._read_run(run) for run in merged_runs))))
+        runs, self._runs = self._runs, []
+        return heapq.merge(*(self._read_run(run) for run in runs))
+
+
+class DupRuns:
+    """
+    Bounded-memory counterpart of DupResults (see detect_dup_images_methods() with a memory limit) for scans too large
+    to keep every hashed image in memory. Hashed images are added as records (digest, path and image metadata) to
+    sorted runs on disk, in a temporary directory of @tmp_dir (the system temporary directory if None), whenever they
+    take more than @memory_limit bytes in memory.
+
+    grouped() then emits the duplications through an external sort: a k-way merge of the runs groups identical digests
+    and only keeps the groups with more than one member, which are sorted again in order of their first image and of
+    decreasing resolution. Duplications are thus emitted in the same order and with the same keys as group_dups() would
+    return them, a chunk at a time, so that memory usage does not grow with the number of images nor of duplications.
+    Full hashes are not kept, so near-duplicates (Hamming distance threshold) cannot be grouped.
+    """
+
+    def __init__(
+            self,
+            method: HashingMethod | None = None,
+            hash_size: int | None = None,
+            reduced_decoding: bool = False,
+            memory_limit: int = 0,
+            tmp_dir: str = None,
+            max_merge_runs: int = EXTERNAL_MAX_MERGE_RUNS
+    ):
+        self.method = method
+        self.hash_size = hash_size
+        self.reduced_decoding = reduced_decoding
+        self.memory_limit = memory_limit
+        self.max_merge_runs = max_merge_runs
+        self.tmp_dir = tempfile.mkdtemp(prefix='imdupes-', dir=tmp_dir)
+        self.entry_count = 0
+        self._sorter = _RunSorter(self.tmp_dir, memory_limit, max_merge_runs)
+
+    @property
+    def run_count(self) -> int:
+        """
+        Returns the number of runs written to disk so far.
+        """
+
+        return self._sorter.run_count
+
+    def add(
+            self,
+            path: str,
+            width: int,
+            height: int,
+            file_size: int = 0,
+            file_format: str | None = None,
+            mtime_ns: int = 0,
+            digest: bytes | None = None,
+            image_hash: bytes | None = None
+    ) -> int:
+        digest = digest if digest is not None else bytes(HASH_DIGEST_SIZE)
+        entry = self.entry_count
+        self._sorter.add(_pack(
+            digest + entry.to_bytes(8, 'big'), digest, entry, width, height, file_size, mtime_ns, file_format, path
+        ))
+        self.entry_count += 1
+        return entry
+
+    def _clustered_records(self) -> Iterator[bytes]:
+        """
+        Returns the records of every image sharing its digest with another, keyed by cluster then decreasing resolution.
+        """
+
+        sorter = _RunSorter(self.tmp_dir, self.memory_limit, self.max_merge_runs)
+        group_digest = None
+        group_entry = None
+        first_record = None  # Record of the first image of the current group, until a second image shows up
+        for record in self._sorter.sorted():
+            digest, entry, width, height = _PAYLOAD.unpack_from(record, _KEY_SIZE)[:4]
+            if digest != group_digest:
+                group_digest, group_entry, first_record = digest, entry, record
+                continue
+            if first_record is not None:
+                first_width, first_height = _PAYLOAD.unpack_from(first_record, _KEY_SIZE)[2:4]
+                sorter.add(
+                    self._cluster_key(group_entry, group_entry, first_width, first_height) + first_record[_KEY_SIZE:]
+                )
+                first_record = None
+            sorter.add(self._cluster_key(group_entry, entry, width, height) + record[_KEY_SIZE:])
+        return sorter.sorted()
+
+    @staticmethod
+    def _cluster_key(first_entry: int, entry: int, width: int, height: int) -> bytes:
+        return b''.join((
+            first_entry.to_bytes(8, 'big'),
+            (_MAX_RESOLUTION - width * height).to_bytes(8, 'big'),
+            entry.to_bytes(8, 'big')
+        ))
+
+    def grouped(self, chunk_size: int = EXTERNAL_CHUNK_SIZE) -> Iterator[DupResults]:
+        """
+        Groups the added images into duplications, yielding them in order as DupResults of consecutive duplications,
+        each holding about @chunk_size files (duplications are never split across chunks). Runs are consumed, so the
+        images can only be grouped once.
+        """
+
+        chunk = DupResults(self.method, self.hash_size, self.reduced_decoding)
+        keys: list[bytes] = []
+        clusters: list[range] = []
+        cluster_first_entry = None
+        for record in self._clustered_records():
+            first_entry = int.from_bytes(record[:8], 'big')
+            digest, _, width, height, file_size, mtime_ns, file_format, path = _unpack(record, _CLUSTER_KEY_SIZE)
+            if first_entry != cluster_first_entry:
+                if chunk.entry_count >= chunk_size:
+                    yield chunk.clustered(keys, clusters)
+                    chunk = DupResults(self.method, self.hash_size, self.reduced_decoding)
+                    keys, clusters = [], []
+                cluster_first_entry = first_entry
+                keys.append(digest)
+                clusters.append(range(chunk.entry_count, chunk.entry_count))
+            chunk.add(
+                path, width, height, file_size=file_size, file_format=file_format, mtime_ns=mtime_ns, digest=digest
+            )
+            clusters[-1] = range(clusters[-1].start, chunk.entry_count)
+        if len(keys) > 0:
+            yield chunk.clustered(keys, clusters)
+
+    def close(self) -> None:
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def __enter__(self) -> 'DupRuns':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
@@ -1,64 +1,316 @@
 from sys import exit
+import io
 import os
 import re
+import sys
+import mmap
+import errno
+import ctypes
+import ctypes.util
+import time
+import hashlib
+import threading
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor, Future
+from tqdm import tqdm
 from termcolor import cprint, colored
 
 from utils.globs import SUPPORTED_FILE_EXTS
+from utils.globs import DEFAULT_INDEX_THREADS, INDEX_MAX_PREFETCH_DIRS
 from utils.globs import INTERACTIVE_OPTS
+from utils.globs import CleanAction
+from utils.globs import DEFAULT_CLEAN_THREADS
 from utils.globs import PathFormat, format_path
-from utils.imutils import ImageFileWrapper
+from utils.results import DupResults
+from utils.journal import CleanJournal, backup_path, temp_path
+from utils import sizeof_fmt
+
+
+DirListing = tuple[list[tuple[os.DirEntry, bool]], list[str]]
+
+
+def is_image_filename(filename: str) -> bool:
+    return os.path.splitext(filename)[1].lower()[1:] in SUPPORTED_FILE_EXTS
+
+
+def map_file(path: str) -> mmap.mmap | None:
+    """
+    Memory-maps a whole file read-only, so that it can be digested, or read through a MappedFile (e.g. by Image.open()),
+    without read() system calls nor copies into read buffers. Returns None if the file cannot be mapped (e.g. empty and
+    special files, or filesystems without mmap support), or opened, in which case it should be read as usual instead.
+
+    Mapped files must not be truncated while they are mapped, which would crash the process reading them.
+    """
+
+    try:
+        with open(path, 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+
+class MappedFile(io.RawIOBase):
+    """
+    Read-only binary file object over a memory mapping of a file (see map_file()), which owns and closes the mapping.
+    Unlike mmap objects, it can be seeked past the end of the file like regular files (e.g. by Image.open()), and reads
+    are sliced directly from the mapping.
+    """
+
+    def __init__(self, mapped: mmap.mmap):
+        super().__init__()
+        self._mapped = mapped
+        self._view = memoryview(mapped)
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self._view[self._pos:self._pos + len(buffer)]
+        buffer[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self._view) if size is None or size < 0 else self._pos + size
+        data = self._view[self._pos:end].tobytes()
+        self._pos += len(data)
+        return data
+
+    def readall(self) -> bytes:
+        return self.read()
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        pos = offset + (0, self._pos, len(self._view))[whence]
+        if pos < 0:
+            raise ValueError(f'negative seek value {pos}')
+        self._pos = pos
+        return pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self) -> None:
+        if not self.closed:
+            self._view.release()
+            self._mapped.close()
+        super().close()
+
+
+def shard_of(path: str, root: str, shard_count: int) -> int:
+    """
+    Returns the shard (from 0 to @shard_count - 1) of the image at @path, from a digest of its path relative to the
+    scanned directory @root, so that every node scanning the same tree agrees on it wherever the tree is mounted.
+    """
+
+    rel_path = os.path.relpath(path, root).replace(os.sep, '/')
+    digest = hashlib.blake2b(rel_path.encode(errors='surrogateescape'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % shard_count
+
+
+class _PrefetchedDir:
+    __slots__ = ('path', 'future', 'sub_dirs')
+
+    def __init__(self, path: str):
+        self.path = path
+        self.future: Future | None = None
+        self.sub_dirs: list['_PrefetchedDir'] | None = None
+
+
+class ImageDirWalker:
+    """
+    Walks a directory with os.scandir(), top-down and in directory listing order like os.walk(), reusing the file type
+    information of each directory entry instead of calling os.path.isfile() per file.
+
+    Iterating yields each file with a supported image extension, and each file with a filename matching @exclude
+    (flagged as excluded), as (os.DirEntry, excluded) tuples.
+
+    With more than one @threads, directories are listed ahead of the walk by a thread pool: as soon as a directory is
+    listed, its subdirectories are submitted to the pool, as long as no more than INDEX_MAX_PREFETCH_DIRS listed
+    directories are waiting to be walked. This hides the latency of each directory listing (e.g. on network
+    filesystems), while the output order stays the same as a sequential walk.
+    """
+
+    def __init__(self, directory: str, exclude: str = None, recursive: bool = False, threads: int = 1):
+        self.directory = directory
+        self.exclude_pattern = None if exclude is None else re.compile(exclude)
+        self.recursive = recursive
+        self.threads = threads
+        self.dir_count = 0
+
+    def _list_dir(self, path: str) -> DirListing:
+        images = []
+        sub_dirs = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if self.recursive:
+                        sub_dirs.append(entry.path)
+                    continue
+                if not entry.is_file():
+                    continue
+
+                if self.exclude_pattern is not None and self.exclude_pattern.search(entry.name) is not None:
+                    images.append((entry, True))
+                    continue
+
+                if is_image_filename(entry.name):
+                    images.append((entry, False))
+        return images, sub_dirs
+
+    def __iter__(self) -> Iterator[tuple[os.DirEntry, bool]]:
+        if self.threads > 1 and self.recursive:
+            yield from self._walk_parallel()
+            return
+
+        dir_stack = [self.directory]
+        while len(dir_stack) > 0:
+            curr_dir = dir_stack.pop()
+            try:
+                images, sub_dirs = self._list_dir(curr_dir)
+            except OSError:
+                if curr_dir == self.directory:
+                    raise
+                continue  # Unreadable subdirectories are skipped, like os.walk() does
+            self.dir_count += 1
+            yield from images
+            dir_stack.extend(reversed(sub_dirs))
+
+    def _walk_parallel(self) -> Iterator[tuple[os.DirEntry, bool]]:
+        lock = threading.RLock()
+        prefetched_count = 0
+        stopped = False
+        executor = ThreadPoolExecutor(max_workers=self.threads)
+
+        def submit(path: str) -> _PrefetchedDir:
+            nonlocal prefetched_count
+            prefetched_dir = _PrefetchedDir(path)
+            prefetched_count += 1
+            prefetched_dir.future = executor.submit(self._list_dir, path)
+            prefetched_dir.future.add_done_callback(lambda _: prefetch_sub_dirs(prefetched_dir))
+            return prefetched_dir
+
+        def prefetch_sub_dirs(prefetched_dir: _PrefetchedDir, force: bool = False) -> None:
+            with lock:
+                if stopped or prefetched_dir.sub_dirs is not None:
+                    return
+                if not force and prefetched_count >= INDEX_MAX_PREFETCH_DIRS:
+                    return  # Left for the walk to submit once it reaches this directory
+                if prefetched_dir.future.exception() is not None:
+                    prefetched_dir.sub_dirs = []
+                    return
+                prefetched_dir.sub_dirs = [submit(sub_dir) for sub_dir in prefetched_dir.future.result()[1]]
+
+        try:
+            with lock:
+                dir_stack = [submit(self.directory)]
+            while len(dir_stack) > 0:
+                prefetched_dir = dir_stack.pop()
+                try:
+                    images, _ = prefetched_dir.future.result()
+                except OSError:
+                    if prefetched_dir.path == self.directory:
+                        raise
+                    images = []  # Unreadable subdirectories are skipped, like os.walk() does
+                else:
+                    self.dir_count += 1
+                with lock:
+                    prefetched_count -= 1
+                prefetch_sub_dirs(prefetched_dir, force=True)
+                yield from images
+                dir_stack.extend(reversed(prefetched_dir.sub_dirs))
+        finally:
+            with lock:
+                stopped = True
+            executor.shutdown(cancel_futures=True)
+
+
+def iter_images(
+        directory: str,
+        exclude: str = None,
+        recursive: bool = False,
+        verbose: int = 0,
+        output_path_format: PathFormat = PathFormat.DIR_RELATIVE,
+        threads: int = DEFAULT_INDEX_THREADS,
+        shard: tuple[int, int] = None
+) -> Iterator[os.DirEntry]:
+    """
+    Lazily indexes the images of @directory, so that they can be processed while the directory is still being walked.
+
+    Yields os.DirEntry objects, whose paths are absolute and whose stat() results are cached. With a @shard (shard,
+    shard count), only the images of that shard are yielded (see shard_of()). The same summary as index_images() is
+    printed once the walk is over, above the progress bar of the images being processed, if any.
+    """
+
+    image_count = 0
+    yielded_count = 0
+    walker = ImageDirWalker(os.path.abspath(directory), exclude=exclude, recursive=recursive, threads=threads)
+    start_time = time.perf_counter()
+    for entry, excluded in walker:
+        if excluded:
+            if verbose > 1:
+                tqdm.write(f'Excluded file: "{format_path(entry.path, output_path_format, directory)}"', file=sys.stdout)
+            continue
+        image_count += 1
+        if shard is None or shard_of(entry.path, walker.directory, shard[1]) == shard[0]:
+            yielded_count += 1
+            yield entry
+
+    # An empty shard of a directory with images is not an error, its (empty) results are still worth merging
+    if image_count == 0:
+        cprint(f'"{directory}" has no valid image files. Program terminated.', 'red')
+        exit()
+
+    if verbose > 0:
+        elapsed_time = time.perf_counter() - start_time
+        tqdm.write(
+            f'Indexing images... Found {colored(str(yielded_count), attrs=["bold"])} image(s) '
+            f'in {colored(str(walker.dir_count), attrs=["bold"])} director{"y" if walker.dir_count == 1 else "ies"} '
+            f'({walker.dir_count / max(elapsed_time, 1e-6):.1f} directories/s) '
+            f'{colored("[DONE]", color="green", attrs=["bold"])}',
+            file=sys.stdout
+        )
 
 
-# noinspection DuplicatedCode
 def index_images(
         directory: str,
         exclude: str = None,
         recursive: bool = False,
         verbose: int = 0,
-        output_path_format: PathFormat = PathFormat.DIR_RELATIVE
-) -> list[str]:
+        output_path_format: PathFormat = PathFormat.DIR_RELATIVE,
+        threads: int = DEFAULT_INDEX_THREADS,
+        shard: tuple[int, int] = None
+) -> list[os.DirEntry]:
+    """
+    Indexes the images of @directory as os.DirEntry objects, whose paths are absolute and whose stat() results are
+    cached. With a @shard (shard, shard count), only the images of that shard are indexed (see shard_of()).
+    """
+
     excluded_count = 0
+    image_count = 0
     img_paths = []
-    abs_root = os.path.abspath(directory)
-    exclude_pattern = None if exclude is None else re.compile(exclude)
+    walker = ImageDirWalker(os.path.abspath(directory), exclude=exclude, recursive=recursive, threads=threads)
 
     if verbose > 0:
         print('Indexing images...', end='', flush=True)
 
-    if recursive:
-        for root, dirs, files in os.walk(abs_root):
-            for file in files:
-                file_path = os.path.join(root, file)
-                file_name = os.path.basename(file_path)
-                if exclude_pattern is not None and exclude_pattern.search(file_name) is not None:
-                    if verbose > 1:
-                        if excluded_count == 0:
-                            print()
-                        print(f'Excluded file: "{format_path(file_path, output_path_format, directory)}"')
-                    excluded_count += 1
-                    continue
-
-                file_extension = os.path.splitext(file)[1].lower()[1:]
-                if file_extension in SUPPORTED_FILE_EXTS:
-                    img_paths.append(file_path)
-    else:
-        for file in os.listdir(abs_root):
-            file_path = os.path.join(abs_root, file)
-            if os.path.isfile(file_path):
-                file_name = os.path.basename(file_path)
-                if exclude_pattern is not None and exclude_pattern.search(file_name) is not None:
-                    if verbose > 1:
-                        if excluded_count == 0:
-                            print()
-                        print(f'Excluded file: "{format_path(file_path, output_path_format, directory)}"')
-                    excluded_count += 1
-                    continue
-
-                file_extension = os.path.splitext(file)[1].lower()[1:]
-                if file_extension in SUPPORTED_FILE_EXTS:
-                    img_paths.append(file_path)
+    start_time = time.perf_counter()
+    for entry, excluded in walker:
+        if excluded:
+            if verbose > 1:
+                if excluded_count == 0:
+                    print()
+                print(f'Excluded file: "{format_path(entry.path, output_path_format, directory)}"')
+            excluded_count += 1
+            continue
+        image_count += 1
+        if shard is None or shard_of(entry.path, walker.directory, shard[1]) == shard[0]:
+            img_paths.append(entry)
 
-    if len(img_paths) == 0:
+    if image_count == 0:
         cprint(f'"{directory}" has no valid image files. Program terminated.', 'red')
         exit()
 
@@ -66,8 +318,11 @@ def index_images(
         cprint(' No file(s) excluded.', 'yellow', end='')
 
     if verbose > 0:
+        elapsed_time = time.perf_counter() - start_time
         print(
             f'{" " if excluded_count == 0 else ""}Found {colored(str(len(img_paths)), attrs=["bold"])} image(s) '
+            f'in {colored(str(walker.dir_count), attrs=["bold"])} director{"y" if walker.dir_count == 1 else "ies"} '
+            f'({walker.dir_count / max(elapsed_time, 1e-6):.1f} directories/s) '
             f'{colored("[DONE]", color="green", attrs=["bold"])}',
             flush=True
         )
@@ -75,13 +330,208 @@ def index_images(
     return img_paths
 
 
+FICLONE = 0x40049409  # Linux ioctl cloning a whole file, from <linux/fs.h>
+
+_CLEAN_VERBS = {  # Past tense and present participle of each clean action, for console output
+    CleanAction.DELETE: ('Deleted', 'deleting'),
+    CleanAction.HARDLINK: ('Hardlinked', 'hardlinking'),
+    CleanAction.REFLINK: ('Reflinked', 'reflinking'),
+}
+
+
+def reflink(src: str, dst: str) -> None:
+    """
+    Creates a new file at @dst sharing the data blocks of the file at @src (copy-on-write), on filesystems that support
+    it (e.g. Btrfs, XFS, ZFS on Linux, and APFS on MacOS).
+
+    Raises OSError if the filesystem or the platform does not support reflinks.
+    """
+
+    if sys.platform.startswith('linux'):
+        import fcntl
+        with open(src, 'rb') as src_file, open(dst, 'xb') as dst_file:
+            try:
+                fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+            except OSError:
+                os.remove(dst)
+                raise
+    elif sys.platform == 'darwin':
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.clonefile.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_uint32]
+        if libc.clonefile(os.fsencode(src), os.fsencode(dst), 0) != 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), dst)
+    else:
+        raise OSError(errno.ENOTSUP, 'Reflinks are not supported on this platform', dst)
+
+
+def _clean_file(dup_path: str, kept_path: str, action: CleanAction, journaled: bool = False) -> int:
+    """
+    Cleans the duplicated image at @dup_path with @action, replacing it by a link to @kept_path if it is a link action.
+    Links are created under a temporary file first, so that a failed link leaves the duplicated image untouched, and a
+    successful one replaces it atomically. When @journaled, the duplicated image is moved to its backup file instead of
+    being deleted (see CleanJournal), and cleans interrupted after moving it are completed.
+
+    Returns the number of bytes reclaimed by cleaning the duplicated image, which is always 0 when @journaled, as the
+    space is only reclaimed once backups are deleted.
+    """
+
+    def link(path: str) -> None:
+        if os.path.lexists(path):
+            os.remove(path)  # Left over by an interrupted clean
+        if action == CleanAction.HARDLINK:
+            os.link(kept_path, path)
+        else:
+            reflink(kept_path, path)
+
+    backup = backup_path(dup_path) if journaled else None
+    if backup is not None and os.path.lexists(backup):
+        # Moved by an interrupted clean, which may not have linked it yet
+        if action != CleanAction.DELETE and not os.path.lexists(dup_path):
+            link(temp_path(dup_path))
+            os.replace(temp_path(dup_path), dup_path)
+        return 0
+
+    dup_stat = os.lstat(dup_path)
+    if action != CleanAction.DELETE:
+        kept_stat = os.stat(kept_path)
+        if (kept_stat.st_dev, kept_stat.st_ino) == (dup_stat.st_dev, dup_stat.st_ino):
+            return 0  # Already a hardlink to the kept image
+        link(temp_path(dup_path))
+
+    try:
+        if backup is not None:
+            os.rename(dup_path, backup)
+        elif action == CleanAction.DELETE:
+            os.remove(dup_path)
+        if action != CleanAction.DELETE:
+            os.replace(temp_path(dup_path), dup_path)
+    except OSError:
+        if action != CleanAction.DELETE and os.path.lexists(temp_path(dup_path)):
+            os.remove(temp_path(dup_path))
+        raise
+
+    # Files with other hardlinks keep their data
+    return dup_stat.st_size if backup is None and dup_stat.st_nlink == 1 else 0
+
+
+def _clean_clusters(
+        clusters: list[list[str]],
+        action: CleanAction,
+        journal: CleanJournal | None,
+        threads: int,
+        verbose: int,
+        root_dir: str | None,
+        output_path_format: PathFormat
+) -> tuple[int, int]:
+    """
+    Cleans every file of @clusters but the first one of each, from @threads threads each cleaning one cluster at a
+    time, skipping the files already cleaned according to @journal. Returns the number of cleaned files and the number
+    of reclaimed bytes.
+    """
+
+    past_verb, participle = _CLEAN_VERBS[action]
+
+    def clean_cluster(cluster_index: int) -> tuple[int, int]:
+        cluster = clusters[cluster_index]
+        cleaned_count = reclaimed_size = 0
+        for file_index, dup_img_path in enumerate(cluster[1:], start=1):
+            if journal is not None and (cluster_index, file_index) in journal.done:
+                cleaned_count += 1
+                continue
+            try:
+                reclaimed_size += _clean_file(dup_img_path, cluster[0], action, journaled=journal is not None)
+                if journal is not None:
+                    journal.mark_done(cluster_index, file_index)
+                if verbose > 0:
+                    print(f'-- {past_verb} "{format_path(dup_img_path, output_path_format, root_dir)}"', flush=True)
+                cleaned_count += 1
+            except (OSError, PermissionError) as error:
+                cprint(
+                    f'Error {participle} file '
+                    f'"{format_path(dup_img_path, output_path_format, root_dir)}": {str(error)}',
+                    'red'
+                )
+        return cleaned_count, reclaimed_size
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(clean_cluster, range(len(clusters))))
+    return sum(count for count, _ in results), sum(size for _, size in results)
+
+
+def _commit_clean(journal: CleanJournal) -> int:
+    """
+    Deletes the backup files of a journaled clean, then the journal itself, and returns the number of reclaimed bytes.
+    The journal is kept if any backup file cannot be deleted, so that committing can be retried by resuming it.
+    """
+
+    journal.mark_committing()
+    reclaimed_size = 0
+    failed = False
+    for cluster in journal.clusters:
+        for dup_img_path in cluster[1:]:
+            backup = backup_path(dup_img_path)
+            try:
+                backup_stat = os.lstat(backup)
+            except FileNotFoundError:
+                continue  # Not cleaned, already linked, or already committed
+            try:
+                os.remove(backup)
+                reclaimed_size += backup_stat.st_size if backup_stat.st_nlink == 1 else 0
+            except (OSError, PermissionError) as error:
+                cprint(f'Error deleting file "{backup}": {str(error)}', 'red')
+                failed = True
+    journal.close(remove=not failed)
+    if failed:
+        cprint(f'Clean not fully committed, clean "{journal.file}" again to retry', 'red')
+    return reclaimed_size
+
+
+def _print_clean_done(
+        action: CleanAction,
+        cleaned_count: int,
+        total_files_count: int,
+        dups_count: int,
+        reclaimed_size: int
+) -> None:
+    print(
+        f'{_CLEAN_VERBS[action][0]} '
+        f'{colored(str(cleaned_count), attrs=["bold"])}/{colored(str(total_files_count), attrs=["bold"])} '
+        f'files (kept {colored(str(total_files_count - cleaned_count), attrs=["bold"])}) '
+        f'in {colored(str(dups_count), attrs=["bold"])} duplication(s), '
+        f'reclaimed {colored(sizeof_fmt(reclaimed_size), attrs=["bold"])} '
+        f'{colored("[DONE]", color="green", attrs=["bold"])}', flush=True
+    )
+
+
+def _open_journal(journal_file: str) -> CleanJournal:
+    try:
+        return CleanJournal.open(journal_file)
+    except (ValueError, OSError, PermissionError) as error:
+        cprint(f"Error reading file '{journal_file}': {error.__str__()}\nProgram terminated.", 'red')
+        exit()
+
+
 def clean(
-        dups: list[list[ImageFileWrapper]],
+        dups: DupResults,
         root_dir: str = None,
         interactive: bool = False,
         verbose: int = 0,
-        output_path_format: PathFormat = PathFormat.DIR_RELATIVE
+        output_path_format: PathFormat = PathFormat.DIR_RELATIVE,
+        action: CleanAction = CleanAction.DELETE,
+        threads: int = DEFAULT_CLEAN_THREADS,
+        journal_file: str = None
 ) -> None:
+    """
+    Cleans every image of @dups but the first (highest resolution) one of each duplication, or the images chosen by the
+    user one at a time with @interactive (delete action only), by deleting them or, with a link @action, by replacing
+    them with a hardlink or a reflink to the kept image, so that their paths remain valid. Duplications are cleaned
+    from @threads threads at once, as cleaning mostly waits on storage.
+
+    With a @journal_file, the clean is journaled (see CleanJournal), so that it can be resumed with resume_clean(), or
+    rolled back with rollback_clean() if it is interrupted.
+    """
+
     if len(dups) == 0:
         print(f'No duplications to clean', flush=True)
         return
@@ -90,70 +540,147 @@ def clean(
         print(f'\nCleaning duplications...', flush=True)
 
     del_count = 0
-    total_files_count = sum(len(lst) for lst in dups)
+    reclaimed_size = 0
+    total_files_count = dups.file_count
+
+    if not interactive:
+        clusters = [dups.cluster_paths(cluster_id) for cluster_id in range(len(dups))]
+        journal = None
+        if journal_file is not None:
+            try:
+                journal = CleanJournal.create(journal_file, action, clusters)
+            except (OSError, PermissionError) as error:
+                cprint(f"Error writing file '{journal_file}': {error.__str__()}\nProgram terminated.", 'red')
+                exit()
+            clusters = journal.clusters
+        del_count, reclaimed_size = _clean_clusters(
+            clusters, action, journal, threads, verbose, root_dir, output_path_format
+        )
+        if journal is not None:
+            reclaimed_size = _commit_clean(journal)
+        if verbose > 0:
+            _print_clean_done(action, del_count, total_files_count, len(dups), reclaimed_size)
+        return
 
     def print_done():
+        _print_clean_done(action, del_count, total_files_count, len(dups), reclaimed_size)
+
+    for dup_imgs_index in range(1, len(dups) + 1):
+        dup_img_paths = dups.cluster_paths(dup_imgs_index - 1)
+        print(colored(f'\n[ DUPLICATION {dup_imgs_index}/{len(dups)} ]', 'magenta', attrs=['bold']))
+        for dup_img_index, dup_img_path in enumerate(dup_img_paths, start=1):
+            while True:
+                choices = '\n    '.join(f'[{key.upper()}] {value}' for key, value in INTERACTIVE_OPTS.items())
+                choice = input(
+                    f'{colored(f"Image {dup_img_index}/{len(dup_img_paths)}:", "yellow")} Delete '
+                    f'"{format_path(dup_img_path, output_path_format, root_dir)}"?\n'
+                    f'    {colored(choices)}\n{colored(">>", "yellow", attrs=["bold"])} '
+                ).lower()
+
+                if choice in INTERACTIVE_OPTS.keys():
+                    if choice == 'y':
+                        try:
+                            reclaimed_size += _clean_file(dup_img_path, dup_img_paths[0], CleanAction.DELETE)
+                            if verbose > 0:
+                                print(f'-- Deleted "{format_path(dup_img_path, output_path_format, root_dir)}"')
+                            del_count += 1
+                        except (OSError, PermissionError) as error:
+                            cprint(
+                                f'Error deleting file '
+                                f'"{format_path(dup_img_path, output_path_format, root_dir)}": {str(error)}',
+                                'red'
+                            )
+                    if choice == 'x':
+                        cprint('Cleaning cancelled', 'red')
+                        print_done()
+                        return
+
+                    break
+
+                else:
+                    print('Invalid choice. Please choose a valid option.')
+
+    if verbose > 0:
+        print()
+        print_done()
+
+
+def resume_clean(
+        journal_file: str,
+        verbose: int = 0,
+        threads: int = DEFAULT_CLEAN_THREADS
+) -> None:
+    """
+    Resumes an interrupted journaled clean (see clean()), with the action it was started with, then commits it.
+    """
+
+    journal = _open_journal(journal_file)
+    if verbose > 0:
         print(
-            f'Deleted '
-            f'{colored(str(del_count), attrs=["bold"])}/{colored(str(total_files_count), attrs=["bold"])} '
-            f'files (kept {colored(str(total_files_count - del_count), attrs=["bold"])}) '
-            f'in {colored(str(len(dups)), attrs=["bold"])} duplication(s) '
-            f'{colored("[DONE]", color="green", attrs=["bold"])}', flush=True
+            f'Resuming clean of {colored(str(len(journal.clusters)), attrs=["bold"])} duplication(s) '
+            f'({colored(str(len(journal.done)), attrs=["bold"])} file(s) already cleaned)...',
+            flush=True
         )
 
-    for dup_imgs_index, dup_imgs in enumerate(dups, start=1):
-        if interactive:
-            print(colored(f'\n[ DUPLICATION {dup_imgs_index}/{len(dups)} ]', 'magenta', attrs=['bold']))
-            for dup_img_index, dup_img in enumerate(dup_imgs, start=1):
-                while True:
-                    choices = '\n    '.join(f'[{key.upper()}] {value}' for key, value in INTERACTIVE_OPTS.items())
-                    choice = input(
-                        f'{colored(f"Image {dup_img_index}/{len(dup_imgs)}:", "yellow")} Delete '
-                        f'"{format_path(dup_img.path, output_path_format, root_dir)}"?\n'
-                        f'    {colored(choices)}\n{colored(">>", "yellow", attrs=["bold"])} '
-                    ).lower()
-
-                    if choice in INTERACTIVE_OPTS.keys():
-                        if choice == 'y':
-                            try:
-                                os.remove(dup_img.path)
-                                if verbose > 0:
-                                    print(f'-- Deleted "{format_path(dup_img.path, output_path_format, root_dir)}"')
-                                del_count += 1
-                            except (OSError, PermissionError) as error:
-                                cprint(
-                                    f'Error deleting file '
-                                    f'"{format_path(dup_img.path, output_path_format, root_dir)}": {str(error)}',
-                                    'red'
-                                )
-                        if choice == 'x':
-                            cprint('Cleaning cancelled', 'red')
-                            print_done()
-                            return
-
-                        break
-
-                    else:
-                        print('Invalid choice. Please choose a valid option.')
+    del_count = len(journal.done)
+    if not journal.committing:
+        del_count, _ = _clean_clusters(
+            journal.clusters, journal.action, journal, threads, verbose, None, PathFormat.ABSOLUTE
+        )
+    reclaimed_size = _commit_clean(journal)
+    if verbose > 0:
+        _print_clean_done(
+            journal.action, del_count, sum(len(cluster) for cluster in journal.clusters), len(journal.clusters),
+            reclaimed_size
+        )
 
-        else:
-            for dup_index in range(1, len(dup_imgs)):
-                try:
-                    os.remove(dup_imgs[dup_index].path)
+
+def rollback_clean(
+        journal_file: str,
+        verbose: int = 0,
+        threads: int = DEFAULT_CLEAN_THREADS
+) -> None:
+    """
+    Rolls back an interrupted journaled clean (see clean()), moving every cleaned file back in place of the link that
+    replaced it, if any, then deletes the journal.
+    """
+
+    journal = _open_journal(journal_file)
+    if journal.committing:
+        journal.close()
+        cprint(
+            f'"{journal_file}": Clean already committed, its files cannot be restored, resume it to finish committing. '
+            f'Program terminated.', 'red'
+        )
+        exit()
+
+    def rollback_cluster(cluster: list[str]) -> tuple[int, bool]:
+        restored_count = 0
+        failed = False
+        for dup_img_path in cluster[1:]:
+            try:
+                if os.path.lexists(temp_path(dup_img_path)):
+                    os.remove(temp_path(dup_img_path))
+                if os.path.lexists(backup_path(dup_img_path)):
+                    os.replace(backup_path(dup_img_path), dup_img_path)
                     if verbose > 0:
-                        print(
-                            f'-- Deleted "{format_path(dup_imgs[dup_index].path, output_path_format, root_dir)}"',
-                            flush=True
-                        )
-                    del_count += 1
-                except (OSError, PermissionError) as error:
-                    cprint(
-                        f'Error deleting file '
-                        f'"{format_path(dup_imgs[dup_index].path, output_path_format, root_dir)}": {str(error)}',
-                        'red'
-                    )
+                        print(f'-- Restored "{dup_img_path}"', flush=True)
+                    restored_count += 1
+            except (OSError, PermissionError) as error:
+                cprint(f'Error restoring file "{dup_img_path}": {str(error)}', 'red')
+                failed = True
+        return restored_count, failed
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(rollback_cluster, journal.clusters))
+    failed = any(cluster_failed for _, cluster_failed in results)
+    # Kept on failure, so that rolling back can be retried
+    journal.close(remove=not failed)
 
     if verbose > 0:
-        if interactive:
-            print()
-        print_done()
+        print(
+            f'Restored {colored(str(sum(count for count, _ in results)), attrs=["bold"])} file(s) '
+            f'in {colored(str(len(journal.clusters)), attrs=["bold"])} duplication(s) '
+            f'{colored("[DONE]", color="green", attrs=["bold"])}',
+            flush=True
+        )
@@ -51,6 +51,11 @@ SUPPORTED_FILE_EXTS = [  # Refer to: https://pillow.readthedocs.io/en/stable/han
     'xpm',
 ]
 DUPFILE_EXT = 'imdup'
+DUPFILE_VERSION = 2
+INDEX_EXT = 'imidx'
+INDEX_VERSION = 1
+JOURNAL_EXT = 'imjournal'
+JOURNAL_VERSION = 1
 
 INTERACTIVE_OPTS = {
     'y': 'Yes',
@@ -71,9 +76,62 @@ class AutoHashSize(Enum):
     MAX_DIMS_MEAN = 'max-dims-mean'
     AVG_DIM = 'avg-dim'
     AVG_DIMS_MEAN = 'avg-dims-mean'
+    SAMPLED = 'sampled'
+
+
+class ValidationPolicy(Enum):
+    NONE = 'none'
+    HEADER = 'header'
+    FULL = 'full'
+
+
+class CleanAction(Enum):
+    DELETE = 'delete'
+    HARDLINK = 'hardlink'
+    REFLINK = 'reflink'
 
 
 DEFAULT_HASH_SIZE = 512
+REDUCED_DECODING_GAP = 4  # Minimum ratio between reduced-resolution decoding sizes and hashing resize targets
+JPEG2000_MAX_REDUCE = 5  # Decomposition levels of the default OpenJPEG encoder settings
+HASH_DIGEST_SIZE = 16  # Bytes; size of the folded digests that identical image hashes are grouped by
+MAX_JOB_CHUNK_SIZE = 64  # Maximum number of images submitted to a hashing worker process at once
+HASH_BATCH_MAX_SIZE = 64 * 1024 * 1024  # Bytes; working set of a batch of images hashed at once
+
+TUNE_HASH_SIZES = [8, 12, 16, 24, 32, 48, 64, 96, 128]  # Candidate hash sizes of the sampled hash size
+TUNE_SAMPLE_SIZE = 256  # Number of randomly sampled images hashed at every candidate hash size
+TUNE_SAMPLE_SEED = 0  # Fixed, so that the same images are sampled (and the same hash size is picked) on every run
+TUNE_MAX_COST_INCREASE = 0.25  # Maximum increase in decoding and hashing time per image over the smallest hash size
+TUNE_MAX_CHANGED = 0.02  # Maximum fraction of sampled images grouped differently than at the largest hash size
+
+DEFAULT_INDEX_THREADS = 4
+INDEX_MAX_PREFETCH_DIRS = 4096  # Maximum number of directories listed ahead of the directory walk
+DEFAULT_INFO_JOBS = 8  # Threads reading image headers in info mode
+PREFETCH_DEPTH = 8  # Default number of files read ahead of decoding by each hashing process, 0 disables read-ahead
+PREFETCH_MEMORY_BUDGET = 256 * 1024 * 1024  # Bytes; default memory of read-ahead buffers, shared by hashing processes
+PREFETCH_THREADS = 4  # Threads reading files ahead of decoding in each hashing process
+EXTERNAL_MAX_MERGE_RUNS = 256  # Maximum number of sorted runs merged at once (open files) by memory-limited scans
+EXTERNAL_CHUNK_SIZE = 4096  # Files per chunk of duplications emitted at once by memory-limited scans
+EXTERNAL_RECORD_OVERHEAD = 64  # Bytes; estimated memory of a buffered record beyond its own size (object and list slot)
+DEFAULT_CLEAN_THREADS = 8  # Threads cleaning duplications at once, mostly waiting on (network) storage
+CLEAN_BACKUP_SUFFIX = 'imdupes-backup'  # Journaled cleans move files to hidden .<name>.<suffix> files until committed
+CLEAN_TEMP_SUFFIX = 'imdupes-tmp'  # Links are created under hidden .<name>.<suffix> files, then moved in place
+
+WATCH_POLL_INTERVAL = 2.0  # Seconds between directory walks of the polling watcher
+WATCH_SETTLE_TIME = 0.5  # Seconds of filesystem events collected together before they are processed
+
+SERVE_HOST = '127.0.0.1'  # Only local clients may query the dedup service
+SERVE_PORT = 8765
+SERVE_MAX_REQUEST_SIZE = 256 * 1024 * 1024  # Bytes; largest query request body accepted by the dedup service
+
+PREFILTER_PARTIAL_SIZE = 4 * 1024  # Bytes read from both ends of a file for the partial content digest
+PREFILTER_CHUNK_SIZE = 1024 * 1024  # Bytes read at once for the full content digest
+
+CACHE_DIR_NAME = 'imdupes'
+CACHE_FILENAME = 'hashes.sqlite3'
+CACHE_MAX_SIZE = 512 * 1024 * 1024  # Bytes; least recently used entries are evicted past this size
+
+PROFILE_SLOWEST_FILES = 10  # Number of slowest files listed by the profiling report
 
 VERBOSE_LEVELS = [1, 2]
 PROGRESS_BAR_LEVELS = [0, 1, 2]
@@ -0,0 +1,65 @@
+class HammingIndex:
+    """
+    Multi-index hashing index for finding hashes within a Hamming distance of each other.
+
+    Every hash is split into @threshold + 1 disjoint bit segments, each of which is indexed in its own hash table. By the
+    pigeonhole principle, two hashes within @threshold bits of each other must have at least one identical segment, so
+    only hashes sharing a segment are compared. Candidates are compared as Python integers, whose XOR and
+    int.bit_count() popcount work over whole machine words at a time.
+
+    All hashes added to the index must have the same bit length.
+    """
+
+    def __init__(self, bit_length: int, threshold: int):
+        self.threshold = threshold
+        self.hashes: list[int] = []
+
+        segment_count = max(1, min(threshold + 1, bit_length))
+        bounds = [bit_length * i // segment_count for i in range(segment_count + 1)]
+        self._segments = [(bounds[i], (1 << (bounds[i + 1] - bounds[i])) - 1) for i in range(segment_count)]
+        self._tables: list[dict[int, list[int]]] = [{} for _ in range(segment_count)]
+
+    def add(self, hash_value: int) -> int:
+        hash_id = len(self.hashes)
+        self.hashes.append(hash_value)
+        for (shift, mask), table in zip(self._segments, self._tables):
+            table.setdefault((hash_value >> shift) & mask, []).append(hash_id)
+        return hash_id
+
+    def query(self, hash_value: int) -> list[int]:
+        candidates = set()
+        for (shift, mask), table in zip(self._segments, self._tables):
+            candidates.update(table.get((hash_value >> shift) & mask, ()))
+        return sorted(
+            hash_id for hash_id in candidates if (self.hashes[hash_id] ^ hash_value).bit_count() <= self.threshold
+        )
+
+
+def cluster_hashes(hashes: list[int], bit_length: int, threshold: int) -> list[list[int]]:
+    """
+    Groups hashes into clusters of hashes transitively connected by Hamming distances of at most @threshold bits, using
+    a HammingIndex to find neighbours and union-find to merge them.
+
+    Returns the clusters as lists of indices into @hashes, ordered by their first index.
+    """
+
+    parents = list(range(len(hashes)))
+
+    def find(i: int) -> int:
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    index = HammingIndex(bit_length, threshold)
+    for i, hash_value in enumerate(hashes):
+        for j in index.query(hash_value):
+            root_i, root_j = find(i), find(j)
+            if root_i != root_j:
+                parents[max(root_i, root_j)] = min(root_i, root_j)
+        index.add(hash_value)
+
+    clusters: dict[int, list[int]] = {}
+    for i in range(len(hashes)):
+        clusters.setdefault(find(i), []).append(i)
+    return list(clusters.values())
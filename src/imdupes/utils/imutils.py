@@ -1,10 +1,14 @@
 import os
 import sys
+import hashlib
+import functools
+import itertools
 from sys import exit
-import imagehash
+from typing import BinaryIO
+from concurrent.futures import ThreadPoolExecutor
 import numpy
 from imagehash import ImageHash, MeanFunc
-from PIL import Image
+from PIL import Image, ImageFile
 from tqdm.auto import tqdm
 from termcolor import cprint, colored
 
@@ -12,49 +16,264 @@ from utils import UnknownImageFormatError
 from utils import sizeof_fmt, loop_errprint
 from utils.globs import HashingMethod
 from utils.globs import AutoHashSize
+from utils.globs import ValidationPolicy
 from utils.globs import DEFAULT_HASH_SIZE
+from utils.globs import HASH_DIGEST_SIZE
+from utils.globs import HASH_BATCH_MAX_SIZE
+from utils.globs import JPEG2000_MAX_REDUCE
 from utils.globs import PROGRESS_BAR_LEVELS
 from utils.globs import PathFormat, format_path
+from utils.cache import HashCache, dir_fingerprint
 
 
-class ImageFileWrapper:
-    def __init__(self, image: Image = None, path: str = None):
-        self.image = image
-        self.path = path
+def set_validation_policy(validation: ValidationPolicy) -> None:
+    """
+    Applies the process-wide part of @validation: whether Pillow decodes truncated image data as far as possible
+    (ValidationPolicy.NONE) instead of failing. Pillow only has a global setting for it, shared by every thread of the
+    process, so it is set once per run (and in each hashing process) rather than by every open_image() call.
+    """
 
+    ImageFile.LOAD_TRUNCATED_IMAGES = validation == ValidationPolicy.NONE
 
-def hash_image(
-        image: Image,
-        method: HashingMethod,
-        hash_size: int = DEFAULT_HASH_SIZE
-) -> str:
-    if method == HashingMethod.HIST:
-        hash_value = imagehash.dhash(image, hash_size=hash_size).__str__()
-        hash_value += average_histogram_hash(image).__str__()
-        return hash_value
 
-    elif method == HashingMethod.BW:
-        return imagehash.dhash(image, hash_size=hash_size).__str__()
+def open_image(img_path: str | BinaryIO, validation: ValidationPolicy = ValidationPolicy.HEADER) -> Image:
+    """
+    Lazily opens an image file, only reading its header until the image data is accessed.
 
-    elif method == HashingMethod.RGB:
-        im = image if image.mode == 'RGB' else image.convert('RGB')
-        hash_value = imagehash.phash(im.getchannel('R'), hash_size=int(hash_size / 3)).__str__()
-        hash_value += imagehash.phash(im.getchannel('G'), hash_size=int(hash_size / 3)).__str__()
-        hash_value += imagehash.phash(im.getchannel('B'), hash_size=int(hash_size / 3)).__str__()
-        return hash_value
+    @validation ValidationPolicy.NONE decodes truncated image data as far as possible instead of failing, once applied
+    to the process with set_validation_policy(), ValidationPolicy.HEADER only relies on the errors raised while parsing
+    the header and decoding the image data, and ValidationPolicy.FULL additionally runs Image.verify() on the whole file
+    before reopening it.
 
-    elif method == HashingMethod.RGBA:
-        im = image if image.mode == 'RGBA' else image.convert('RGBA')
-        hash_value = imagehash.phash(im.getchannel('R'), hash_size=int(hash_size / 4)).__str__()
-        hash_value += imagehash.phash(im.getchannel('G'), hash_size=int(hash_size / 4)).__str__()
-        hash_value += imagehash.phash(im.getchannel('B'), hash_size=int(hash_size / 4)).__str__()
-        hash_value += imagehash.phash(im.getchannel('A'), hash_size=int(hash_size / 4)).__str__()
-        return hash_value
+    @img_path may also be a binary file object, which is read from its start.
+    """
 
+    if validation == ValidationPolicy.FULL:
+        with Image.open(img_path) as im:
+            im.verify()
+    if not isinstance(img_path, (str, os.PathLike)):
+        img_path.seek(0)
+    return Image.open(img_path)
+
+
+def hash_target_size(method: HashingMethod, hash_size: int = DEFAULT_HASH_SIZE) -> tuple[int, int]:
+    """
+    Returns the size that images are resized to by the dhash/phash of @method, before their hash bits are computed.
+    """
+
+    if method in (HashingMethod.HIST, HashingMethod.BW):
+        return hash_size + 1, hash_size
+    elif method == HashingMethod.RGB:
+        return int(hash_size / 3) * 4, int(hash_size / 3) * 4
+    elif method == HashingMethod.RGBA:
+        return int(hash_size / 4) * 4, int(hash_size / 4) * 4
     else:
         raise ValueError(f'Unknown HashingMethod "{method.value}"')
 
 
+def reduce_image(image: Image, size: tuple[int, int]) -> bool:
+    """
+    Configures the decoder of a lazily opened, not yet loaded image to decode it at the smallest reduced resolution
+    that is still at least @size: JPEG images through DCT scaling (Image.draft()), JPEG 2000 images through their
+    resolution levels, and pyramid TIFF images by seeking to their smallest large enough reduced-resolution page.
+
+    Returns whether a reduced resolution was configured. Image.size is updated accordingly, so the original size must
+    be read beforehand. Not every file supports every reduction (e.g. JPEG 2000 code streams with fewer resolution
+    levels), in which case loading the image raises an OSError and it must be reopened at full resolution.
+    """
+
+    if image.format == 'JPEG':
+        original_size = image.size
+        image.draft(image.mode, size)
+        return image.size != original_size
+
+    if image.format == 'JPEG2000':
+        factor = 0
+        while factor < JPEG2000_MAX_REDUCE \
+                and image.width >> (factor + 1) >= size[0] and image.height >> (factor + 1) >= size[1]:
+            factor += 1
+        if factor > 0:
+            image.reduce = factor
+        return factor > 0
+
+    if image.format == 'TIFF' and getattr(image, 'n_frames', 1) > 1:
+        best_frame = None
+        best_size = image.size
+        for frame in range(1, image.n_frames):
+            image.seek(frame)
+            is_reduced_page = image.tag_v2.get(254, 0) & 1  # NewSubfileType: reduced-resolution version of an image
+            if is_reduced_page and size[0] <= image.width < best_size[0] and size[1] <= image.height < best_size[1]:
+                best_frame = frame
+                best_size = image.size
+        image.seek(best_frame if best_frame is not None else 0)
+        return best_frame is not None
+
+    return False
+
+
+def pack_hashes(*image_hashes: ImageHash) -> bytes:
+    return b''.join(numpy.packbits(image_hash.hash.flatten()).tobytes() for image_hash in image_hashes)
+
+
+def fold_hash(image_hash: bytes) -> bytes:
+    """
+    Folds a packed image hash of any length into a fixed-size HASH_DIGEST_SIZE bytes digest, used for grouping identical
+    hashes without keeping the full hashes around.
+    """
+
+    return hashlib.blake2b(image_hash, digest_size=HASH_DIGEST_SIZE).digest()
+
+
+class HashBatch:
+    """
+    Batched hashing engine: each image is normalized once to the pixel grid its hash is computed from as it is added,
+    and the hashes of all added images are then computed at once on their stacked grids.
+
+    Hashes are bit-identical to the imagehash.dhash() (HashingMethod.HIST and HashingMethod.BW) and per-channel
+    imagehash.phash() (HashingMethod.RGB and HashingMethod.RGBA) based hashes, packed with pack_hashes().
+    """
+
+    def __init__(self, method: HashingMethod, hash_size: int = DEFAULT_HASH_SIZE):
+        self.method = method
+        self.hash_size = hash_size
+        self._grid_size = hash_target_size(method, hash_size)
+        if method in (HashingMethod.HIST, HashingMethod.BW):
+            self._bits_size = hash_size
+        else:
+            self._bits_size = int(hash_size / (3 if method == HashingMethod.RGB else 4))
+        if self._bits_size < 2:
+            raise ValueError('Hash size must be greater than or equal to 2')
+        self._grids: list[numpy.ndarray] = []
+        self._suffixes: list[bytes] = []  # Packed average histogram hashes of HashingMethod.HIST
+
+    def __len__(self) -> int:
+        return len(self._grids)
+
+    @property
+    def is_full(self) -> bool:
+        """
+        Whether the working set of hashing the batch (its grids as float64) has reached HASH_BATCH_MAX_SIZE bytes.
+        """
+
+        return sum(grid.size for grid in self._grids) * 8 >= HASH_BATCH_MAX_SIZE
+
+    def add(self, image: Image, shared: dict | None = None) -> None:
+        """
+        Adds @image to the batch. Batches of different hashing methods adding the same image may pass the same @shared
+        dict, so that the mode conversions and pixel grids they have in common are only computed once (see also
+        add_to_batches()).
+        """
+
+        self.append(self.normalize(image, shared))
+
+    def normalize(self, image: Image, shared: dict | None = None) -> tuple[numpy.ndarray, bytes | None]:
+        """
+        Computes the pixel grid (and histogram hash suffix) that @image is hashed from, without adding it to the batch.
+        """
+
+        if shared is None:
+            shared = {}
+
+        def converted(mode: str) -> Image:
+            if image.mode == mode:
+                return image
+            if mode not in shared:
+                shared[mode] = image.convert(mode)
+            return shared[mode]
+
+        def resized(im: Image, key: str) -> numpy.ndarray:
+            key = (key, self._grid_size)
+            if key not in shared:
+                shared[key] = numpy.asarray(im.resize(self._grid_size, Image.Resampling.LANCZOS))
+            return shared[key]
+
+        if self.method in (HashingMethod.HIST, HashingMethod.BW):
+            # Both methods hash the same grayscale grid
+            grid = resized(converted('L'), 'L')
+            if self.method == HashingMethod.HIST:
+                return grid, pack_hashes(average_histogram_hash(image))
+
+        elif self.method == HashingMethod.RGB:
+            # Resizing all channels at once gives the same result as resizing each channel on its own
+            grid = resized(converted('RGB'), 'RGB').transpose(2, 0, 1)
+
+        else:
+            im = converted('RGBA')
+            # RGBA images are resized with premultiplied alpha, so the color channels are resized apart from alpha. The
+            # RGB conversion (and grid) is only shared when it is converted from the very same RGBA image.
+            if image.mode == 'RGBA':
+                color = resized(converted('RGB'), 'RGB')
+            else:
+                color = resized(im.convert('RGB'), 'RGBA:RGB')
+            alpha = resized(im.getchannel('A'), 'RGBA:A')
+            grid = numpy.concatenate((color.transpose(2, 0, 1), alpha[numpy.newaxis]))
+
+        return grid, None
+
+    def append(self, normalized: tuple[numpy.ndarray, bytes | None]) -> None:
+        """
+        Adds an image to the batch from the result of normalize().
+        """
+
+        grid, suffix = normalized
+        self._grids.append(grid)
+        if suffix is not None:
+            self._suffixes.append(suffix)
+
+    def hash(self) -> list[bytes]:
+        """
+        Returns the packed hashes of the added images, in the order they were added, and empties the batch.
+        """
+
+        if len(self._grids) == 0:
+            return []
+        grids = numpy.stack(self._grids)
+        if self.method in (HashingMethod.HIST, HashingMethod.BW):
+            # Difference hash: compare horizontally adjacent pixels
+            bits = grids[:, :, 1:] > grids[:, :, :-1]
+            packed = numpy.packbits(bits.reshape(len(grids), -1), axis=-1)
+        else:
+            import scipy.fftpack  # Slow to import, and only needed by perceptual hashes
+
+            # Perceptual hash of each channel: compare the lowest frequencies of the DCT of each grid to their median.
+            # Rows of higher vertical frequencies are dropped before the horizontal DCT, which does not mix rows.
+            low_freqs = scipy.fftpack.dct(
+                scipy.fftpack.dct(grids, axis=-2)[..., :self._bits_size, :], axis=-1
+            )[..., :self._bits_size]
+            bits = low_freqs > numpy.median(low_freqs, axis=(-2, -1), keepdims=True)
+            packed = numpy.packbits(bits.reshape(*bits.shape[:2], -1), axis=-1).reshape(len(grids), -1)
+
+        hashes = [image_hash.tobytes() for image_hash in packed]
+        if self.method == HashingMethod.HIST:
+            hashes = [image_hash + suffix for image_hash, suffix in zip(hashes, self._suffixes)]
+        self._grids = []
+        self._suffixes = []
+        return hashes
+
+
+def add_to_batches(batches: list[HashBatch], image: Image) -> None:
+    """
+    Adds @image to every batch of @batches, sharing their mode conversions and pixel grids. The image is normalized for
+    all of them before it is added to any, so that an error (e.g. a MemoryError while resizing) leaves every batch as it
+    was, rather than with one image more in some batches than in others.
+    """
+
+    shared = {}
+    normalized = [batch.normalize(image, shared) for batch in batches]
+    for batch, image_normalized in zip(batches, normalized):
+        batch.append(image_normalized)
+
+
+def hash_image(
+        image: Image,
+        method: HashingMethod,
+        hash_size: int = DEFAULT_HASH_SIZE
+) -> bytes:
+    batch = HashBatch(method, hash_size)
+    batch.add(image)
+    return batch.hash()[0]
+
+
 def average_histogram_hash(
         image: Image,
         mask: Image = None,
@@ -81,14 +300,47 @@ def average_histogram_hash(
     return ImageHash(diff)
 
 
+ImageInfo = tuple[int, int, str | None, str | None, bool]
+
+
+def read_image_info(img_path: str, validation: ValidationPolicy = ValidationPolicy.HEADER) -> ImageInfo:
+    """
+    Reads the dimensions and format of an image from its header only, unless @validation is ValidationPolicy.FULL.
+
+    Returns (width, height, format, error, error_cacheable), with an error message instead of raising.
+    """
+
+    im = None
+    try:
+        im = open_image(img_path, validation)
+        if im.format is None:
+            raise UnknownImageFormatError('Unknown image format')
+        return im.width, im.height, im.format, None, False
+    except (
+            ValueError, TypeError,
+            UnknownImageFormatError,
+            Image.DecompressionBombError,
+            OSError, EOFError, PermissionError,
+            MemoryError
+    ) as error:
+        return 0, 0, None, error.__str__(), not isinstance(error, (PermissionError, MemoryError))
+    finally:
+        if im is not None:
+            im.close()
+
+
 def report_info(
-        img_paths: list[str],
+        img_paths: list[str | os.DirEntry],
         verbose: int = 0,
         progress_bar: int = PROGRESS_BAR_LEVELS[2],
         output_path_format: PathFormat = PathFormat.DIR_RELATIVE,
-        root_dir: str = None
+        root_dir: str = None,
+        validation: ValidationPolicy = ValidationPolicy.HEADER,
+        jobs: int = 1,
+        cache: HashCache = None
 ) -> None:
     pbar = None
+    executor = None
     try:
         if verbose > 0:
             if progress_bar == PROGRESS_BAR_LEVELS[1]:
@@ -105,6 +357,74 @@ def report_info(
         if progress_bar == PROGRESS_BAR_LEVELS[0]:
             print('Collecting information...', end='\n' if verbose > 1 else '', flush=True)
 
+        # Stat results of the directory walk (os.DirEntry) are reused
+        paths = [os.path.abspath(os.fspath(img_path)) for img_path in img_paths]
+        img_stats: list[os.stat_result | None] = []
+        infos: list[ImageInfo | None] = []
+        for img_path in img_paths:
+            try:
+                img_stats.append(img_path.stat() if isinstance(img_path, os.DirEntry) else os.stat(img_path))
+                infos.append(None)
+            except OSError as error:
+                img_stats.append(None)
+                infos.append((0, 0, None, error.__str__(), False))
+        is_cached = [False] * len(paths)
+
+        # Images of unchanged directories are all looked up at once, other images one by one
+        uncached_dirs: list[tuple[str, list[int], bytes]] = []
+        if cache is not None:
+            for directory, dir_indices in itertools.groupby(range(len(paths)), key=lambda i: os.path.dirname(paths[i])):
+                dir_indices = list(dir_indices)
+                if any(img_stats[i] is None for i in dir_indices):
+                    continue
+                fingerprint = dir_fingerprint((os.path.basename(paths[i]), img_stats[i]) for i in dir_indices)
+                cached_dir = cache.get_dir(directory, validation, fingerprint)
+                if cached_dir is not None:
+                    for i, (width, height, file_format, error) in zip(dir_indices, cached_dir):
+                        infos[i] = width, height, file_format, error, False
+                        is_cached[i] = True
+                    continue
+                uncached_dirs.append((directory, dir_indices, fingerprint))
+
+                for i in dir_indices:
+                    cached_error = cache.get_error(paths[i], img_stats[i], validation)
+                    cached_image = (
+                        cache.get_image(paths[i], img_stats[i], validation) if cached_error is None else None
+                    )
+                    if cached_error is not None:
+                        infos[i] = 0, 0, None, cached_error, False
+                        is_cached[i] = True
+                    elif cached_image is not None:
+                        infos[i] = *cached_image, None, False
+                        is_cached[i] = True
+        if pbar is not None:
+            pbar.update(sum(is_cached))
+
+        # Image headers are read from a thread pool, since reading them mostly waits for I/O
+        uncached_indices = [i for i in range(len(paths)) if infos[i] is None]
+        info_reader = functools.partial(read_image_info, validation=validation)
+        if jobs > 1 and len(uncached_indices) > 1:
+            executor = ThreadPoolExecutor(max_workers=jobs)
+            uncached_infos = executor.map(info_reader, [paths[i] for i in uncached_indices])
+        else:
+            uncached_infos = map(info_reader, [paths[i] for i in uncached_indices])
+        for i, info in zip(uncached_indices, uncached_infos):
+            if pbar is not None:
+                pbar.update()
+            infos[i] = info
+            width, height, file_format, error, error_cacheable = info
+            if cache is not None:
+                if error is None:
+                    cache.put_image(paths[i], img_stats[i], width, height, file_format, validation)
+                elif error_cacheable:
+                    cache.put_error(paths[i], img_stats[i], error, validation)
+        if executor is not None:
+            executor.shutdown()
+        for directory, dir_indices, fingerprint in uncached_dirs:
+            # Transient errors would otherwise be cached along with the rest of the directory
+            if all(infos[i][3] is None or infos[i][4] or is_cached[i] for i in dir_indices):
+                cache.put_dir(directory, validation, fingerprint, [infos[i][:4] for i in dir_indices])
+
         has_errors = False
         file_formats: dict[str, int] = {}
         largest_file = None
@@ -124,70 +444,50 @@ def report_info(
         dims_mean_total = 0
         im_count = 0
         errors_count = 0
-        for img_path in img_paths:
-            if pbar is not None:
-                pbar.update()
-
-            im = None
-            try:
-                im = Image.open(img_path)
-                im.verify()
-                im = Image.open(img_path)
-
-                max_width = im.width if im.width > max_width else max_width
-                max_height = im.height if im.height > max_height else max_height
-                min_width = im.width if (min_width == -1) or (im.width < min_width) else min_width
-                min_height = im.height if (min_height == -1) or (im.height < min_height) else min_height
-                widths_total += im.width
-                heights_total += im.height
-                dims_total += im.width + im.height
-
-                dims_mean = int((im.width + im.height) / 2)
-                max_dims_mean = dims_mean if dims_mean > max_dims_mean else max_dims_mean
-                min_dims_mean = dims_mean if (min_dims_mean == -1) or (dims_mean < min_dims_mean) else min_dims_mean
-                dims_mean_total += dims_mean
-
-                im_count += 1
-
-                file_format = im.format.lower()
-                if file_format is not None:
-                    if file_format in file_formats:
-                        file_formats[file_format] += 1
-                    else:
-                        file_formats[file_format] = 1
-                else:
-                    raise UnknownImageFormatError('Unknown image format')
-
-                im.close()
-
-                file_size = os.stat(img_path).st_size
-                if file_size > largest_file_size:
-                    largest_file_size = file_size
-                    largest_file = img_path
-                if (smallest_file_size == -1) or (file_size < smallest_file_size):
-                    smallest_file_size = file_size
-                    smallest_file = img_path
-                disk_usage += file_size
-
-            except (
-                    ValueError, TypeError,
-                    UnknownImageFormatError,
-                    Image.DecompressionBombError,
-                    OSError, EOFError, PermissionError,
-                    MemoryError
-            ) as error:
+        for img_path, st, (width, height, file_format, error, _), info_cached in zip(
+                img_paths, img_stats, infos, is_cached
+        ):
+            if error is not None:
                 has_errors = True
                 loop_errprint(
                     f"Error reading '{format_path(img_path, output_path_format, root_dir)}': "
-                    f'{error.__str__()}. '
-                    f'File skipped.',
+                    f'{error}. '
+                    f'File skipped{" (cached)" if info_cached else ""}.',
                     pbar=pbar
                 )
                 errors_count += 1
-                if im is not None:
-                    im.close()
                 continue
 
+            max_width = width if width > max_width else max_width
+            max_height = height if height > max_height else max_height
+            min_width = width if (min_width == -1) or (width < min_width) else min_width
+            min_height = height if (min_height == -1) or (height < min_height) else min_height
+            widths_total += width
+            heights_total += height
+            dims_total += width + height
+
+            dims_mean = int((width + height) / 2)
+            max_dims_mean = dims_mean if dims_mean > max_dims_mean else max_dims_mean
+            min_dims_mean = dims_mean if (min_dims_mean == -1) or (dims_mean < min_dims_mean) else min_dims_mean
+            dims_mean_total += dims_mean
+
+            im_count += 1
+
+            file_format = file_format.lower()
+            if file_format in file_formats:
+                file_formats[file_format] += 1
+            else:
+                file_formats[file_format] = 1
+
+            file_size = st.st_size
+            if file_size > largest_file_size:
+                largest_file_size = file_size
+                largest_file = img_path
+            if (smallest_file_size == -1) or (file_size < smallest_file_size):
+                smallest_file_size = file_size
+                smallest_file = img_path
+            disk_usage += file_size
+
         if pbar is not None:
             pbar.close()
 
@@ -268,19 +568,30 @@ def report_info(
             f'{int(dims_mean_total / im_count)}px (good performance & medium accuracy)'
         )
     except KeyboardInterrupt:
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
         if pbar is not None:
             pbar.close()
         exit()
 
 
 def calc_hash_size(
-        img_paths: list[str],
+        img_paths: list[str | os.DirEntry],
         auto_hash_size: AutoHashSize = AutoHashSize.MAX_DIMS_MEAN,
         verbose: int = 0,
         progress_bar: int = PROGRESS_BAR_LEVELS[2],
         output_path_format: PathFormat = PathFormat.DIR_RELATIVE,
-        root_dir: str = None
-) -> tuple[int, list[str]]:
+        root_dir: str = None,
+        cache: HashCache = None,
+        validation: ValidationPolicy = ValidationPolicy.HEADER,
+        verified: set[str] = None
+) -> tuple[int, list[str | os.DirEntry]]:
+    """
+    Determines the hash size from the dimensions of images, returning it along with the images that could be read. The
+    absolute paths of the images opened with @validation in this run, rather than served from @cache, are added to
+    @verified, if given.
+    """
+
     pbar = None
     try:
         if verbose > 0:
@@ -308,25 +619,47 @@ def calc_hash_size(
                 pbar.update()
 
             im = None
+            st = None
             try:
-                im = Image.open(img_path)
-                im.verify()
-                im = Image.open(img_path)
+                cached_image = None
+                if cache is not None:
+                    st = img_path.stat() if isinstance(img_path, os.DirEntry) else os.stat(img_path)
+                    cached_error = cache.get_error(os.path.abspath(img_path), st, validation)
+                    if cached_error is not None:
+                        has_errors = True
+                        loop_errprint(
+                            f"Error reading '{format_path(img_path, output_path_format, root_dir)}': "
+                            f'{cached_error}. '
+                            f'File skipped (cached).',
+                            pbar=pbar
+                        )
+                        continue
+                    cached_image = cache.get_image(os.path.abspath(img_path), st, validation)
+
+                if cached_image is not None:
+                    width, height, _ = cached_image
+                else:
+                    im = open_image(img_path, validation)
+                    width, height = im.size
+                    if cache is not None:
+                        cache.put_image(os.path.abspath(img_path), st, width, height, im.format, validation)
+                    im.close()
+                    if verified is not None:
+                        verified.add(os.path.abspath(img_path))
 
                 if auto_hash_size == AutoHashSize.MAX_DIM:
-                    max_hash_size = max([max_hash_size, im.width, im.height])
+                    max_hash_size = max([max_hash_size, width, height])
                 elif auto_hash_size == AutoHashSize.MAX_DIMS_MEAN:
-                    max_hash_size = max([max_hash_size, int((im.width + im.height) / 2)])
+                    max_hash_size = max([max_hash_size, int((width + height) / 2)])
                 elif auto_hash_size == AutoHashSize.AVG_DIM:
-                    dims_total += im.width + im.height
+                    dims_total += width + height
                     im_count += 1
                 elif auto_hash_size == AutoHashSize.AVG_DIMS_MEAN:
-                    dims_total += int((im.width + im.height) / 2)
+                    dims_total += int((width + height) / 2)
                     im_count += 1
                 else:
                     raise ValueError('Invalid AutoHashSize value')
 
-                im.close()
                 new_img_paths.append(img_path)
             except (
                     ValueError, TypeError,
@@ -341,6 +674,8 @@ def calc_hash_size(
                     f'File skipped.',
                     pbar=pbar
                 )
+                if cache is not None and st is not None and not isinstance(error, (PermissionError, MemoryError)):
+                    cache.put_error(os.path.abspath(img_path), st, error.__str__(), validation)
                 if im is not None:
                     im.close()
                 continue
@@ -0,0 +1,102 @@
+import os
+import json
+import threading
+
+from utils.globs import CleanAction
+from utils.globs import JOURNAL_VERSION
+from utils.globs import CLEAN_BACKUP_SUFFIX, CLEAN_TEMP_SUFFIX
+
+
+def backup_path(path: str) -> str:
+    """
+    Returns the hidden file that a journaled clean moves the file at @path to until it is committed, in the same
+    directory, so that moving it is a rename on the same filesystem.
+    """
+
+    directory, basename = os.path.split(path)
+    return os.path.join(directory, f'.{basename}.{CLEAN_BACKUP_SUFFIX}')
+
+
+def temp_path(path: str) -> str:
+    """
+    Returns the hidden file that a link replacing the file at @path is created as, before being moved in place.
+    """
+
+    directory, basename = os.path.split(path)
+    return os.path.join(directory, f'.{basename}.{CLEAN_TEMP_SUFFIX}')
+
+
+class CleanJournal:
+    """
+    Append-only journal (JSON lines .imjournal file) of a clean. Its first line records the clean action and the
+    absolute paths of every duplication to clean (kept file first), and each following line either marks a file as
+    cleaned, or the clean as committing.
+
+    Journaled cleans move cleaned files to backup files (see backup_path()) instead of deleting them, and only delete
+    the backups once the whole clean is committed, so that an interrupted clean can either be resumed, or rolled back by
+    moving the backups back in place.
+
+    Raises ValueError if an existing journal file is malformed, or was written by a newer version.
+    """
+
+    def __init__(self, file: str, action: CleanAction, clusters: list[list[str]]):
+        self.file = file
+        self.action = action
+        self.clusters = clusters
+        self.done: set[tuple[int, int]] = set()
+        self.committing = False
+        self._stream = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls, file: str, action: CleanAction, clusters: list[list[str]]) -> 'CleanJournal':
+        journal = cls(file, action, [[os.path.abspath(path) for path in cluster] for cluster in clusters])
+        journal._stream = open(file, 'xt')
+        journal._write(
+            {'version': JOURNAL_VERSION, 'action': action.value, 'duplications': journal.clusters}, sync=True
+        )
+        return journal
+
+    @classmethod
+    def open(cls, file: str) -> 'CleanJournal':
+        with open(file, 'rt') as f:
+            lines = f.read().split('\n')
+        try:
+            header = json.loads(lines[0])
+            if header['version'] > JOURNAL_VERSION:
+                raise ValueError(f'Unsupported journal version {header["version"]}')
+            journal = cls(file, CleanAction(header['action']), header['duplications'])
+            for line in lines[1:]:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Empty, or partially written by an interrupted clean
+                if record.get('state') == 'committing':
+                    journal.committing = True
+                elif record.get('state') == 'done':
+                    journal.done.add((record['duplication'], record['file']))
+        except (json.JSONDecodeError, KeyError, TypeError) as error:
+            raise ValueError(f'Invalid journal: {error}')
+        journal._stream = open(file, 'at')
+        return journal
+
+    def _write(self, record: dict, sync: bool = False) -> None:
+        with self._lock:
+            self._stream.write(json.dumps(record) + '\n')
+            self._stream.flush()
+            if sync:
+                os.fsync(self._stream.fileno())
+
+    def mark_done(self, cluster: int, file: int) -> None:
+        self._write({'duplication': cluster, 'file': file, 'state': 'done'})
+        with self._lock:
+            self.done.add((cluster, file))
+
+    def mark_committing(self) -> None:
+        self._write({'state': 'committing'}, sync=True)
+        self.committing = True
+
+    def close(self, remove: bool = False) -> None:
+        self._stream.close()
+        if remove:
+            os.remove(self.file)
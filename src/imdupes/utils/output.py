@@ -1,21 +1,28 @@
 import sys
 from typing import TextIO
 from termcolor import colored
-from utils.imutils import ImageFileWrapper
+from utils.results import DupResults
 from utils.globs import PathFormat, format_path
 
 
 def print_dups(
-        hashed_dups: dict[str, list[ImageFileWrapper]],
+        hashed_dups: DupResults,
         root_dir: str = None,
         output_path_format: PathFormat = PathFormat.DIR_RELATIVE,
         colored_cluster_header: bool = False,
         show_hash_cluster_header: bool = False,
         file: TextIO = sys.stdout,
-        flush: bool = False
+        flush: bool = False,
+        start: int = 1
 ) -> None:
-    for i, dup_imgs in enumerate(hashed_dups.items(), start=1):
-        hash_str = dup_imgs[0][:48] + '...' if len(dup_imgs[0]) > 48 else dup_imgs[0]
+    """
+    Prints the duplications of @hashed_dups, numbered from @start (e.g. to print the chunks of a memory-limited scan
+    one after another).
+    """
+
+    for i, hash_key in enumerate(hashed_dups.cluster_keys, start=start):
+        hash_hex = hash_key.hex()
+        hash_str = hash_hex[:48] + '...' if len(hash_hex) > 48 else hash_hex
         hash_str_print = f' | hash: {hash_str}' if show_hash_cluster_header else ''
         print(
             colored(f'[ DUPLICATION {i}{hash_str_print} ]', 'magenta', attrs=['bold']) if colored_cluster_header
@@ -23,6 +30,6 @@ def print_dups(
             file=file
         )
 
-        for dup_img in dup_imgs[1]:
-            print(format_path(dup_img.path, output_path_format, root_dir), file=file)
+        for dup_img_path in hashed_dups.cluster_paths(i - start):
+            print(format_path(dup_img_path, output_path_format, root_dir), file=file)
         print(file=file, flush=flush)
@@ -0,0 +1,101 @@
+import io
+import os
+import mmap
+import time
+import functools
+from collections import deque
+from collections.abc import Iterator, Sequence
+from typing import BinaryIO
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from utils.globs import PREFETCH_DEPTH, PREFETCH_MEMORY_BUDGET, PREFETCH_THREADS
+from utils.futils import map_file, MappedFile
+
+
+class Prefetcher:
+    """
+    Reads files ahead of the decoding of images from a small thread pool, so that disk or network filesystem reads
+    overlap with decoding and hashing instead of alternating with them.
+
+    At most @depth files are read ahead, each into a memory buffer if it fits in its share of @memory_budget (one
+    @depth + 1-th, counting the buffer being decoded), so that buffers never take more than @memory_budget bytes at
+    once. Larger files are not buffered: the kernel is hinted to read them ahead (posix_fadvise(POSIX_FADV_WILLNEED)),
+    where supported, and they are decoded from their path, as are files that cannot be read, so that their errors are
+    reported by decoding as usual.
+
+    With @use_mmap, files are memory mapped instead (see futils.map_file()), and files that fit in their share of
+    @memory_budget are read ahead by touching every page of their mapping, rather than copied into buffers. Files that
+    cannot be mapped are read as without @use_mmap.
+
+    Iterating yields the buffer (mapped file, or path) of every file of @img_paths in order, along with the time spent
+    waiting for it to be read. Sources that are not paths (e.g. binary file objects) are yielded as is.
+    """
+
+    def __init__(
+            self,
+            img_paths: Sequence[str | BinaryIO],
+            depth: int = PREFETCH_DEPTH,
+            memory_budget: int = PREFETCH_MEMORY_BUDGET,
+            threads: int = PREFETCH_THREADS,
+            use_mmap: bool = False
+    ):
+        self.img_paths = img_paths
+        self.depth = depth
+        self.use_mmap = use_mmap
+        self.max_buffer_size = memory_budget // (depth + 1)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, min(threads, depth)))
+
+    def _read(self, img_path: str | BinaryIO) -> str | BinaryIO:
+        if not isinstance(img_path, str):
+            return img_path
+        mapped = map_file(img_path) if self.use_mmap else None
+        if mapped is not None:
+            if hasattr(mapped, 'madvise'):
+                mapped.madvise(mmap.MADV_WILLNEED)
+            if len(mapped) <= self.max_buffer_size:
+                mapped[::mmap.PAGESIZE]  # Faults every page in, so that decoding does not wait for them
+            return MappedFile(mapped)
+        try:
+            with open(img_path, 'rb') as f:
+                file_size = os.fstat(f.fileno()).st_size
+                if file_size <= self.max_buffer_size:
+                    return io.BytesIO(f.read())
+                if hasattr(os, 'posix_fadvise'):
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+        except OSError:
+            pass
+        return img_path
+
+    @staticmethod
+    def _discard(img_path: str | BinaryIO, read: Future) -> None:
+        if read.cancelled() or read.exception() is not None:
+            return
+        source = read.result()
+        if source is not img_path and not isinstance(source, str):
+            source.close()
+
+    def __iter__(self) -> Iterator[tuple[str | BinaryIO, float]]:
+        reads: deque[tuple[str | BinaryIO, Future]] = deque()
+        try:
+            for i in range(len(self.img_paths)):
+                while len(reads) < self.depth and i + len(reads) < len(self.img_paths):
+                    img_path = self.img_paths[i + len(reads)]
+                    reads.append((img_path, self._executor.submit(self._read, img_path)))
+                start_time = time.perf_counter()
+                source = reads.popleft()[1].result()
+                yield source, time.perf_counter() - start_time
+        finally:
+            # Files read ahead of an interrupted iteration are closed as soon as their reads are done, so that their
+            # buffers and mappings are not left open
+            for img_path, read in reads:
+                if not read.cancel():
+                    read.add_done_callback(functools.partial(self._discard, img_path))
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self) -> 'Prefetcher':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
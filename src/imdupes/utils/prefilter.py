@@ -0,0 +1,118 @@
+import os
+import hashlib
+
+from utils.globs import PREFILTER_PARTIAL_SIZE, PREFILTER_CHUNK_SIZE
+from utils.futils import map_file
+
+
+def _partial_digest(path: str, file_size: int, use_mmap: bool = False) -> bytes:
+    digest = hashlib.blake2b(digest_size=16)
+    mapped = map_file(path) if use_mmap and file_size > 0 else None
+    if mapped is not None:
+        with mapped, memoryview(mapped) as view:
+            digest.update(view[:PREFILTER_PARTIAL_SIZE])
+            if file_size > PREFILTER_PARTIAL_SIZE:
+                digest.update(view[max(PREFILTER_PARTIAL_SIZE, file_size - PREFILTER_PARTIAL_SIZE):])
+        return digest.digest()
+    with open(path, 'rb') as f:
+        digest.update(f.read(PREFILTER_PARTIAL_SIZE))
+        if file_size > PREFILTER_PARTIAL_SIZE:
+            f.seek(max(PREFILTER_PARTIAL_SIZE, file_size - PREFILTER_PARTIAL_SIZE))
+            digest.update(f.read(PREFILTER_PARTIAL_SIZE))
+    return digest.digest()
+
+
+def _full_digest(path: str, use_mmap: bool = False) -> bytes:
+    digest = hashlib.blake2b(digest_size=16)
+    mapped = map_file(path) if use_mmap else None
+    if mapped is not None:
+        with mapped, memoryview(mapped) as view:
+            digest.update(view)
+        return digest.digest()
+    with open(path, 'rb') as f:
+        while chunk := f.read(PREFILTER_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.digest()
+
+
+class IdenticalFileFilter:
+    """
+    Finds byte-identical files without decoding them, one file at a time, so that it can be used while files are still
+    being indexed.
+
+    Hardlinks (paths sharing the same device and inode) are matched first. Other files are only compared to previously
+    checked files of the same size and the same digest of their first and last PREFILTER_PARTIAL_SIZE bytes, by a
+    digest of their whole content. Digests are only computed once a second file of the same size shows up. With
+    @use_mmap, files are digested through a memory mapping of their content (see futils.map_file()) rather than read.
+    """
+
+    def __init__(self, use_mmap: bool = False):
+        self.use_mmap = use_mmap
+        self.identical_count = 0
+        self.hardlink_count = 0
+        self.bytes_read = 0
+        self._inodes: dict[tuple[int, int], str] = {}
+        self._sizes: dict[int, str | None] = {}  # First path of each size, until its partial digest is computed
+        self._partials: dict[tuple[int, bytes], list[str]] = {}
+        self._full_digests: dict[str, bytes] = {}
+
+    def _full_digest(self, path: str, file_size: int) -> bytes:
+        if file_size <= 2 * PREFILTER_PARTIAL_SIZE:
+            return b''  # Already covered by the partial digest
+        if path not in self._full_digests:
+            self._full_digests[path] = _full_digest(path, self.use_mmap)
+            self.bytes_read += file_size
+        return self._full_digests[path]
+
+    def _add_partial(self, path: str, file_size: int) -> list[str] | None:
+        try:
+            partial_digest = _partial_digest(path, file_size, self.use_mmap)
+            self.bytes_read += min(file_size, 2 * PREFILTER_PARTIAL_SIZE)
+            return self._partials.setdefault((file_size, partial_digest), [])
+        except OSError:
+            return None  # Unreadable files are left for the hashing stage to report
+
+    def _find_content(self, path: str, file_size: int) -> str | None:
+        if file_size not in self._sizes:
+            self._sizes[file_size] = path
+            return None
+        first_path = self._sizes[file_size]
+        if first_path is not None:
+            first_path_partials = self._add_partial(first_path, file_size)
+            if first_path_partials is not None:
+                first_path_partials.append(first_path)
+            self._sizes[file_size] = None
+
+        same_partial_paths = self._add_partial(path, file_size)
+        if same_partial_paths is None:
+            return None
+        try:
+            full_digest = self._full_digest(path, file_size)
+        except OSError:
+            return None
+        for other_path in same_partial_paths:
+            try:
+                if self._full_digest(other_path, file_size) == full_digest:
+                    return other_path
+            except OSError:
+                continue
+        same_partial_paths.append(path)
+        return None
+
+    def find(self, path: str, st: os.stat_result) -> str | None:
+        """
+        Returns the first previously checked path with the same content as @path, or None if its content is new.
+        """
+
+        inode = (st.st_dev, st.st_ino)
+        if inode in self._inodes:
+            self.hardlink_count += 1
+            return self._inodes[inode]
+
+        rep_path = self._find_content(path, st.st_size)
+        if rep_path is not None:
+            self.identical_count += 1
+
+        # Hardlinks of a redundant copy must point to the representative of its content as well
+        self._inodes[inode] = path if rep_path is None else rep_path
+        return rep_path
@@ -0,0 +1,240 @@
+import sys
+import time
+import json
+import heapq
+import contextlib
+from collections.abc import Iterable, Iterator
+import numpy
+from termcolor import cprint, colored
+try:
+    import resource
+except ImportError:  # Not available on Windows, where peak memory is not reported
+    resource = None
+
+from utils import sizeof_fmt
+from utils.globs import PROFILE_SLOWEST_FILES
+
+
+FileTimings = dict[str, float]  # Seconds spent by a hashing worker in each step of processing a single file
+BatchTimings = list[tuple[float, int]]  # Seconds spent by a hashing worker on each batch of files, and their number
+
+LATENCY_PERCENTILES = [50, 95, 99]
+LATENCY_HISTOGRAM_EDGES = [10 ** (exponent / 4) for exponent in range(-20, 9)]  # Seconds; 10us to 100s, 4 per decade
+
+
+def peak_rss(children: bool = False) -> int | None:
+    """
+    Returns the peak resident set size of the current process (or of its largest terminated child process), in bytes.
+    """
+
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+class Profiler:
+    """
+    Records the wall and CPU time of each stage of a run, and the latency of each step of processing every file.
+
+    Stages are timed with the stage() context manager, or iterate() for lazily evaluated stages (e.g. the directory walk
+    of streamed images), and are keyed by their path of nested stage names. File timings are measured by the hashing
+    workers and recorded by the parent process with record_file(), and so are the timings of steps that process a whole
+    batch of files at once, with record_batch(), which are reported per batch rather than per file.
+    """
+
+    enabled = True
+
+    def __init__(self, slowest_count: int = PROFILE_SLOWEST_FILES):
+        self.slowest_count = slowest_count
+        self.stages: dict[str, list[float]] = {}  # [wall time, CPU time, calls]
+        self.file_timings: dict[str, list[float]] = {}
+        self.batch_timings: dict[str, list[tuple[float, int]]] = {}
+        self.file_count = 0
+        self.bytes_scanned = 0  # Sizes of the files processed, not what decoding actually read of them
+        self.bytes_digested = 0
+        self._stack: list[str] = []
+        self._slowest: list[tuple[float, str]] = []  # Min-heap of the slowest files
+
+    def _record_stage(self, name: str, wall_time: float, cpu_time: float) -> None:
+        stage = self.stages.setdefault(' > '.join(self._stack + [name]), [0.0, 0.0, 0])
+        stage[0] += wall_time
+        stage[1] += cpu_time
+        stage[2] += 1
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        self._stack.append(name)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            self._record_stage(name, time.perf_counter() - start_wall, time.process_time() - start_cpu)
+
+    def iterate(self, name: str, items: Iterable) -> Iterator:
+        """
+        Yields @items, timing the retrieval of each item as stage @name.
+        """
+
+        iterator = iter(items)
+        while True:
+            start_wall, start_cpu = time.perf_counter(), time.process_time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._record_stage(name, time.perf_counter() - start_wall, time.process_time() - start_cpu)
+            yield item
+
+    def record_file(self, path: str, timings: FileTimings, file_size: int = 0) -> None:
+        for step, seconds in timings.items():
+            self.file_timings.setdefault(step, []).append(seconds)
+        self.file_count += 1
+        self.bytes_scanned += file_size
+
+        total_time = sum(timings.values())
+        if len(self._slowest) < self.slowest_count:
+            heapq.heappush(self._slowest, (total_time, path))
+        elif total_time > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, (total_time, path))
+
+    def record_batch(self, step: str, seconds: float, file_count: int) -> None:
+        self.batch_timings.setdefault(step, []).append((seconds, file_count))
+
+    def add_bytes_digested(self, bytes_digested: int) -> None:
+        self.bytes_digested += bytes_digested
+
+    def report(self) -> dict:
+        latencies = {}
+        for step, seconds in self.file_timings.items():
+            timings = numpy.asarray(seconds)
+            histogram, _ = numpy.histogram(timings, bins=[0.0, *LATENCY_HISTOGRAM_EDGES, numpy.inf])
+            latencies[step] = {
+                'count': len(timings),
+                'total': float(timings.sum()),
+                'mean': float(timings.mean()),
+                'max': float(timings.max()),
+                **{
+                    f'p{percentile}': float(value)
+                    for percentile, value in zip(LATENCY_PERCENTILES, numpy.percentile(timings, LATENCY_PERCENTILES))
+                },
+                'histogram': {'edges': LATENCY_HISTOGRAM_EDGES, 'counts': histogram.tolist()}
+            }
+        batch_latencies = {}
+        for step, batches in self.batch_timings.items():
+            timings = numpy.asarray([seconds for seconds, _ in batches])
+            file_count = sum(batch_size for _, batch_size in batches)
+            batch_latencies[step] = {
+                'count': len(timings),
+                'files': file_count,
+                'total': float(timings.sum()),
+                'mean': float(timings.mean()),
+                'max': float(timings.max()),
+                'per_file': float(timings.sum()) / max(file_count, 1)
+            }
+
+        return {
+            'stages': [
+                {'stage': name, 'wall_time': wall_time, 'cpu_time': cpu_time, 'calls': calls}
+                for name, (wall_time, cpu_time, calls) in self.stages.items()
+            ],
+            'files': self.file_count,
+            'bytes_scanned': self.bytes_scanned,
+            'bytes_digested': self.bytes_digested,
+            'file_latencies': latencies,
+            'batch_latencies': batch_latencies,
+            'slowest_files': [
+                {'path': path, 'time': seconds} for seconds, path in sorted(self._slowest, reverse=True)
+            ],
+            'peak_rss': peak_rss(),
+            'peak_rss_workers': peak_rss(children=True)
+        }
+
+    def print_summary(self) -> None:
+        report = self.report()
+
+        def header(text: str) -> str:
+            return colored(text, color='magenta', attrs=['bold'])
+
+        cprint('\nProfile', color='magenta', attrs=['bold'])
+        print('-------')
+        print(' '.join(
+            [header('Stage'.ljust(40)), header('Wall'.rjust(10)), header('CPU'.rjust(10)), header('Calls'.rjust(8))]
+        ))
+        for stage in report['stages']:
+            print(f'{stage["stage"]:40} {stage["wall_time"]:9.3f}s {stage["cpu_time"]:9.3f}s {stage["calls"]:8}')
+
+        if len(report['file_latencies']) > 0:
+            print()
+            print(' '.join(
+                [header('Per-file step'.ljust(16)), header('Total'.rjust(10))]
+                + [header(f'p{percentile}'.rjust(9)) for percentile in LATENCY_PERCENTILES]
+                + [header('Max'.rjust(9))]
+            ))
+            for step, latency in report['file_latencies'].items():
+                print(' '.join(
+                    [f'{step:16}', f'{latency["total"]:9.3f}s']
+                    + [f'{latency[f"p{percentile}"] * 1000:7.1f}ms' for percentile in LATENCY_PERCENTILES]
+                    + [f'{latency["max"] * 1000:7.1f}ms']
+                ))
+
+        if len(report['batch_latencies']) > 0:
+            print()
+            print(' '.join(
+                [header('Per-batch step'.ljust(16)), header('Total'.rjust(10)), header('Batches'.rjust(8))]
+                + [header(column.rjust(9)) for column in ('Mean', 'Max', 'Per file')]
+            ))
+            for step, latency in report['batch_latencies'].items():
+                print(' '.join(
+                    [f'{step:16}', f'{latency["total"]:9.3f}s', f'{latency["count"]:8}']
+                    + [f'{latency[key] * 1000:7.1f}ms' for key in ('mean', 'max', 'per_file')]
+                ))
+
+        if len(report['slowest_files']) > 0:
+            print(f'\n{header("Slowest files:")}')
+            for slowest_file in report['slowest_files']:
+                print(f'{slowest_file["time"] * 1000:9.1f}ms "{slowest_file["path"]}"')
+
+        print(
+            f'\n{header("Files processed:")} {report["files"]} ({sizeof_fmt(report["bytes_scanned"])} scanned, '
+            f'{sizeof_fmt(report["bytes_digested"])} digested by the prefilter)'
+        )
+        if report['peak_rss'] is not None:
+            workers_peak_rss = report['peak_rss_workers']
+            print(
+                f'{header("Peak memory:    ")} {sizeof_fmt(report["peak_rss"])}'
+                + (f' (largest worker: {sizeof_fmt(workers_peak_rss)})' if workers_peak_rss else '')
+            )
+
+    def save(self, file: str) -> None:
+        with open(file, 'wt') as f:
+            json.dump(self.report(), f, indent=2)
+
+
+class NullProfiler(Profiler):
+    """
+    Profiler that records nothing, used when profiling is disabled so that instrumented code costs close to nothing.
+    """
+
+    enabled = False
+    _null_stage = contextlib.nullcontext()
+
+    def stage(self, name: str) -> contextlib.nullcontext:
+        return self._null_stage
+
+    def iterate(self, name: str, items: Iterable) -> Iterable:
+        return items
+
+    def record_file(self, path: str, timings: FileTimings, file_size: int = 0) -> None:
+        pass
+
+    def record_batch(self, step: str, seconds: float, file_count: int) -> None:
+        pass
+
+    def add_bytes_digested(self, bytes_digested: int) -> None:
+        pass
+
+
+NULL_PROFILER = NullProfiler()
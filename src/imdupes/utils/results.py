@@ -0,0 +1,181 @@
+import os
+from array import array
+from collections.abc import Sequence
+import numpy
+
+from utils.globs import HashingMethod
+from utils.globs import HASH_DIGEST_SIZE
+
+
+class DupResults:
+    """
+    Compact columnar store of image files and of the duplication clusters they belong to.
+
+    Instead of one Python object per image, each image attribute is kept in its own typed array, indexed by entry:
+    paths are split into an interned directory table and a basename, and image formats are interned into a format table.
+    The hashing parameters that the digests of the entries were computed with are kept alongside, when known. The full
+    hash of each entry is only kept with @keep_hashes, e.g. to compare hashes by Hamming distance.
+
+    Entries are first added while scanning, then clustered() returns a new store holding only the clustered entries,
+    ordered by cluster and by decreasing resolution (width * height) within each cluster, so that the highest resolution
+    image of each cluster comes first and is kept during cleaning step.
+    """
+
+    __slots__ = (
+        'method', 'hash_size', 'reduced_decoding',
+        'directories', 'formats', '_directory_ids', '_format_ids',
+        'dir_ids', 'basenames', 'widths', 'heights', 'file_sizes', 'mtimes_ns', 'format_ids', 'digests', 'hashes',
+        'cluster_ids', 'cluster_keys', '_cluster_offsets'
+    )
+
+    def __init__(
+            self,
+            method: HashingMethod | None = None,
+            hash_size: int | None = None,
+            reduced_decoding: bool = False,
+            keep_hashes: bool = False
+    ):
+        self.method = method
+        self.hash_size = hash_size
+        self.reduced_decoding = reduced_decoding
+
+        self.directories: list[str] = []
+        self.formats: list[str | None] = []
+        self._directory_ids: dict[str, int] = {}
+        self._format_ids: dict[str | None, int] = {}
+
+        self.dir_ids = array('I')
+        self.basenames: list[str] = []
+        self.widths = array('I')
+        self.heights = array('I')
+        self.file_sizes = array('Q')
+        self.mtimes_ns = array('q')
+        self.format_ids = array('H')
+        self.digests = bytearray()  # HASH_DIGEST_SIZE bytes per entry, zeroed if unknown
+        self.hashes: list[bytes | None] | None = [] if keep_hashes else None
+        self.cluster_ids = array('i')
+
+        self.cluster_keys: list[bytes] = []
+        self._cluster_offsets = array('Q', [0])
+
+    def __len__(self) -> int:
+        """
+        Returns the number of duplication clusters.
+        """
+
+        return len(self.cluster_keys)
+
+    @property
+    def entry_count(self) -> int:
+        return len(self.basenames)
+
+    @property
+    def file_count(self) -> int:
+        """
+        Returns the number of files across all duplication clusters.
+        """
+
+        return self._cluster_offsets[-1]
+
+    def add(
+            self,
+            path: str,
+            width: int,
+            height: int,
+            file_size: int = 0,
+            file_format: str | None = None,
+            mtime_ns: int = 0,
+            digest: bytes | None = None,
+            image_hash: bytes | None = None
+    ) -> int:
+        directory, basename = os.path.split(path)
+        dir_id = self._directory_ids.get(directory)
+        if dir_id is None:
+            dir_id = self._directory_ids[directory] = len(self.directories)
+            self.directories.append(directory)
+        format_id = self._format_ids.get(file_format)
+        if format_id is None:
+            format_id = self._format_ids[file_format] = len(self.formats)
+            self.formats.append(file_format)
+
+        self.dir_ids.append(dir_id)
+        self.basenames.append(basename)
+        self.widths.append(width)
+        self.heights.append(height)
+        self.file_sizes.append(file_size)
+        self.mtimes_ns.append(mtime_ns)
+        self.format_ids.append(format_id)
+        self.digests += digest if digest is not None else bytes(HASH_DIGEST_SIZE)
+        if self.hashes is not None:
+            self.hashes.append(image_hash)
+        self.cluster_ids.append(-1)
+        return len(self.basenames) - 1
+
+    def path(self, entry: int) -> str:
+        return os.path.join(self.directories[self.dir_ids[entry]], self.basenames[entry])
+
+    def size(self, entry: int) -> tuple[int, int]:
+        return self.widths[entry], self.heights[entry]
+
+    def file_format(self, entry: int) -> str | None:
+        return self.formats[self.format_ids[entry]]
+
+    def digest(self, entry: int) -> bytes:
+        return bytes(self.digests[entry * HASH_DIGEST_SIZE:(entry + 1) * HASH_DIGEST_SIZE])
+
+    def hash(self, entry: int) -> bytes | None:
+        return self.hashes[entry] if self.hashes is not None else None
+
+    def cluster(self, cluster_id: int) -> range:
+        """
+        Returns the entries of a duplication cluster, highest resolution first.
+        """
+
+        return range(self._cluster_offsets[cluster_id], self._cluster_offsets[cluster_id + 1])
+
+    def cluster_paths(self, cluster_id: int) -> list[str]:
+        return [self.path(entry) for entry in self.cluster(cluster_id)]
+
+    def clustered(self, keys: list[bytes], clusters: list[Sequence[int]]) -> 'DupResults':
+        """
+        Returns a new store with only the entries of @clusters (sequences of entries of this store), keyed by @keys.
+        Clusters keep their order, while the entries of each cluster are sorted in order of decreasing resolution, ties
+        keeping their order.
+        """
+
+        results = DupResults(self.method, self.hash_size, self.reduced_decoding, keep_hashes=self.hashes is not None)
+        results.directories = self.directories
+        results.formats = self.formats
+        results._directory_ids = self._directory_ids
+        results._format_ids = self._format_ids
+        results.cluster_keys = list(keys)
+
+        if len(clusters) == 0:
+            return results
+
+        lengths = numpy.fromiter((len(cluster) for cluster in clusters), dtype=numpy.int64, count=len(clusters))
+        entries = numpy.concatenate([numpy.asarray(cluster, dtype=numpy.int64) for cluster in clusters])
+        cluster_ids = numpy.repeat(numpy.arange(len(clusters), dtype=numpy.int32), lengths)
+        resolutions = (
+            numpy.frombuffer(self.widths, dtype=numpy.uint32).astype(numpy.int64)[entries]
+            * numpy.frombuffer(self.heights, dtype=numpy.uint32).astype(numpy.int64)[entries]
+        )
+        # numpy.lexsort() is stable and sorts by its last key first
+        order = numpy.lexsort((-resolutions, cluster_ids))
+        entries = entries[order]
+
+        results.dir_ids = array('I', numpy.frombuffer(self.dir_ids, dtype=numpy.uint32)[entries].tobytes())
+        results.basenames = [self.basenames[entry] for entry in entries]
+        results.widths = array('I', numpy.frombuffer(self.widths, dtype=numpy.uint32)[entries].tobytes())
+        results.heights = array('I', numpy.frombuffer(self.heights, dtype=numpy.uint32)[entries].tobytes())
+        results.file_sizes = array('Q', numpy.frombuffer(self.file_sizes, dtype=numpy.uint64)[entries].tobytes())
+        results.mtimes_ns = array('q', numpy.frombuffer(self.mtimes_ns, dtype=numpy.int64)[entries].tobytes())
+        results.digests = bytearray(
+            numpy.frombuffer(self.digests, dtype=numpy.uint8).reshape(-1, HASH_DIGEST_SIZE)[entries].tobytes()
+        )
+        results.format_ids = array('H', numpy.frombuffer(self.format_ids, dtype=numpy.uint16)[entries].tobytes())
+        if self.hashes is not None:
+            results.hashes = [self.hashes[entry] for entry in entries]
+        results.cluster_ids = array('i', cluster_ids.tobytes())
+        results._cluster_offsets = array('Q', [0, *numpy.cumsum(lengths).tolist()])
+        return results
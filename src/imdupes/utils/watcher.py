@@ -0,0 +1,254 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+from utils.futils import ImageDirWalker
+from utils.cache import file_fingerprint
+from utils.globs import WATCH_POLL_INTERVAL, WATCH_SETTLE_TIME
+
+
+# Refer to: https://man7.org/linux/man-pages/man7/inotify.7.html
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+INOTIFY_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+INOTIFY_EVENT = struct.Struct('iIII')  # struct inotify_event, followed by its null-padded name
+INOTIFY_READ_SIZE = 64 * 1024
+
+
+def _load_libc() -> ctypes.CDLL | None:
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    except OSError:
+        return None
+    if not hasattr(libc, 'inotify_init1'):
+        return None
+    libc.inotify_init1.argtypes = [ctypes.c_int]
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    return libc
+
+
+class PollingWatcher:
+    """
+    Detects changed image files by walking @directory every @interval seconds and comparing the fingerprint (size,
+    modification time and inode) of every image file to that of the previous walk. Works on any platform and
+    filesystem, at the cost of a directory walk per interval.
+    """
+
+    def __init__(
+            self,
+            directory: str,
+            exclude: str = None,
+            recursive: bool = False,
+            interval: float = WATCH_POLL_INTERVAL,
+            threads: int = 1
+    ):
+        self.directory = directory
+        self.exclude = exclude
+        self.recursive = recursive
+        self.interval = interval
+        self.threads = threads
+        self._snapshot = self._walk()
+        self._next_walk = time.monotonic() + interval
+
+    def _walk(self) -> dict[str, tuple[int, int, int]]:
+        snapshot = {}
+        walker = ImageDirWalker(self.directory, exclude=self.exclude, recursive=self.recursive, threads=self.threads)
+        for entry, excluded in walker:
+            if excluded:
+                continue
+            try:
+                snapshot[entry.path] = file_fingerprint(entry.stat())
+            except OSError:
+                continue  # Removed since the directory was listed
+        return snapshot
+
+    def wait(self, timeout: float = None) -> set[str] | None:
+        """
+        Waits up to @timeout seconds (indefinitely if None) for changes, and returns the paths of the image files that
+        were added, modified or removed since the last call, which is empty if there were none.
+        """
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if deadline is not None and deadline < self._next_walk:
+                time.sleep(max(deadline - time.monotonic(), 0.0))
+                return set()
+            time.sleep(max(self._next_walk - time.monotonic(), 0.0))
+            self._next_walk = time.monotonic() + self.interval
+
+            snapshot = self._walk()
+            changed = {path for path, fingerprint in snapshot.items() if self._snapshot.get(path) != fingerprint}
+            changed.update(path for path in self._snapshot if path not in snapshot)
+            self._snapshot = snapshot
+            if len(changed) > 0:
+                return changed
+
+    def close(self) -> None:
+        pass
+
+
+class InotifyWatcher:
+    """
+    Detects changed files through Linux inotify, called through ctypes, so that changes are picked up as soon as they
+    happen without walking the directory.
+
+    Files are reported once they are closed after being written, moved in or out, or deleted. Newly created files are
+    not reported until they are closed, so that images are not read while they are still being written. With
+    @recursive, created and moved in subdirectories are watched as soon as they are reported, and reported themselves,
+    as files may have been added to them before they were watched. Events arriving within @settle_time seconds of each
+    other are reported together.
+
+    Raises OSError if inotify is not available, or if the inotify watch limit of the user is reached
+    (/proc/sys/fs/inotify/max_user_watches).
+    """
+
+    def __init__(self, directory: str, recursive: bool = False, settle_time: float = WATCH_SETTLE_TIME):
+        self.directory = directory
+        self.recursive = recursive
+        self.settle_time = settle_time
+        self._libc = _load_libc()
+        if self._libc is None:
+            raise OSError(errno.ENOSYS, 'inotify is not available on this platform')
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self._watches: dict[int, str] = {}  # Watch descriptor: watched directory
+        self._watch_ids: dict[str, int] = {}
+        try:
+            self._watch_tree(directory)
+        except OSError:
+            os.close(self._fd)
+            raise
+
+    def _watch(self, path: str) -> None:
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), INOTIFY_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+        self._watches[wd] = path
+        self._watch_ids[path] = wd
+
+    def _watch_tree(self, path: str) -> None:
+        self._watch(path)
+        if not self.recursive:
+            return
+        for root, dir_names, _ in os.walk(path):
+            for dir_name in dir_names:
+                try:
+                    self._watch(os.path.join(root, dir_name))
+                except (FileNotFoundError, NotADirectoryError):
+                    continue  # Removed since it was listed
+
+    def _unwatch_tree(self, path: str) -> None:
+        for watched_dir in [d for d in self._watch_ids if d == path or d.startswith(path + os.sep)]:
+            wd = self._watch_ids.pop(watched_dir)
+            self._watches.pop(wd, None)
+            self._libc.inotify_rm_watch(self._fd, wd)  # Fails harmlessly if the directory is already gone
+
+    def _read_events(self, changed: set[str]) -> bool:
+        """
+        Reads the pending events into @changed, and returns whether events were lost because the event queue
+        overflowed.
+        """
+
+        try:
+            data = os.read(self._fd, INOTIFY_READ_SIZE)
+        except BlockingIOError:
+            return False
+
+        overflowed = False
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_size = INOTIFY_EVENT.unpack_from(data, offset)
+            name = data[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + name_size].split(b'\0', 1)[0]
+            offset += INOTIFY_EVENT.size + name_size
+
+            if mask & IN_Q_OVERFLOW:
+                overflowed = True
+                continue
+            if mask & IN_IGNORED:
+                # The watched directory was removed
+                watched_dir = self._watches.pop(wd, None)
+                if watched_dir is not None and self._watch_ids.get(watched_dir) == wd:
+                    del self._watch_ids[watched_dir]
+                continue
+            watched_dir = self._watches.get(wd)
+            if watched_dir is None or len(name) == 0:
+                continue
+
+            path = os.path.join(watched_dir, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if not self.recursive:
+                    continue
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        self._watch_tree(path)
+                    except (FileNotFoundError, NotADirectoryError):
+                        pass
+                else:
+                    self._unwatch_tree(path)
+            elif mask & IN_CREATE:
+                continue
+            changed.add(path)
+        return overflowed
+
+    def wait(self, timeout: float = None) -> set[str] | None:
+        """
+        Waits up to @timeout seconds (indefinitely if None) for changes, and returns the paths of the files and
+        directories that changed, which is empty if there were none, or None if events were lost and the whole directory
+        must be compared again.
+        """
+
+        if len(select.select([self._fd], [], [], timeout)[0]) == 0:
+            return set()
+
+        changed = set()
+        overflowed = False
+        deadline = time.monotonic() + self.settle_time
+        while True:
+            overflowed |= self._read_events(changed)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or len(select.select([self._fd], [], [], remaining)[0]) == 0:
+                break
+        return None if overflowed else changed
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def create_watcher(
+        directory: str,
+        exclude: str = None,
+        recursive: bool = False,
+        polling: bool = False,
+        poll_interval: float = WATCH_POLL_INTERVAL,
+        threads: int = 1
+) -> InotifyWatcher | PollingWatcher:
+    """
+    Returns an InotifyWatcher of @directory, or a PollingWatcher if @polling is enabled or if inotify is not available.
+    """
+
+    if not polling:
+        try:
+            return InotifyWatcher(directory, recursive=recursive)
+        except OSError:
+            pass
+    return PollingWatcher(directory, exclude=exclude, recursive=recursive, interval=poll_interval, threads=threads)
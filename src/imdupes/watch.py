@@ -0,0 +1,340 @@
+import os
+import re
+import stat
+import time
+from collections.abc import Iterable, Iterator
+from termcolor import colored
+
+from detect_dup_images import detect_dup_images
+from utils.futils import ImageDirWalker, is_image_filename, clean
+from utils.output import print_dups
+from utils.results import DupResults
+from utils.cache import HashCache, file_fingerprint
+from utils.watcher import InotifyWatcher, PollingWatcher
+from utils.globs import HashingMethod
+from utils.globs import ValidationPolicy
+from utils.globs import MAX_JOB_CHUNK_SIZE
+from utils.globs import PREFETCH_DEPTH, PREFETCH_MEMORY_BUDGET
+from utils.globs import PROGRESS_BAR_LEVELS
+from utils.globs import PathFormat, format_path
+
+
+IndexedImage = tuple[bytes, int, int, int, str | None, int, tuple[int, int, int]]
+
+
+class DupIndex:
+    """
+    In-memory index of hashed images, keyed both by path and by digest, so that adding, removing or looking up the
+    duplicates of an image costs O(1) however many images are indexed.
+
+    Each image is indexed as (digest, width, height, file size, format, modification time, fingerprint), the fingerprint
+    being that of utils.cache.file_fingerprint() when the image was hashed.
+    """
+
+    def __init__(self, method: HashingMethod, hash_size: int, reduced_decoding: bool = False):
+        self.method = method
+        self.hash_size = hash_size
+        self.reduced_decoding = reduced_decoding
+        self._images: dict[str, IndexedImage] = {}
+        self._groups: dict[bytes, dict[str, None]] = {}  # Digest: paths of its images, in insertion order
+        self._dir_paths: dict[str, dict[str, None]] = {}  # Directory: paths of its images, to remove whole directories
+
+    def __len__(self) -> int:
+        return len(self._images)
+
+    def __contains__(self, path: str) -> bool:
+        return path in self._images
+
+    def paths(self) -> list[str]:
+        return list(self._images)
+
+    def fingerprint(self, path: str) -> tuple[int, int, int] | None:
+        image = self._images.get(path)
+        return image[-1] if image is not None else None
+
+    def add(
+            self,
+            path: str,
+            digest: bytes,
+            width: int,
+            height: int,
+            file_size: int,
+            file_format: str | None,
+            mtime_ns: int,
+            fingerprint: tuple[int, int, int]
+    ) -> bool:
+        """
+        Adds or replaces the image at @path, and returns whether it has duplicates.
+        """
+
+        self.remove(path)
+        self._images[path] = (digest, width, height, file_size, file_format, mtime_ns, fingerprint)
+        group = self._groups.setdefault(digest, {})
+        group[path] = None
+        self._dir_paths.setdefault(os.path.dirname(path), {})[path] = None
+        return len(group) > 1
+
+    def remove(self, path: str) -> bool:
+        image = self._images.pop(path, None)
+        if image is None:
+            return False
+
+        group = self._groups[image[0]]
+        del group[path]
+        if len(group) == 0:
+            del self._groups[image[0]]
+        dir_paths = self._dir_paths[os.path.dirname(path)]
+        del dir_paths[path]
+        if len(dir_paths) == 0:
+            del self._dir_paths[os.path.dirname(path)]
+        return True
+
+    def remove_tree(self, directory: str) -> int:
+        """
+        Removes the images of @directory and of its subdirectories, and returns how many were removed.
+        """
+
+        removed_count = 0
+        for indexed_dir in [d for d in self._dir_paths if d == directory or d.startswith(directory + os.sep)]:
+            for path in list(self._dir_paths.get(indexed_dir, {})):
+                removed_count += self.remove(path)
+        return removed_count
+
+    def digest(self, path: str) -> bytes | None:
+        image = self._images.get(path)
+        return image[0] if image is not None else None
+
+    def dup_results(self, digests: Iterable[bytes] = None) -> DupResults:
+        """
+        Returns the duplications of @digests (all of them if None) that still have duplicates, as clustered DupResults.
+        """
+
+        results = DupResults(self.method, self.hash_size, self.reduced_decoding)
+        keys = []
+        clusters = []
+        for digest in dict.fromkeys(digests if digests is not None else self._groups):
+            group = self._groups.get(digest)
+            if group is None or len(group) < 2:
+                continue
+            cluster = []
+            for path in group:
+                _, width, height, file_size, file_format, mtime_ns, _ = self._images[path]
+                cluster.append(results.add(
+                    path, width, height,
+                    file_size=file_size, file_format=file_format, mtime_ns=mtime_ns, digest=digest
+                ))
+            keys.append(digest)
+            clusters.append(cluster)
+        return results.clustered(keys, clusters)
+
+
+def _walk_images(directory: str, exclude: str, recursive: bool, threads: int = 1) -> Iterator[os.DirEntry]:
+    for entry, excluded in ImageDirWalker(directory, exclude=exclude, recursive=recursive, threads=threads):
+        if not excluded:
+            yield entry
+
+
+class DupWatcher:
+    """
+    Keeps the images of @directory hashed in a DupIndex, and hashes only the new and changed images reported by a
+    filesystem watcher (see utils.watcher), so that their duplicates are reported (and optionally cleaned) as soon as
+    they arrive.
+    """
+
+    def __init__(
+            self,
+            directory: str,
+            method: HashingMethod,
+            hash_size: int,
+            exclude: str = None,
+            recursive: bool = False,
+            clean_dups: bool = False,
+            interactive: bool = False,
+            verbose: int = 0,
+            progress_bar: int = PROGRESS_BAR_LEVELS[2],
+            output_path_format: PathFormat = PathFormat.DIR_RELATIVE,
+            show_hash: bool = False,
+            cache: HashCache = None,
+            jobs: int = 1,
+            validation: ValidationPolicy = ValidationPolicy.HEADER,
+            prefilter: bool = True,
+            reduced_decoding: bool = False,
+            index_threads: int = 1,
+            prefetch: int = PREFETCH_DEPTH,
+            prefetch_memory: int = PREFETCH_MEMORY_BUDGET,
+            use_mmap: bool = False
+    ):
+        self.directory = os.path.abspath(directory)
+        self.method = method
+        self.hash_size = hash_size
+        self.exclude = exclude
+        self.exclude_pattern = None if exclude is None else re.compile(exclude)
+        self.recursive = recursive
+        self.clean_dups = clean_dups
+        self.interactive = interactive
+        self.verbose = verbose
+        self.progress_bar = progress_bar
+        self.output_path_format = output_path_format
+        self.show_hash = show_hash
+        self.cache = cache
+        self.jobs = jobs
+        self.validation = validation
+        self.prefilter = prefilter
+        self.reduced_decoding = reduced_decoding
+        self.index_threads = index_threads
+        self.prefetch = prefetch
+        self.prefetch_memory = prefetch_memory
+        self.use_mmap = use_mmap
+        self.index = DupIndex(method, hash_size, reduced_decoding)
+
+    def _is_watched_image(self, path: str) -> bool:
+        directory, filename = os.path.split(path)
+        if not is_image_filename(filename):
+            return False
+        if self.exclude_pattern is not None and self.exclude_pattern.search(filename) is not None:
+            return False
+        return self.recursive or directory == self.directory
+
+    def _hash(self, fingerprints: dict[str, tuple[int, int, int]], verbose: int = 0) -> list[bytes]:
+        """
+        Hashes the images of @fingerprints, replacing their previous entries in the index, and returns the digests of
+        those that have duplicates.
+        """
+
+        for path in fingerprints:
+            self.index.remove(path)
+        scanned_images = detect_dup_images(
+            list(fingerprints),
+            method=self.method,
+            hash_size=self.hash_size,
+            root_dir=self.directory,
+            output_path_format=self.output_path_format,
+            verbose=verbose,
+            progress_bar=self.progress_bar if verbose > 0 else PROGRESS_BAR_LEVELS[2],
+            cache=self.cache,
+            jobs=self.jobs if len(fingerprints) > MAX_JOB_CHUNK_SIZE else 1,
+            validation=self.validation,
+            prefilter=self.prefilter,
+            reduced_decoding=self.reduced_decoding,
+            group=False,
+            prefetch=self.prefetch,
+            prefetch_memory=self.prefetch_memory,
+            use_mmap=self.use_mmap
+        )
+
+        dup_digests = []
+        for entry in range(scanned_images.entry_count):
+            path = scanned_images.path(entry)
+            digest = scanned_images.digest(entry)
+            if self.index.add(
+                    path, digest, *scanned_images.size(entry),
+                    file_size=scanned_images.file_sizes[entry], file_format=scanned_images.file_format(entry),
+                    mtime_ns=scanned_images.mtimes_ns[entry], fingerprint=fingerprints[path]
+            ):
+                dup_digests.append(digest)
+        return dup_digests
+
+    def _report(self, dups: DupResults) -> None:
+        if len(dups) == 0:
+            return
+        print_dups(
+            dups,
+            root_dir=self.directory,
+            output_path_format=self.output_path_format,
+            colored_cluster_header=True,
+            show_hash_cluster_header=self.show_hash,
+            flush=True
+        )
+        if self.clean_dups:
+            clean(
+                dups,
+                root_dir=self.directory,
+                interactive=self.interactive,
+                verbose=self.verbose,
+                output_path_format=self.output_path_format
+            )
+
+    def build(self) -> DupResults:
+        """
+        Hashes every image of the directory, and returns their duplications.
+        """
+
+        fingerprints = {}
+        for entry in _walk_images(self.directory, self.exclude, self.recursive, self.index_threads):
+            try:
+                fingerprints[entry.path] = file_fingerprint(entry.stat())
+            except OSError:
+                continue  # Removed since the directory was listed
+        if self.verbose > 0:
+            print(f'Found {colored(str(len(fingerprints)), attrs=["bold"])} image(s)', flush=True)
+        self._hash(fingerprints, verbose=self.verbose)
+        dups = self.index.dup_results()
+        if self.verbose > 0:
+            print(flush=True)
+        self._report(dups)
+        return dups
+
+    def update(self, changed: Iterable[str] | None) -> DupResults:
+        """
+        Updates the index with the @changed files and directories (every indexed and current image if None), and returns
+        the duplications of the new and changed images.
+        """
+
+        if changed is None:
+            changed = set(self.index.paths())
+            changed.update(entry.path for entry in _walk_images(self.directory, self.exclude, self.recursive))
+
+        fingerprints = {}
+        removed_count = 0
+        for path in sorted(changed):
+            try:
+                st = os.stat(path)
+            except OSError:
+                removed_count += self.index.remove(path) + self.index.remove_tree(path)
+                continue
+
+            if stat.S_ISDIR(st.st_mode):
+                # Directories moved into the tree as a whole
+                for entry in _walk_images(path, self.exclude, self.recursive):
+                    try:
+                        fingerprint = file_fingerprint(entry.stat())
+                    except OSError:
+                        continue
+                    if self.index.fingerprint(entry.path) != fingerprint:
+                        fingerprints[entry.path] = fingerprint
+            elif stat.S_ISREG(st.st_mode) and self._is_watched_image(path):
+                if self.index.fingerprint(path) != file_fingerprint(st):
+                    fingerprints[path] = file_fingerprint(st)
+
+        dup_digests = self._hash(fingerprints) if len(fingerprints) > 0 else []
+        dups = self.index.dup_results(dup_digests)
+        if self.verbose > 0 and (len(fingerprints) > 0 or removed_count > 0):
+            print(
+                f'[{time.strftime("%H:%M:%S")}] '
+                f'Hashed {colored(str(len(fingerprints)), attrs=["bold"])} new or changed image(s), '
+                f'removed {colored(str(removed_count), attrs=["bold"])} image(s), '
+                f'found {colored(str(len(dups)), attrs=["bold"])} duplication(s) '
+                f'({colored(str(len(self.index)), attrs=["bold"])} image(s) indexed)',
+                flush=True
+            )
+        if self.verbose > 1:
+            for path in fingerprints:
+                print(f'Hashed "{format_path(path, self.output_path_format, self.directory)}"', flush=True)
+        self._report(dups)
+        return dups
+
+    def run(self, watcher: InotifyWatcher | PollingWatcher) -> None:
+        """
+        Builds the index, then updates it with the changes reported by @watcher until interrupted. @watcher should be
+        created beforehand, so that images added while the index is being built are not missed.
+        """
+
+        self.build()
+        if self.verbose > 0:
+            print(
+                f'Watching "{self.directory}" for changes '
+                f'({"inotify" if isinstance(watcher, InotifyWatcher) else "polling"}), press Ctrl+C to stop...',
+                flush=True
+            )
+        while True:
+            self.update(watcher.wait())
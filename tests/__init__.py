@@ -6,3 +6,11 @@ DIR_DATA_SCRAPED = os.path.join(DIR_DATA, 'scraped/')
 DATA_DUPLICATE_PERCENTAGE = 0.2  # Percentage of images to be duplicated in test data
 DATA_MAX_DUPLICATES = 3          # Maximum number of duplicated images in test data
 DATA_RANDOM_SEED = 42            # Random seed for reproducibility of test data duplication process
+
+DIR_DATA_SYNTHETIC = os.path.abspath('tests/data/synthetic/')
+SYNTHETIC_IMAGE_COUNT = 200           # Number of original images in synthetic test data
+SYNTHETIC_DUPLICATE_PERCENTAGE = 0.3  # Percentage of images to be duplicated in synthetic test data
+SYNTHETIC_MIN_SIZE = 64               # Minimum width and height of images in synthetic test data
+SYNTHETIC_MAX_SIZE = 1024             # Maximum width and height of images in synthetic test data
+SYNTHETIC_RANDOM_SEED = 42            # Random seed for reproducibility of synthetic test data generation
+SYNTHETIC_MANIFEST = 'manifest.json'  # Record of planted duplicates, saved along with synthetic test data
@@ -0,0 +1,235 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+from os.path import dirname
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+
+
+sys.path.append(os.path.join(dirname(__file__) + '/..', 'src/imdupes'))
+sys.path.append(os.path.join(dirname(__file__) + '/..'))
+import dupfile
+from detect_dup_images import detect_dup_images
+from utils.futils import index_images
+from utils.imutils import calc_hash_size
+from utils.results import DupResults
+from utils.profiling import peak_rss
+from utils.globs import HashingMethod
+from utils.globs import AutoHashSize
+from tests import SYNTHETIC_MANIFEST
+from tests.init_synthetic_data import generate
+
+
+BENCHMARK_HASH_SIZES = [8, 16, 32]
+BENCHMARK_FORMAT_VERSION = 1
+
+
+def score(dups: DupResults, corpus: str) -> dict:
+    """
+    Returns the recall and precision of @dups against the duplicates planted in @corpus, counted in image pairs.
+    """
+
+    with open(os.path.join(corpus, SYNTHETIC_MANIFEST), 'rt') as f:
+        manifest = json.load(f)
+    planted = {frozenset((duplicate['path'], duplicate['original'])) for duplicate in manifest['duplicates']}
+    found = set()
+    for cluster_id in range(len(dups)):
+        basenames = [os.path.basename(path) for path in dups.cluster_paths(cluster_id)]
+        found.update(frozenset((a, b)) for i, a in enumerate(basenames) for b in basenames[i + 1:])
+    return {
+        'recall': round(len(found & planted) / len(planted), 4) if len(planted) > 0 else None,
+        'precision': round(len(found & planted) / len(found), 4) if len(found) > 0 else None
+    }
+
+
+def run_stage(stage: str, corpus: str, method: str = None, hash_size: int = None, jobs: int = 1) -> dict:
+    """
+    Runs one benchmark stage on @corpus, timing only the stage itself and not the stages it depends on. Meant to be run
+    in a fresh process, so that the reported peak RSS is that of the stage.
+    """
+
+    result = {}
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        start_time = time.perf_counter()
+        img_paths = index_images(corpus)
+        image_count = len(img_paths)
+
+        if stage == 'calc_hash_size':
+            start_time = time.perf_counter()
+            result['calculated_hash_size'], _ = calc_hash_size(img_paths, auto_hash_size=AutoHashSize.MAX_DIMS_MEAN)
+        elif stage in ('detect_dup_images', 'dupfile.save', 'dupfile.load'):
+            if stage == 'detect_dup_images':
+                start_time = time.perf_counter()
+            dups = detect_dup_images(img_paths, method=HashingMethod(method), hash_size=hash_size, jobs=jobs)
+            if stage == 'detect_dup_images':
+                result.update(score(dups, corpus))
+            dupfile_path = os.path.join(tmp_dir, 'benchmark.imdup')
+            if stage == 'dupfile.save':
+                start_time = time.perf_counter()
+            if stage in ('dupfile.save', 'dupfile.load'):
+                dupfile.save(dups, dupfile_path)
+                image_count = dups.file_count
+            if stage == 'dupfile.load':
+                start_time = time.perf_counter()
+                dupfile.load(dupfile_path)
+        elif stage != 'index_images':
+            raise ValueError(f'Unknown benchmark stage {stage}')
+
+        seconds = time.perf_counter() - start_time
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    return {
+        'stage': stage,
+        'method': method,
+        'hash_size': hash_size,
+        'jobs': jobs,
+        'images': image_count,
+        'seconds': seconds,
+        'images_per_sec': image_count / max(seconds, 1e-9),
+        'peak_rss_bytes': peak_rss(),
+        **result
+    }
+
+
+def benchmark_cases(methods: list[str], hash_sizes: list[int]) -> list[dict]:
+    cases = [{'stage': 'index_images'}, {'stage': 'calc_hash_size'}]
+    cases += [
+        {'stage': 'detect_dup_images', 'method': method, 'hash_size': hash_size}
+        for method in methods for hash_size in hash_sizes
+    ]
+    cases += [
+        {'stage': stage, 'method': HashingMethod.BW.value, 'hash_size': min(hash_sizes)}
+        for stage in ('dupfile.save', 'dupfile.load')
+    ]
+    return cases
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def case_key(result: dict) -> tuple:
+    return result['stage'], result['method'], result['hash_size'], result['jobs']
+
+
+def run(
+        corpus: str,
+        methods: list[str],
+        hash_sizes: list[int],
+        jobs: int = 1,
+        repeat: int = 1,
+        print_fn: Callable[[str], None] = print
+) -> list[dict]:
+    """
+    Runs every benchmark case @repeat times, each in a fresh process, and keeps the fastest run of each case.
+    """
+
+    results = []
+    for case in benchmark_cases(methods, hash_sizes):
+        runs = []
+        for _ in range(repeat):
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                runs.append(executor.submit(run_stage, corpus=corpus, jobs=jobs, **case).result())
+        best = min(runs, key=lambda r: r['seconds'])
+        results.append(best)
+        line = (
+            f'{best["stage"]:18} {best["method"] or "":20} {best["hash_size"] or "":>4} '
+            f'{best["seconds"]:9.3f}s {best["images_per_sec"]:10.1f} images/s'
+        )
+        if best['peak_rss_bytes'] is not None:
+            line += f' {best["peak_rss_bytes"] / 2 ** 20:8.1f} MiB peak RSS'
+        if 'calculated_hash_size' in best:
+            line += f' (hash size: {best["calculated_hash_size"]})'
+        if 'recall' in best:
+            line += f' (recall: {best["recall"]}, precision: {best["precision"]})'
+        print_fn(line)
+    return results
+
+
+def compare(results: list[dict], baseline: list[dict], print_fn: Callable[[str], None] = print) -> None:
+    baseline_results = {case_key(result): result for result in baseline}
+    print_fn('\nSpeedup over baseline:')
+    for result in results:
+        base = baseline_results.get(case_key(result))
+        if base is None:
+            continue
+        print_fn(
+            f'{result["stage"]:18} {result["method"] or "":20} {result["hash_size"] or "":>4} '
+            f'{base["seconds"] / max(result["seconds"], 1e-9):6.2f}x'
+        )
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(
+        description='Benchmark the image indexing, hashing and dupfile stages on a synthetic image corpus'
+    )
+    ap.add_argument(
+        '-c', '--corpus', metavar='DIR', default=None,
+        help='benchmark on an existing corpus generated by tests/init_synthetic_data.py instead of generating one'
+    )
+    ap.add_argument('-n', '--images', type=int, default=500, help='number of original images to generate')
+    ap.add_argument('--max-size', type=int, default=1024, help='maximum width and height of generated images')
+    ap.add_argument(
+        '-m', '--methods', nargs='+', choices=[m.value for m in HashingMethod],
+        default=[m.value for m in HashingMethod],
+        help='hashing methods to benchmark (default: all)'
+    )
+    ap.add_argument(
+        '-s', '--hash-sizes', nargs='+', type=int, default=BENCHMARK_HASH_SIZES,
+        help=f'hash sizes to benchmark (default: {" ".join(str(s) for s in BENCHMARK_HASH_SIZES)})'
+    )
+    ap.add_argument('-j', '--jobs', type=int, default=1, help='worker processes used for hashing images')
+    ap.add_argument('--repeat', type=int, default=1, help='runs of each case, the fastest of which is kept')
+    ap.add_argument('-o', '--output', metavar='JSON', default=None, help='save the results to a JSON file')
+    ap.add_argument('--baseline', metavar='JSON', default=None, help='compare the results to earlier saved results')
+    args = ap.parse_args()
+
+    corpus = args.corpus
+    tmp_corpus = None
+    if corpus is None:
+        corpus = tmp_corpus = tempfile.mkdtemp()
+        print(f'Generating {args.images} synthetic images...', flush=True)
+        generate(corpus, image_count=args.images, max_size=args.max_size)
+    try:
+        bench_results = run(corpus, args.methods, args.hash_sizes, jobs=args.jobs, repeat=args.repeat)
+    finally:
+        if tmp_corpus is not None:
+            shutil.rmtree(tmp_corpus)
+
+    if args.output is not None:
+        with open(args.output, 'wt') as out_file:
+            json.dump(
+                {
+                    'version': BENCHMARK_FORMAT_VERSION,
+                    'commit': git_commit(),
+                    'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                    'python': platform.python_version(),
+                    'platform': platform.platform(),
+                    'cpu_count': os.cpu_count(),
+                    'corpus': args.corpus if args.corpus is not None else {
+                        'images': args.images, 'max_size': args.max_size
+                    },
+                    'results': bench_results
+                },
+                out_file, indent=2
+            )
+        print(f'\nResults saved to "{args.output}"')
+
+    if args.baseline is not None:
+        with open(args.baseline, 'rt') as baseline_file:
+            compare(bench_results, json.load(baseline_file)['results'])
@@ -0,0 +1,224 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+from os.path import dirname
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+
+
+sys.path.append(os.path.join(dirname(__file__) + '/..', 'src/imdupes'))
+sys.path.append(os.path.join(dirname(__file__) + '/..'))
+import hashindex
+from detect_dup_images import detect_dup_images
+from service import ServiceClient
+from utils.futils import index_images
+from utils.globs import HashingMethod
+from tests.init_synthetic_data import generate
+from tests.benchmark import git_commit
+
+
+SERVICE_BENCHMARK_FORMAT_VERSION = 1
+SERVICE_START_TIMEOUT = 60  # Seconds
+
+
+def percentiles(latencies: list[float]) -> dict:
+    latencies = sorted(latencies)
+    return {
+        f'p{p}': latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] * 1000 for p in (50, 95, 99)
+    }
+
+
+def start_service(index: str, socket_path: str, threshold: int) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [
+            sys.executable, os.path.join(dirname(__file__), '..', 'src', 'imdupes', 'imdupes.py'), 'serve', index,
+            '--socket', socket_path, '-t', str(threshold)
+        ],
+        stdout=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + SERVICE_START_TIMEOUT
+    while True:
+        try:
+            client = ServiceClient(socket_path=socket_path)
+            client.stats()
+            client.close()
+            return process
+        except OSError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                raise RuntimeError('Dedup service did not start')
+            time.sleep(0.1)
+
+
+def run_case(
+        socket_path: str,
+        queries: list[Callable[[ServiceClient], object]],
+        query_images: int,
+        clients: int
+) -> dict:
+    """
+    Runs @queries against the service from @clients concurrent clients, each with its own connection, and returns the
+    latency percentiles (in milliseconds) of single queries and the overall throughput.
+    """
+
+    def run_client(client_queries: list[Callable[[ServiceClient], object]]) -> list[float]:
+        client = ServiceClient(socket_path=socket_path)
+        latencies = []
+        try:
+            for query in client_queries:
+                start_time = time.perf_counter()
+                query(client)
+                latencies.append(time.perf_counter() - start_time)
+        finally:
+            client.close()
+        return latencies
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        latencies = [
+            latency
+            for client_latencies in executor.map(run_client, [queries[i::clients] for i in range(clients)])
+            for latency in client_latencies
+        ]
+    seconds = time.perf_counter() - start_time
+    return {
+        'requests': len(queries),
+        'clients': clients,
+        'seconds': seconds,
+        'requests_per_sec': len(queries) / max(seconds, 1e-9),
+        'images_per_sec': len(queries) * query_images / max(seconds, 1e-9),
+        **percentiles(latencies)
+    }
+
+
+def run(
+        corpus: str,
+        method: str,
+        hash_size: int,
+        threshold: int = 0,
+        query_count: int = 500,
+        batch_size: int = 16,
+        clients: int = 1,
+        print_fn: Callable[[str], None] = print
+) -> dict:
+    tmp_dir = tempfile.mkdtemp()
+    process = None
+    try:
+        img_paths = index_images(corpus)
+        start_time = time.perf_counter()
+        scanned_images = detect_dup_images(
+            img_paths, method=HashingMethod(method), hash_size=hash_size, group=False, keep_hashes=True
+        )
+        index = os.path.join(tmp_dir, 'benchmark.imidx')
+        hashindex.save(scanned_images, index)
+        print_fn(f'Indexed {scanned_images.entry_count} images in {time.perf_counter() - start_time:.3f}s')
+
+        socket_path = os.path.join(tmp_dir, 'service.sock')
+        start_time = time.perf_counter()
+        process = start_service(index, socket_path, threshold)
+        startup_seconds = time.perf_counter() - start_time
+        print_fn(f'Service started in {startup_seconds:.3f}s')
+
+        rng = random.Random(0)
+        query_paths = [os.fspath(rng.choice(img_paths)) for _ in range(query_count)]
+        query_data = [open(path, 'rb').read() for path in query_paths]
+        cases = {
+            'path': ([lambda client, path=path: client.query([path]) for path in query_paths], 1),
+            'bytes': ([lambda client, data=data: client.query_bytes(data) for data in query_data], 1),
+            f'batch of {batch_size} paths': (
+                [
+                    lambda client, i=i: client.query(query_paths[i:i + batch_size])
+                    for i in range(0, query_count - batch_size + 1, batch_size)
+                ],
+                batch_size
+            )
+        }
+
+        results = []
+        for case, (queries, query_images) in cases.items():
+            result = {'case': case, **run_case(socket_path, queries, query_images, clients)}
+            results.append(result)
+            print_fn(
+                f'{case:22} p50 {result["p50"]:8.2f}ms p95 {result["p95"]:8.2f}ms p99 {result["p99"]:8.2f}ms '
+                f'{result["requests_per_sec"]:9.1f} requests/s {result["images_per_sec"]:9.1f} images/s'
+            )
+        return {
+            'method': method,
+            'hash_size': hash_size,
+            'threshold': threshold,
+            'indexed_images': scanned_images.entry_count,
+            'startup_seconds': startup_seconds,
+            'results': results
+        }
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(
+        description='Benchmark the query latency and throughput of a local dedup service instance (imdupes serve) on a '
+                    'synthetic image corpus'
+    )
+    ap.add_argument(
+        '-c', '--corpus', metavar='DIR', default=None,
+        help='benchmark on an existing corpus generated by tests/init_synthetic_data.py instead of generating one'
+    )
+    ap.add_argument('-n', '--images', type=int, default=500, help='number of original images to generate')
+    ap.add_argument('--max-size', type=int, default=1024, help='maximum width and height of generated images')
+    ap.add_argument(
+        '-m', '--method', choices=[m.value for m in HashingMethod], default=HashingMethod.BW.value,
+        help=f'hashing method of the index (default: {HashingMethod.BW.value})'
+    )
+    ap.add_argument('-s', '--hash-size', type=int, default=16, help='hash size of the index (default: 16)')
+    ap.add_argument(
+        '-t', '--threshold', type=int, default=0, help='Hamming distance threshold of the queries (default: 0)'
+    )
+    ap.add_argument('-q', '--queries', type=int, default=500, help='number of queried images of each case')
+    ap.add_argument('-b', '--batch-size', type=int, default=16, help='images per batched query (default: 16)')
+    ap.add_argument('--clients', type=int, default=1, help='concurrent clients, each with its own connection')
+    ap.add_argument('-o', '--output', metavar='JSON', default=None, help='save the results to a JSON file')
+    args = ap.parse_args()
+
+    corpus = args.corpus
+    tmp_corpus = None
+    if corpus is None:
+        corpus = tmp_corpus = tempfile.mkdtemp()
+        print(f'Generating {args.images} synthetic images...', flush=True)
+        generate(corpus, image_count=args.images, max_size=args.max_size)
+    try:
+        bench_results = run(
+            corpus, args.method, args.hash_size, threshold=args.threshold, query_count=args.queries,
+            batch_size=args.batch_size, clients=args.clients
+        )
+    finally:
+        if tmp_corpus is not None:
+            shutil.rmtree(tmp_corpus)
+
+    if args.output is not None:
+        with open(args.output, 'wt') as out_file:
+            json.dump(
+                {
+                    'version': SERVICE_BENCHMARK_FORMAT_VERSION,
+                    'commit': git_commit(),
+                    'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                    'python': platform.python_version(),
+                    'platform': platform.platform(),
+                    'cpu_count': os.cpu_count(),
+                    'corpus': args.corpus if args.corpus is not None else {
+                        'images': args.images, 'max_size': args.max_size
+                    },
+                    **bench_results
+                },
+                out_file, indent=2
+            )
+        print(f'\nResults saved to "{args.output}"')
@@ -0,0 +1,142 @@
+import os
+import sys
+import json
+import random
+import shutil
+import argparse
+from PIL import Image, ImageDraw
+
+
+from tests import DIR_DATA_SYNTHETIC, SYNTHETIC_MANIFEST
+from tests import SYNTHETIC_IMAGE_COUNT, SYNTHETIC_DUPLICATE_PERCENTAGE, SYNTHETIC_RANDOM_SEED
+from tests import SYNTHETIC_MIN_SIZE, SYNTHETIC_MAX_SIZE
+
+
+# (Pillow format, file extension, image mode) of synthetic images
+SYNTHETIC_FORMATS = [
+    ('JPEG', 'jpg', 'RGB'),
+    ('PNG', 'png', 'RGB'),
+    ('PNG', 'png', 'RGBA'),
+    ('WEBP', 'webp', 'RGB'),
+    ('BMP', 'bmp', 'RGB'),
+    ('GIF', 'gif', 'P'),
+    ('TIFF', 'tiff', 'RGB'),
+]
+DUPLICATE_KINDS = ['exact', 'reencoded', 'resized']
+
+
+def draw_image(rng: random.Random, width: int, height: int, mode: str) -> Image:
+    """
+    Draws a random composition of a background gradient and filled shapes, so that different images do not hash alike.
+    """
+
+    def color() -> tuple[int, ...]:
+        return tuple(rng.randrange(256) for _ in range(4 if mode == 'RGBA' else 3))
+
+    draw_mode = 'RGBA' if mode == 'RGBA' else 'RGB'
+    gradient = Image.linear_gradient('L').rotate(rng.choice([0, 90, 180, 270])).resize((width, height))
+    im = Image.composite(
+        Image.new(draw_mode, (width, height), color()), Image.new(draw_mode, (width, height), color()), gradient
+    )
+    draw = ImageDraw.Draw(im)
+    for _ in range(rng.randint(3, 12)):
+        x0, x1 = sorted(rng.randrange(width) for _ in range(2))
+        y0, y1 = sorted(rng.randrange(height) for _ in range(2))
+        shape = rng.choice(['rectangle', 'ellipse', 'polygon'])
+        if shape == 'rectangle':
+            draw.rectangle((x0, y0, x1, y1), fill=color())
+        elif shape == 'ellipse':
+            draw.ellipse((x0, y0, x1, y1), fill=color())
+        else:
+            vertices = [(rng.randrange(width), rng.randrange(height)) for _ in range(rng.randint(3, 6))]
+            draw.polygon(vertices, fill=color())
+    return im.convert('P') if mode == 'P' else im
+
+
+def save_image(im: Image, path: str, file_format: str, rng: random.Random) -> None:
+    if file_format in ('JPEG', 'WEBP'):
+        im.save(path, file_format, quality=rng.randint(70, 95))
+    else:
+        im.save(path, file_format)
+
+
+def generate(
+        directory: str = DIR_DATA_SYNTHETIC,
+        image_count: int = SYNTHETIC_IMAGE_COUNT,
+        duplicate_percentage: float = SYNTHETIC_DUPLICATE_PERCENTAGE,
+        min_size: int = SYNTHETIC_MIN_SIZE,
+        max_size: int = SYNTHETIC_MAX_SIZE,
+        seed: int = SYNTHETIC_RANDOM_SEED,
+        verbose: bool = False
+) -> dict:
+    """
+    Generates a reproducible image corpus of mixed formats and sizes into @directory, with planted exact, re-encoded and
+    resized duplicates of a share of the images, and records them in a manifest saved alongside the images.
+
+    Returns the manifest: the generation parameters, the original images, and the duplicates as {path, original, kind}
+    entries (paths relative to @directory).
+    """
+
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    manifest = {
+        'seed': seed,
+        'image_count': image_count,
+        'duplicate_percentage': duplicate_percentage,
+        'min_size': min_size,
+        'max_size': max_size,
+        'originals': [],
+        'duplicates': []
+    }
+
+    for i in range(image_count):
+        file_format, ext, mode = rng.choice(SYNTHETIC_FORMATS)
+        width, height = rng.randint(min_size, max_size), rng.randint(min_size, max_size)
+        filename = f'synthetic_{i:05}.{ext}'
+        im = draw_image(rng, width, height, mode)
+        save_image(im, os.path.join(directory, filename), file_format, rng)
+        manifest['originals'].append(filename)
+
+        if rng.random() > duplicate_percentage:
+            continue
+        kind = rng.choice(DUPLICATE_KINDS)
+        if kind == 'exact':
+            dup_filename = f'DUPLICATE_exact_{filename}'
+            shutil.copy(os.path.join(directory, filename), os.path.join(directory, dup_filename))
+        elif kind == 'reencoded':
+            dup_format, dup_ext, _ = rng.choice([f for f in SYNTHETIC_FORMATS if f[0] != file_format and f[2] != 'P'])
+            dup_filename = f'DUPLICATE_reencoded_{os.path.splitext(filename)[0]}.{dup_ext}'
+            dup_im = im.convert('RGBA' if im.mode == 'RGBA' and dup_format in ('PNG', 'WEBP', 'TIFF') else 'RGB')
+            save_image(dup_im, os.path.join(directory, dup_filename), dup_format, rng)
+        else:
+            scale = rng.uniform(0.5, 0.9)
+            dup_filename = f'DUPLICATE_resized_{filename}'
+            dup_im = im.resize((max(1, int(width * scale)), max(1, int(height * scale))), Image.Resampling.LANCZOS)
+            save_image(dup_im, os.path.join(directory, dup_filename), file_format, rng)
+        manifest['duplicates'].append({'path': dup_filename, 'original': filename, 'kind': kind})
+        if verbose:
+            print(f'Image {i + 1}/{image_count}: {filename} was duplicated ({kind}).')
+
+    with open(os.path.join(directory, SYNTHETIC_MANIFEST), 'wt') as f:
+        json.dump(manifest, f, indent=2)
+
+    if verbose:
+        print(
+            f'\nGenerated {image_count} images and {len(manifest["duplicates"])} duplicates in {directory}\n'
+            f'[DONE]'
+        )
+    return manifest
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='Generate a reproducible synthetic image corpus with planted duplicates')
+    ap.add_argument('-o', '--output', default=DIR_DATA_SYNTHETIC, metavar='DIR', help='output directory')
+    ap.add_argument('-n', '--images', type=int, default=SYNTHETIC_IMAGE_COUNT, help='number of original images')
+    ap.add_argument('--seed', type=int, default=SYNTHETIC_RANDOM_SEED, help='random seed')
+    ap.add_argument('--max-size', type=int, default=SYNTHETIC_MAX_SIZE, help='maximum image width and height')
+    args = ap.parse_args()
+
+    if os.path.isdir(args.output) and len(os.listdir(args.output)) != 0:
+        print(f'"{args.output}" is not empty. Program terminated.', file=sys.stderr)
+        exit(1)
+    generate(args.output, image_count=args.images, max_size=args.max_size, seed=args.seed, verbose=True)
@@ -0,0 +1,135 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+import contextlib
+import io
+from os.path import dirname
+
+
+sys.path.append(os.path.join(dirname(__file__) + '/..', 'src/imdupes'))
+sys.path.append(os.path.join(dirname(__file__) + '/..', 'tests'))
+from detect_dup_images import detect_dup_images
+from utils.cache import HashCache, dir_fingerprint
+from utils.imutils import report_info, calc_hash_size
+from utils.globs import HashingMethod
+from utils.globs import ValidationPolicy
+from tests import DIR_DATA
+
+
+class Cache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.tmp_dir, 'cache.sqlite3')
+        self.img_path = os.path.join(self.tmp_dir, 'pikachu.jpg')
+        shutil.copy(os.path.join(DIR_DATA, 'pikachu.jpg'), self.img_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_fingerprint(self):
+        cache = HashCache(self.cache_file)
+        cache.put_hash(self.img_path, os.stat(self.img_path), HashingMethod.BW, 8, b'digest', None, (10, 20), 'JPEG')
+        cache.close()
+
+        cache = HashCache(self.cache_file)
+        self.assertEqual(
+            (b'digest', None, (10, 20), 'JPEG'),
+            cache.get_hash(self.img_path, os.stat(self.img_path), HashingMethod.BW, 8)
+        )
+        self.assertIsNone(cache.get_hash(self.img_path, os.stat(self.img_path), HashingMethod.BW, 8, full_hash=True))
+        self.assertIsNone(cache.get_hash(self.img_path, os.stat(self.img_path), HashingMethod.BW, 16))
+        self.assertIsNone(cache.get_hash(self.img_path, os.stat(self.img_path), HashingMethod.RGB, 8))
+        with open(self.img_path, 'ab') as f:
+            f.write(b'\0')
+        self.assertIsNone(cache.get_hash(self.img_path, os.stat(self.img_path), HashingMethod.BW, 8))
+        cache.close()
+
+        cache = HashCache(self.cache_file, rebuild=True)
+        self.assertIsNone(cache.get_hash(self.img_path, os.stat(self.img_path), HashingMethod.BW, 8))
+        cache.close()
+
+    def test_validation(self):
+        st = os.stat(self.img_path)
+        cache = HashCache(self.cache_file)
+        cache.put_hash(
+            self.img_path, st, HashingMethod.BW, 8, b'digest', None, (10, 20), 'JPEG',
+            validation=ValidationPolicy.HEADER
+        )
+        cache.put_error(self.img_path, st, 'Truncated', ValidationPolicy.HEADER)
+        self.assertIsNotNone(cache.get_hash(self.img_path, st, HashingMethod.BW, 8, validation=ValidationPolicy.NONE))
+        self.assertIsNotNone(cache.get_hash(self.img_path, st, HashingMethod.BW, 8, validation=ValidationPolicy.HEADER))
+        self.assertIsNone(cache.get_hash(self.img_path, st, HashingMethod.BW, 8, validation=ValidationPolicy.FULL))
+        self.assertIsNone(cache.get_error(self.img_path, st, ValidationPolicy.NONE))
+        self.assertEqual('Truncated', cache.get_error(self.img_path, st, ValidationPolicy.HEADER))
+        self.assertEqual('Truncated', cache.get_error(self.img_path, st, ValidationPolicy.FULL))
+
+        cache.put_image(self.img_path, st, 10, 20, 'JPEG', ValidationPolicy.NONE)
+        self.assertIsNotNone(cache.get_image(self.img_path, st, ValidationPolicy.NONE))
+        self.assertIsNone(cache.get_image(self.img_path, st, ValidationPolicy.HEADER))
+        cache.close()
+
+    def test_detect(self):
+        img_paths = [self.img_path, os.path.join(self.tmp_dir, 'copy.jpg'), os.path.join(self.tmp_dir, 'bad.jpg')]
+        shutil.copy(self.img_path, img_paths[1])
+        with open(img_paths[2], 'wb') as f:
+            f.write(b'not an image')
+
+        for _ in range(2):
+            cache = HashCache(self.cache_file)
+            dups = detect_dup_images(img_paths, method=HashingMethod.BW, hash_size=8, cache=cache)
+            cache.close()
+            self.assertCountEqual(img_paths[:2], dups.cluster_paths(0))
+
+        cache = HashCache(self.cache_file)
+        self.assertIsNotNone(cache.get_error(img_paths[2], os.stat(img_paths[2])))
+        cache.close()
+
+    def test_verified(self):
+        for expected in ({self.img_path}, set()):
+            cache = HashCache(self.cache_file)
+            verified = set()
+            calc_hash_size([self.img_path], cache=cache, validation=ValidationPolicy.FULL, verified=verified)
+            cache.close()
+            self.assertEqual(expected, verified)
+
+    def test_info(self):
+        img_paths = [self.img_path, os.path.join(self.tmp_dir, 'bad.jpg')]
+        with open(img_paths[1], 'wb') as f:
+            f.write(b'not an image')
+
+        def fingerprint():
+            return dir_fingerprint((os.path.basename(img_path), os.stat(img_path)) for img_path in img_paths)
+
+        for _ in range(2):
+            cache = HashCache(self.cache_file)
+            with contextlib.redirect_stdout(io.StringIO()):
+                report_info(img_paths, root_dir=self.tmp_dir, jobs=2, cache=cache)
+            cache.close()
+
+        cache = HashCache(self.cache_file)
+        images = cache.get_dir(self.tmp_dir, ValidationPolicy.HEADER, fingerprint())
+        self.assertEqual(len(img_paths), len(images))
+        self.assertEqual('JPEG', images[0][2])
+        self.assertIsNotNone(images[1][3])
+        self.assertIsNone(cache.get_dir(self.tmp_dir, ValidationPolicy.FULL, fingerprint()))
+        with open(img_paths[1], 'ab') as f:
+            f.write(b'\0')
+        self.assertIsNone(cache.get_dir(self.tmp_dir, ValidationPolicy.HEADER, fingerprint()))
+        cache.close()
+
+    def test_eviction(self):
+        cache = HashCache(self.cache_file, max_size=0)
+        st = os.stat(self.img_path)
+        for i in range(1000):
+            cache.put_hash(f'{self.img_path}{i}', st, HashingMethod.BW, 8, b'digest', b'hash' * 16, (10, 20), 'JPEG')
+        cache.close()
+
+        cache = HashCache(self.cache_file)
+        self.assertIsNone(cache.get_hash(f'{self.img_path}0', st, HashingMethod.BW, 8))
+        cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,9 +6,10 @@ from os.path import dirname
 
 sys.path.append(os.path.join(dirname(__file__) + '/..', 'src/imdupes'))
 sys.path.append(os.path.join(dirname(__file__) + '/..', 'tests'))
-from detect_dup_images import detect_dup_images
+from detect_dup_images import detect_dup_images, detect_dup_images_methods, tune_hash_size
+from utils.futils import index_images, iter_images
 from utils.globs import HashingMethod
-from tests import DIR_DATA_SCRAPED
+from tests import DIR_DATA, DIR_DATA_SCRAPED
 
 
 def get_test_dups() -> list[str]:
@@ -34,12 +35,63 @@ class Detect(unittest.TestCase):
             verbose=True
         )
         detect_dups = []
-        for dup_imgs in detect_dups_dict.values():
-            for dup_img in dup_imgs:
-                detect_dups.append(os.path.basename(dup_img.path))
+        for cluster_id in range(len(detect_dups_dict)):
+            for dup_img_path in detect_dups_dict.cluster_paths(cluster_id):
+                detect_dups.append(os.path.basename(dup_img_path))
 
         self.assertCountEqual(test_dups, detect_dups)  # add assertion here
 
+    def test_jobs(self):
+        img_paths = [os.path.join(DIR_DATA_SCRAPED, img) for img in os.listdir(DIR_DATA_SCRAPED)]
+        serial_dups = detect_dup_images(img_paths, method=HashingMethod.BW, hash_size=16)
+        parallel_dups = detect_dup_images(img_paths, method=HashingMethod.BW, hash_size=16, jobs=3)
+
+        self.assertEqual(serial_dups.cluster_keys, parallel_dups.cluster_keys)
+        for cluster_id in range(len(serial_dups)):
+            self.assertEqual(serial_dups.cluster_paths(cluster_id), parallel_dups.cluster_paths(cluster_id))
+
+    def test_streaming(self):
+        img_paths = [entry.path for entry in index_images(DIR_DATA, recursive=True)]
+        self.assertEqual(img_paths, [entry.path for entry in iter_images(DIR_DATA, recursive=True)])
+
+        indexed_dups = detect_dup_images(img_paths, method=HashingMethod.BW, hash_size=16)
+        streamed_dups = detect_dup_images(
+            iter_images(DIR_DATA, recursive=True), method=HashingMethod.BW, hash_size=16, jobs=2
+        )
+
+        self.assertEqual(indexed_dups.cluster_keys, streamed_dups.cluster_keys)
+        for cluster_id in range(len(indexed_dups)):
+            self.assertEqual(indexed_dups.cluster_paths(cluster_id), streamed_dups.cluster_paths(cluster_id))
+
+    def test_methods(self):
+        img_paths = [entry.path for entry in index_images(DIR_DATA, recursive=True)]
+        method_dups = detect_dup_images_methods(img_paths, methods=list(HashingMethod), hash_size=16, threshold=2)
+
+        self.assertEqual(list(HashingMethod), list(method_dups.keys()))
+        for method in HashingMethod:
+            dups = detect_dup_images(img_paths, method=method, hash_size=16, threshold=2)
+            self.assertEqual(dups.cluster_keys, method_dups[method].cluster_keys, method)
+            for cluster_id in range(len(dups)):
+                self.assertEqual(dups.cluster_paths(cluster_id), method_dups[method].cluster_paths(cluster_id))
+
+    def test_tune_hash_size(self):
+        img_paths = [os.path.join(DIR_DATA_SCRAPED, img) for img in sorted(os.listdir(DIR_DATA_SCRAPED))]
+        candidates = [8, 16, 32]
+
+        hash_size, stats = tune_hash_size(
+            img_paths, [HashingMethod.RGB], candidates=candidates, sample_size=30, max_cost_increase=float('inf'),
+            max_changed=0
+        )
+        self.assertEqual(candidates, [stat['hash_size'] for stat in stats])
+        self.assertIsNone(stats[-1]['changed'])
+        # Every size from the picked one up groups the sampled images the same way
+        self.assertTrue(all(stat['changed'] == 0 for stat in stats[candidates.index(hash_size):-1]))
+
+        self.assertEqual(8, tune_hash_size(img_paths, [HashingMethod.RGB], candidates=candidates, max_changed=1)[0])
+        self.assertEqual(
+            8, tune_hash_size(img_paths, [HashingMethod.RGB], candidates=candidates, max_cost_increase=-1)[0]
+        )
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+import sys
+import os
+import json
+import shutil
+import tempfile
+from os.path import dirname
+
+
+sys.path.append(os.path.join(dirname(__file__) + '/..', 'src/imdupes'))
+sys.path.append(os.path.join(dirname(__file__) + '/..', 'tests'))
+import dupfile
+from detect_dup_images import detect_dup_images
+from utils.globs import HashingMethod
+from tests import DIR_DATA
+
+
+class Dupfile(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.dupfile = os.path.join(self.tmp_dir, 'dups.imdup')
+        self.img_paths = [os.path.join(self.tmp_dir, f'pikachu{i}.jpg') for i in range(3)]
+        for img_path in self.img_paths:
+            shutil.copy(os.path.join(DIR_DATA, 'pikachu.jpg'), img_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_save_load(self):
+        dups = detect_dup_images(self.img_paths, method=HashingMethod.BW, hash_size=8, prefilter=False)
+        dupfile.save(dups, self.dupfile)
+        loaded_dups = dupfile.load(self.dupfile)
+        self.assertEqual(dups.cluster_keys, loaded_dups.cluster_keys)
+        self.assertEqual(dups.cluster_paths(0), loaded_dups.cluster_paths(0))
+        self.assertEqual(
+            [dups.size(entry) for entry in dups.cluster(0)],
+            [loaded_dups.size(entry) for entry in loaded_dups.cluster(0)]
+        )
+
+        # Touched files are rehashed and kept, modified files no longer have the recorded hash and are skipped
+        os.utime(self.img_paths[1], ns=(0, 0))
+        shutil.copy(os.path.join(DIR_DATA, 'INVERT_pikachu.jpg'), self.img_paths[2])
+        self.assertEqual(self.img_paths[:2], dupfile.load(self.dupfile).cluster_paths(0))
+
+    def test_load_v1(self):
+        with open(self.dupfile, 'wt') as f:
+            json.dump([self.img_paths], f)
+        dups = dupfile.load(self.dupfile)
+        self.assertEqual(self.img_paths, dups.cluster_paths(0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+import sys
+import os
+import random
+import shutil
+import tempfile
+from os.path import dirname
+
+
+sys.path.append(os.path.join(dirname(__file__) + '/..', 'src/imdupes'))
+sys.path.append(os.path.join(dirname(__file__) + '/..', 'tests'))
+import dupfile
+from detect_dup_images import detect_dup_images, group_dups
+from utils.extsort import DupRuns
+from utils.results import DupResults
+from utils.globs import HashingMethod
+from tests import DIR_DATA_SCRAPED
+
+
+class ExternalSort(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    @staticmethod
+    def as_lists(chunks: list[DupResults]) -> list[tuple[bytes, list[tuple]]]:
+        return [
+            (dups.cluster_keys[cluster_id], [
+                (dups.path(entry), dups.size(entry), dups.file_format(entry), dups.mtimes_ns[entry], dups.digest(entry))
+                for entry in dups.cluster(cluster_id)
+            ])
+            for dups in chunks
+            for cluster_id in range(len(dups))
+        ]
+
+    def test_grouped(self):
+        rng = random.Random(0)
+        digests = [bytes(rng.randrange(4) for _ in range(16)) for _ in range(200)]
+        images = DupResults(HashingMethod.BW, 16)
+        dup_runs = DupRuns(HashingMethod.BW, 16, memory_limit=2048, tmp_dir=self.tmp_dir, max_merge_runs=3)
+        for i in range(1000):
+            args = (
+                f'dir{i % 7}/image{i}.jpg', rng.randrange(1, 4), rng.randrange(1, 4),
+                i, rng.choice(['JPEG', 'PNG', None]), i * 1000, rng.choice(digests)
+            )
+            images.add(*args)
+            dup_runs.add(*args)
+        self.assertLess(1, dup_runs.run_count)
+
+        # Same duplications, in the same order, as grouped in memory
+        chunks = list(dup_runs.grouped(chunk_size=50))
+        self.assertLess(1, len(chunks))
+        self.assertEqual(self.as_lists([group_dups(images)]), self.as_lists(chunks))
+        dup_runs.close()
+        self.assertEqual([], os.listdir(self.tmp_dir))
+
+        with DupRuns(memory_limit=1, tmp_dir=self.tmp_dir) as dup_runs:
+            self.assertEqual([], list(dup_runs.grouped()))
+
+    def test_detect(self):
+        img_paths = [os.path.join(DIR_DATA_SCRAPED, img) for img in sorted(os.listdir(DIR_DATA_SCRAPED))]
+        dups = detect_dup_images(img_paths, method=HashingMethod.BW, hash_size=16)
+        with detect_dup_images(
+                img_paths, method=HashingMethod.BW, hash_size=16, memory_limit=4096, tmp_dir=self.tmp_dir
+        ) as dup_runs:
+            chunks = list(dup_runs.grouped(chunk_size=10))
+        self.assertEqual(self.as_lists([dups]), self.as_lists(chunks))
+
+        # Dupfiles written a chunk at a time are the same as dupfiles saved at once
+        dupfile.save(dups, os.path.join(self.tmp_dir, 'saved.imdup'))
+        writer = dupfile.DupfileWriter(os.path.join(self.tmp_dir, 'written.imdup'), HashingMethod.BW, 16)
+        for chunk in chunks:
+            writer.write(chunk)
+        writer.close()
+        with open(os.path.join(self.tmp_dir, 'saved.imdup')) as saved, \
+                open(os.path.join(self.tmp_dir, 'written.imdup')) as written:
+            self.assertEqual(saved.read(), written.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+import contextlib
+import io
+from os.path import dirname
+
+
+sys.path.append(os.path.join(dirname(__file__) + '/..', 'src/imdupes'))
+sys.path.append(os.path.join(dirname(__file__) + '/..', 'tests'))
+from utils.futils import ImageDirWalker, index_images, iter_images, clean, resume_clean, rollback_clean
+from utils.journal import CleanJournal, backup_path
+from utils.results import DupResults
+from utils.globs import CleanAction
+from tests import DIR_DATA_SCRAPED
+
+
+class Walk(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        img_files = sorted(os.listdir(DIR_DATA_SCRAPED))[:40]
+        for i, img_file in enumerate(img_files):
+            sub_dir = os.path.join(self.tmp_dir, *[f'dir{j}' for j in range(i % 4)], f'sub{i % 3}')
+            os.makedirs(sub_dir, exist_ok=True)
+            shutil.copy(os.path.join(DIR_DATA_SCRAPED, img_file), sub_dir)
+        open(os.path.join(self.tmp_dir, 'notes.txt'), 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_parallel(self):
+        walked_files = [
+            os.path.join(root, file) for root, _, files in os.walk(self.tmp_dir) for file in files
+            if not file.endswith('.txt')
+        ]
+        for threads in (1, 2, 8):
+            walker = ImageDirWalker(self.tmp_dir, exclude='^DUPLICATE_', recursive=True, threads=threads)
+            entries = list(walker)
+            self.assertEqual(walked_files, [entry.path for entry, _ in entries])
+            self.assertEqual(
+                [os.path.basename(path).startswith('DUPLICATE_') for path in walked_files],
+                [excluded for _, excluded in entries]
+            )
+            self.assertEqual(len(list(os.walk(self.tmp_dir))), walker.dir_count)
+
+    def test_summary(self):
+        walked_dirs = len(list(os.walk(self.tmp_dir)))
+        for index in (index_images, iter_images):
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                img_paths = list(index(self.tmp_dir, recursive=True, verbose=1))
+            self.assertIn(f'Found {len(img_paths)} image(s) in {walked_dirs} directories', output.getvalue())
+
+    def test_shard(self):
+        img_paths = [entry.path for entry in index_images(self.tmp_dir, recursive=True)]
+        shards = [
+            [entry.path for entry in iter_images(self.tmp_dir, recursive=True, shard=(shard, 3))] for shard in range(3)
+        ]
+        self.assertCountEqual(img_paths, [path for shard in shards for path in shard])
+        self.assertTrue(all(len(shard) > 0 for shard in shards))
+
+        # Shards are assigned by relative path, wherever the directory is
+        sub_dir = os.path.join(self.tmp_dir, 'sub0')
+        moved_dir = os.path.join(self.tmp_dir, 'moved')
+        shutil.copytree(sub_dir, os.path.join(moved_dir, 'sub0'))
+        self.assertEqual(
+            [
+                os.path.relpath(entry.path, moved_dir)
+                for entry in index_images(moved_dir, recursive=True, shard=(1, 3))
+            ],
+            [os.path.relpath(path, self.tmp_dir) for path in shards[1] if os.path.dirname(path) == sub_dir]
+        )
+
+
+class Clean(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.img_paths = []
+        for i, img_file in enumerate(sorted(os.listdir(DIR_DATA_SCRAPED))[:4]):
+            self.img_paths.append(os.path.join(self.tmp_dir, f'{i}_{img_file}'))
+            shutil.copy(os.path.join(DIR_DATA_SCRAPED, img_file), self.img_paths[-1])
+        self.contents = {path: open(path, 'rb').read() for path in self.img_paths}
+        dups = DupResults()
+        for path in self.img_paths:
+            dups.add(path, 10, 10)
+        self.dups = dups.clustered([b'a', b'b'], [[0, 1], [2, 3]])
+        self.journal_file = os.path.join(self.tmp_dir, 'clean.imjournal')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def listdir(self) -> list[str]:
+        return sorted(os.path.join(self.tmp_dir, f) for f in os.listdir(self.tmp_dir))
+
+    def interrupt(self) -> None:
+        """
+        Simulates a journaled hardlink clean interrupted after cleaning the first duplicate, and while cleaning the
+        second one.
+        """
+
+        journal = CleanJournal.create(
+            self.journal_file, CleanAction.HARDLINK, [self.dups.cluster_paths(c) for c in range(len(self.dups))]
+        )
+        os.rename(self.img_paths[1], backup_path(self.img_paths[1]))
+        os.link(self.img_paths[0], self.img_paths[1])
+        journal.mark_done(0, 1)
+        os.rename(self.img_paths[3], backup_path(self.img_paths[3]))
+        journal.close()
+
+    def test_hardlink(self):
+        clean(self.dups, action=CleanAction.HARDLINK, threads=2)
+        self.assertTrue(os.path.samefile(self.img_paths[0], self.img_paths[1]))
+        self.assertTrue(os.path.samefile(self.img_paths[2], self.img_paths[3]))
+
+    def test_journal(self):
+        self.interrupt()
+        rollback_clean(self.journal_file)
+        self.assertEqual(self.contents, {path: open(path, 'rb').read() for path in self.img_paths})
+        self.assertEqual(sorted(self.img_paths), self.listdir())
+
+        self.interrupt()
+        resume_clean(self.journal_file)
+        self.assertTrue(os.path.samefile(self.img_paths[0], self.img_paths[1]))
+        self.assertTrue(os.path.samefile(self.img_paths[2], self.img_paths[3]))
+        self.assertEqual(sorted(self.img_paths), self.listdir())
+
+        # Committed journaled deletions leave neither backups nor the journal behind
+        clean(self.dups, journal_file=self.journal_file)
+        self.assertEqual(sorted(self.img_paths[0::2]), self.listdir())
+
+
+if __name__ == '__main__':
+    unittest.main()
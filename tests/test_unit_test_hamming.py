@@ -0,0 +1,42 @@
+import unittest
+import sys
+import os
+import random
+from os.path import dirname
+
+
+sys.path.append(os.path.join(dirname(__file__) + '/..', 'src/imdupes'))
+from utils.hamming import HammingIndex, cluster_hashes
+
+
+class Hamming(unittest.TestCase):
+    def test_query(self):
+        rng = random.Random(42)
+        bit_length = 256
+        hashes = [rng.getrandbits(bit_length) for _ in range(200)]
+        # Plant near-duplicates of the first hashes with a few flipped bits
+        for i in range(50):
+            near_dup = hashes[i]
+            for bit in rng.sample(range(bit_length), rng.randint(0, 6)):
+                near_dup ^= 1 << bit
+            hashes.append(near_dup)
+
+        for threshold in (0, 3, 6):
+            index = HammingIndex(bit_length, threshold)
+            for hash_value in hashes:
+                index.add(hash_value)
+            for hash_value in hashes[:60]:
+                self.assertEqual(
+                    [i for i, other in enumerate(hashes) if (hash_value ^ other).bit_count() <= threshold],
+                    index.query(hash_value)
+                )
+
+    def test_cluster(self):
+        hashes = [0b0000, 0b1111, 0b0001, 0b0011, 0b1110]
+        self.assertEqual([[0], [1], [2], [3], [4]], cluster_hashes(hashes, 4, 0))
+        self.assertEqual([[0, 2, 3], [1, 4]], cluster_hashes(hashes, 4, 1))
+        self.assertEqual([[0, 1, 2, 3, 4]], cluster_hashes(hashes, 4, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
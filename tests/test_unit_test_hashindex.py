@@ -0,0 +1,87 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+from os.path import dirname
+
+
+sys.path.append(os.path.join(dirname(__file__) + '/..', 'src/imdupes'))
+sys.path.append(os.path.join(dirname(__file__) + '/..', 'tests'))
+import hashindex
+from detect_dup_images import detect_dup_images, group_dups
+from utils.futils import iter_images
+from utils.globs import HashingMethod
+from tests import DIR_DATA
+
+
+class HashIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_merge(self):
+        dups = detect_dup_images(iter_images(DIR_DATA), method=HashingMethod.BW, hash_size=16)
+
+        shard_indexes = []
+        for shard in range(3):
+            shard_index = os.path.join(self.tmp_dir, f'shard{shard}.imidx')
+            hashindex.save(
+                detect_dup_images(
+                    iter_images(DIR_DATA, shard=(shard, 3)), method=HashingMethod.BW, hash_size=16,
+                    group=False, keep_hashes=True
+                ),
+                shard_index
+            )
+            shard_indexes.append(shard_index)
+        merged_dups = group_dups(hashindex.merge(shard_indexes))
+        self.assertCountEqual(
+            [sorted(dups.cluster_paths(c)) for c in range(len(dups))],
+            [sorted(merged_dups.cluster_paths(c)) for c in range(len(merged_dups))]
+        )
+
+        # Merged images do not depend on the order of the indexes, and are only kept once
+        self.assertEqual(
+            merged_dups.cluster_keys,
+            group_dups(hashindex.merge([*reversed(shard_indexes), shard_indexes[0]])).cluster_keys
+        )
+
+    def test_add_matches(self):
+        dups = detect_dup_images(iter_images(DIR_DATA), method=HashingMethod.BW, hash_size=16)
+        reference_index = os.path.join(self.tmp_dir, 'reference.imidx')
+        hashindex.save(
+            detect_dup_images(
+                iter_images(DIR_DATA, shard=(0, 2)), method=HashingMethod.BW, hash_size=16, group=False,
+                keep_hashes=True
+            ),
+            reference_index
+        )
+        new_paths = [os.fspath(entry) for entry in iter_images(DIR_DATA, shard=(1, 2))]
+
+        # Only the duplications involving new images are found, along with every reference image they contain
+        for threshold in (0, 8):
+            new_images = detect_dup_images(
+                new_paths, method=HashingMethod.BW, hash_size=16, group=False, keep_hashes=True
+            )
+            hashindex.add_matches(reference_index, new_images, threshold=threshold)
+            new_dups = group_dups(new_images, threshold=threshold)
+            for c in range(len(new_dups)):
+                self.assertTrue(any(path in new_paths for path in new_dups.cluster_paths(c)))
+            if threshold == 0:
+                self.assertCountEqual(
+                    [
+                        sorted(dups.cluster_paths(c)) for c in range(len(dups))
+                        if any(path in new_paths for path in dups.cluster_paths(c))
+                    ],
+                    [sorted(new_dups.cluster_paths(c)) for c in range(len(new_dups))]
+                )
+
+        # Scanned images that are also indexed are only kept once
+        images = detect_dup_images(iter_images(DIR_DATA), method=HashingMethod.BW, hash_size=16, group=False)
+        self.assertEqual(0, hashindex.add_matches(reference_index, images))
+
+
+if __name__ == '__main__':
+    unittest.main()
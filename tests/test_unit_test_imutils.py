@@ -0,0 +1,99 @@
+import unittest
+import sys
+import os
+import io
+from unittest import mock
+from os.path import dirname
+import imagehash
+from PIL import Image
+
+
+sys.path.append(os.path.join(dirname(__file__) + '/..', 'src/imdupes'))
+sys.path.append(os.path.join(dirname(__file__) + '/..', 'tests'))
+from utils.imutils import HashBatch, add_to_batches, pack_hashes, average_histogram_hash
+from utils.imutils import open_image, set_validation_policy
+from utils.globs import HashingMethod
+from utils.globs import ValidationPolicy
+from tests import DIR_DATA
+
+
+def reference_hash(image: Image, method: HashingMethod, hash_size: int) -> bytes:
+    """
+    Hashes an image one imagehash call at a time, as hash_image() did before hashes were computed in batches.
+    """
+
+    if method == HashingMethod.HIST:
+        return pack_hashes(imagehash.dhash(image, hash_size=hash_size), average_histogram_hash(image))
+    if method == HashingMethod.BW:
+        return pack_hashes(imagehash.dhash(image, hash_size=hash_size))
+    channels = 'RGB' if method == HashingMethod.RGB else 'RGBA'
+    im = image if image.mode == channels else image.convert(channels)
+    return pack_hashes(
+        *[imagehash.phash(im.getchannel(channel), hash_size=int(hash_size / len(channels))) for channel in channels]
+    )
+
+
+class Hashing(unittest.TestCase):
+    def test_bit_identical(self):
+        images = []
+        for root, _, filenames in os.walk(DIR_DATA):
+            for filename in sorted(filenames)[:30]:
+                try:
+                    with Image.open(os.path.join(root, filename)) as im:
+                        im.load()
+                        images.append(im.convert('RGBA') if im.format == 'PNG' and im.mode != 'RGBA' else im.copy())
+                except (OSError, ValueError):
+                    continue
+
+        for method in HashingMethod:
+            for hash_size in (8, 16, 33):
+                batch = HashBatch(method, hash_size)
+                for im in images:
+                    batch.add(im)
+                self.assertEqual(
+                    [reference_hash(im, method, hash_size) for im in images], batch.hash(), f'{method} {hash_size}'
+                )
+                self.assertEqual(0, len(batch))
+
+        # Batches of all methods sharing the conversions and grids of each image
+        for hash_size in (8, 16, 33):
+            batches = [HashBatch(method, hash_size) for method in HashingMethod]
+            for im in images:
+                add_to_batches(batches, im)
+            for batch in batches:
+                self.assertEqual(
+                    [reference_hash(im, batch.method, hash_size) for im in images], batch.hash(),
+                    f'{batch.method} {hash_size} shared'
+                )
+
+        # Images are added to all batches or to none of them
+        batches = [HashBatch(method, 8) for method in HashingMethod]
+        with mock.patch.object(batches[-1], 'normalize', side_effect=MemoryError):
+            with self.assertRaises(MemoryError):
+                add_to_batches(batches, images[0])
+        self.assertEqual([0] * len(batches), [len(batch) for batch in batches])
+
+
+
+class Validation(unittest.TestCase):
+    def tearDown(self):
+        set_validation_policy(ValidationPolicy.HEADER)
+
+    def test_truncated(self):
+        with open(os.path.join(DIR_DATA, 'BTEXT_pikachu.jpg'), 'rb') as f:
+            truncated = f.read()
+        truncated = truncated[:len(truncated) // 2]
+
+        # Truncated images are only decoded once the policy is applied to the process, whatever each open asks for
+        set_validation_policy(ValidationPolicy.HEADER)
+        with open_image(io.BytesIO(truncated), ValidationPolicy.NONE) as im:
+            self.assertRaises(OSError, im.load)
+        set_validation_policy(ValidationPolicy.NONE)
+        with open_image(io.BytesIO(truncated), ValidationPolicy.NONE) as im:
+            im.load()
+        with open_image(io.BytesIO(truncated)) as im:
+            im.load()
+
+
+if __name__ == '__main__':
+    unittest.main()
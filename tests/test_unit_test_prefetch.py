@@ -0,0 +1,108 @@
+import unittest
+import sys
+import os
+import io
+import shutil
+import tempfile
+from os.path import dirname
+
+
+sys.path.append(os.path.join(dirname(__file__) + '/..', 'src/imdupes'))
+sys.path.append(os.path.join(dirname(__file__) + '/..', 'tests'))
+from detect_dup_images import detect_dup_images
+from utils.prefetch import Prefetcher
+from utils.futils import MappedFile
+from utils.prefilter import _partial_digest, _full_digest
+from utils.globs import HashingMethod
+from tests import DIR_DATA_SCRAPED
+
+
+class Prefetch(unittest.TestCase):
+    def setUp(self):
+        self.img_paths = [os.path.join(DIR_DATA_SCRAPED, img) for img in sorted(os.listdir(DIR_DATA_SCRAPED))[:40]]
+
+    def test_prefetcher(self):
+        img_paths = [*self.img_paths[:10], os.path.join(DIR_DATA_SCRAPED, 'missing.jpg')]
+        max_size = max(os.path.getsize(path) for path in img_paths[:10])
+        with Prefetcher(img_paths, depth=3, memory_budget=4 * max_size) as prefetcher:
+            sources = [source for source, _ in prefetcher]
+        self.assertEqual(len(img_paths), len(sources))
+        for img_path, source in zip(img_paths[:10], sources):
+            self.assertIsInstance(source, io.BytesIO)
+            with open(img_path, 'rb') as f:
+                self.assertEqual(f.read(), source.getvalue())
+        self.assertEqual(img_paths[-1], sources[-1])
+
+        # Files larger than their share of the memory budget are decoded from their path
+        with Prefetcher(img_paths[:10], depth=3, memory_budget=0) as prefetcher:
+            self.assertEqual(img_paths[:10], [source for source, _ in prefetcher])
+
+    def test_interrupted(self):
+        # Files already read ahead are closed when the iteration stops early
+        class RecordingPrefetcher(Prefetcher):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self.sources = []
+
+            def _read(self, img_path):
+                source = super()._read(img_path)
+                self.sources.append(source)
+                return source
+
+        with RecordingPrefetcher(self.img_paths[:10], depth=4) as prefetcher:
+            sources = iter(prefetcher)
+            first_source, _ = next(sources)
+            sources.close()
+        self.assertGreater(len(prefetcher.sources), 1)
+        for source in prefetcher.sources:
+            self.assertEqual(source is not first_source, source.closed)
+        first_source.close()
+
+    def test_detect(self):
+        for jobs in (1, 2):
+            self.assertEqual(
+                detect_dup_images(self.img_paths, method=HashingMethod.BW, hash_size=16, jobs=jobs, prefetch=0)
+                .cluster_keys,
+                detect_dup_images(self.img_paths, method=HashingMethod.BW, hash_size=16, jobs=jobs, prefetch=4)
+                .cluster_keys
+            )
+
+    def test_mmap(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            empty_path = os.path.join(tmp_dir, 'empty.jpg')
+            open(empty_path, 'wb').close()
+            img_paths = [*self.img_paths[:10], empty_path]
+            with Prefetcher(img_paths, depth=3, use_mmap=True) as prefetcher:
+                sources = [source for source, _ in prefetcher]
+            for img_path, source in zip(img_paths[:10], sources):
+                self.assertIsInstance(source, MappedFile)
+                with open(img_path, 'rb') as f:
+                    self.assertEqual(f.read(), source.read())
+                source.close()
+            # Empty files cannot be mapped, and are read as without memory mapping
+            self.assertEqual(b'', sources[-1].getvalue())
+
+            for img_path in img_paths:
+                file_size = os.path.getsize(img_path)
+                self.assertEqual(_partial_digest(img_path, file_size), _partial_digest(img_path, file_size, True))
+                self.assertEqual(_full_digest(img_path), _full_digest(img_path, True))
+
+            for prefetch in (0, 4):
+                images = [
+                    detect_dup_images(
+                        img_paths, method=HashingMethod.BW, hash_size=16, group=False, keep_hashes=True,
+                        prefetch=prefetch, use_mmap=use_mmap
+                    )
+                    for use_mmap in (False, True)
+                ]
+                self.assertEqual(
+                    *([(result.path(entry), result.hash(entry)) for entry in range(result.entry_count)]
+                      for result in images)
+                )
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+from os.path import dirname
+
+
+sys.path.append(os.path.join(dirname(__file__) + '/..', 'src/imdupes'))
+from utils.prefilter import IdenticalFileFilter
+
+
+class Prefilter(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, filename: str, content: bytes) -> str:
+        path = os.path.join(self.tmp_dir, filename)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test(self):
+        content = os.urandom(64 * 1024)
+        original = self.write('original', content)
+        copy = self.write('copy', content)
+        hardlink = os.path.join(self.tmp_dir, 'hardlink')
+        os.link(copy, hardlink)
+        # Same size, head and tail as the original, only differs in the middle
+        middle_changed = self.write('middle_changed', content[:32 * 1024] + b'\0' + content[32 * 1024 + 1:])
+        small = self.write('small', b'small')
+        small_copy = self.write('small_copy', b'small')
+
+        for use_mmap in (False, True):
+            identical_filter = IdenticalFileFilter(use_mmap=use_mmap)
+            self.assertEqual(
+                [None, original, None, original, None, small],
+                [
+                    identical_filter.find(path, os.stat(path))
+                    for path in (original, copy, middle_changed, hardlink, small, small_copy)
+                ]
+            )
+            self.assertEqual(2, identical_filter.identical_count)
+            self.assertEqual(1, identical_filter.hardlink_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
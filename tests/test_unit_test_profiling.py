@@ -0,0 +1,64 @@
+import unittest
+import sys
+import os
+from os.path import dirname
+
+
+sys.path.append(os.path.join(dirname(__file__) + '/..', 'src/imdupes'))
+sys.path.append(os.path.join(dirname(__file__) + '/..', 'tests'))
+from detect_dup_images import detect_dup_images
+from utils.profiling import Profiler, NULL_PROFILER
+from utils.globs import HashingMethod
+from tests import DIR_DATA_SCRAPED
+
+
+class Profiling(unittest.TestCase):
+    def test_stages(self):
+        profiler = Profiler(slowest_count=2)
+        with profiler.stage('scan'):
+            self.assertEqual([1, 2, 3], list(profiler.iterate('index', [1, 2, 3])))
+            with profiler.stage('group'):
+                pass
+        for i in range(100):
+            profiler.record_file(f'{i}.jpg', {'decode': i / 1000, 'resize': 0.001}, file_size=10)
+        profiler.record_batch('hash', 0.03, 60)
+        profiler.record_batch('hash', 0.01, 40)
+
+        report = profiler.report()
+        self.assertEqual(
+            [('scan > index', 4), ('scan > group', 1), ('scan', 1)],
+            [(stage['stage'], stage['calls']) for stage in report['stages']]
+        )
+        self.assertEqual(100, report['files'])
+        self.assertEqual(1000, report['bytes_scanned'])
+        self.assertAlmostEqual(0.0495, report['file_latencies']['decode']['p50'])
+        self.assertEqual(100, sum(report['file_latencies']['decode']['histogram']['counts']))
+        self.assertEqual(['99.jpg', '98.jpg'], [slowest['path'] for slowest in report['slowest_files']])
+        self.assertEqual(2, report['batch_latencies']['hash']['count'])
+        self.assertEqual(100, report['batch_latencies']['hash']['files'])
+        self.assertAlmostEqual(0.0004, report['batch_latencies']['hash']['per_file'])
+
+        NULL_PROFILER.record_file('0.jpg', {'decode': 1.0})
+        with NULL_PROFILER.stage('scan'):
+            pass
+        self.assertEqual(0, len(NULL_PROFILER.report()['stages']))
+
+    def test_detect(self):
+        img_paths = [os.path.join(DIR_DATA_SCRAPED, img) for img in sorted(os.listdir(DIR_DATA_SCRAPED))[:40]]
+        profiler = Profiler()
+        profiled_dups = detect_dup_images(img_paths, method=HashingMethod.BW, hash_size=16, profiler=profiler)
+        dups = detect_dup_images(img_paths, method=HashingMethod.BW, hash_size=16)
+
+        self.assertEqual(dups.cluster_keys, profiled_dups.cluster_keys)
+        report = profiler.report()
+        self.assertEqual(
+            ['io wait', 'open', 'decode', 'convert', 'resize'], list(report['file_latencies'].keys())
+        )
+        self.assertEqual(['hash'], list(report['batch_latencies'].keys()))
+        self.assertEqual(
+            len(img_paths) - sum(len(dups.cluster(c)) - 1 for c in range(len(dups))), report['files']
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+import sys
+import os
+from os.path import dirname
+
+
+sys.path.append(os.path.join(dirname(__file__) + '/..', 'src/imdupes'))
+from utils.results import DupResults
+
+
+class Results(unittest.TestCase):
+    def test_clustered(self):
+        images = DupResults()
+        images.add('/a/small.png', 10, 10, 100, 'PNG')
+        images.add('/a/large.jpg', 20, 20, 400, 'JPEG')
+        images.add('/b/unique.jpg', 30, 30, 900, 'JPEG')
+        images.add('/b/large_copy.jpg', 20, 20, 400, 'JPEG')
+        images.add('/c/other.png', 5, 5, 25, 'PNG')
+        images.add('/c/other_copy.png', 5, 5, 25, 'PNG')
+
+        dups = images.clustered([b'first', b'second'], [[0, 1, 3], [4, 5]])
+        self.assertEqual(2, len(dups))
+        self.assertEqual(5, dups.file_count)
+        self.assertEqual([b'first', b'second'], dups.cluster_keys)
+        # Highest resolution first, ties keep their order
+        self.assertEqual(['/a/large.jpg', '/b/large_copy.jpg', '/a/small.png'], dups.cluster_paths(0))
+        self.assertEqual(['/c/other.png', '/c/other_copy.png'], dups.cluster_paths(1))
+        self.assertEqual([(20, 20), (20, 20), (10, 10)], [dups.size(entry) for entry in dups.cluster(0)])
+        self.assertEqual(['JPEG', 'JPEG', 'PNG'], [dups.file_format(entry) for entry in dups.cluster(0)])
+        self.assertEqual([0, 0, 0, 1, 1], list(dups.cluster_ids))
+        self.assertEqual(['/a', '/b', '/c'], images.directories)
+
+        self.assertEqual(0, len(images.clustered([], [])))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+import threading
+from os.path import dirname
+
+
+sys.path.append(os.path.join(dirname(__file__) + '/..', 'src/imdupes'))
+sys.path.append(os.path.join(dirname(__file__) + '/..', 'tests'))
+import hashindex
+from detect_dup_images import detect_dup_images, group_dups
+from service import QueryIndex, ServiceClient, create_server
+from utils.globs import HashingMethod
+from tests import DIR_DATA
+
+
+class Service(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.index = os.path.join(self.tmp_dir, 'library.imidx')
+        self.img_paths = [
+            os.path.join(DIR_DATA, img)
+            for img in ('pikachu.jpg', 'ON_TRANSPARENT_pikachu.png', 'pikachu.bmp', 'SOLID_red.jpg')
+        ]
+        scanned_images = detect_dup_images(
+            self.img_paths[1:], method=HashingMethod.BW, hash_size=16, group=False, keep_hashes=True
+        )
+        hashindex.save(scanned_images, self.index)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_hashindex(self):
+        images = hashindex.load(self.index)
+        self.assertEqual((HashingMethod.BW, 16), (images.method, images.hash_size))
+        self.assertEqual(self.img_paths[1:], [images.path(entry) for entry in range(images.entry_count)])
+        self.assertEqual(
+            group_dups(detect_dup_images(
+                self.img_paths[1:], method=HashingMethod.BW, hash_size=16, group=False
+            )).cluster_keys,
+            group_dups(images).cluster_keys
+        )
+        with self.assertRaises(ValueError):
+            hashindex.IndexWriter(self.index, HashingMethod.RGB, 16)
+
+    def test_query(self):
+        writer = hashindex.IndexWriter(self.index, HashingMethod.BW, 16)
+        query_index = QueryIndex(hashindex.load(self.index), threshold=8, writer=writer)
+        results = query_index.query([self.img_paths[0], os.path.join(self.tmp_dir, 'missing.jpg')], threshold=0)
+        self.assertEqual(
+            [self.img_paths[2]], [match['path'] for match in results[0]['matches'] if match['distance'] == 0]
+        )
+        self.assertIn('error', results[1])
+
+        with open(self.img_paths[0], 'rb') as f:
+            data = f.read()
+        near_matches = query_index.query([data])[0]['matches']
+        self.assertLessEqual(2, len(near_matches))
+        self.assertEqual(sorted(match['distance'] for match in near_matches), [m['distance'] for m in near_matches])
+        with self.assertRaises(ValueError):
+            query_index.query([data], threshold=9)
+
+        # Added images are matched by later queries, and written through to the index file
+        self.assertTrue(query_index.query([data], names=['uploads/pikachu.jpg'], threshold=0, add=True)[0]['added'])
+        self.assertIn('uploads/pikachu.jpg', [m['path'] for m in query_index.query([self.img_paths[2]])[0]['matches']])
+        writer.close()
+        self.assertEqual(4, hashindex.load(self.index).entry_count)
+
+    def test_server(self):
+        for socket_path in (None, os.path.join(self.tmp_dir, 'service.sock')):
+            server = create_server(QueryIndex(hashindex.load(self.index)), socket_path=socket_path, port=0)
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+            client = ServiceClient(socket_path=socket_path, port=server.server_address[1] if socket_path is None else 0)
+            try:
+                self.assertEqual(3, client.stats()['images'])
+                results = client.query(self.img_paths[:2])
+                self.assertEqual([self.img_paths[2]], [match['path'] for match in results[0]['matches']])
+                with open(self.img_paths[0], 'rb') as f:
+                    self.assertEqual(results[0]['hash'], client.query_bytes(f.read())['hash'])
+                with self.assertRaises(ValueError):
+                    client.query([], threshold=1)
+            finally:
+                client.close()
+                server.shutdown()
+                server.server_close()
+                thread.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
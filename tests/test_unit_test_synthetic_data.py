@@ -0,0 +1,49 @@
+import unittest
+import sys
+import os
+import shutil
+import filecmp
+import tempfile
+from os.path import dirname
+
+
+sys.path.append(os.path.join(dirname(__file__) + '/..', 'src/imdupes'))
+sys.path.append(os.path.join(dirname(__file__) + '/..'))
+from detect_dup_images import detect_dup_images
+from utils.futils import index_images
+from utils.globs import HashingMethod
+from tests.init_synthetic_data import generate
+from tests.benchmark import score
+
+
+class SyntheticData(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test(self):
+        corpus = os.path.join(self.tmp_dir, 'corpus')
+        manifest = generate(corpus, image_count=40, max_size=256, seed=1)
+        self.assertEqual(
+            manifest, generate(os.path.join(self.tmp_dir, 'corpus_again'), image_count=40, max_size=256, seed=1)
+        )
+        self.assertEqual(
+            [],
+            filecmp.cmpfiles(corpus, os.path.join(self.tmp_dir, 'corpus_again'), os.listdir(corpus), shallow=False)[1]
+        )
+        self.assertEqual(40 + len(manifest['duplicates']), len(index_images(corpus)))
+
+        dups = detect_dup_images([entry.path for entry in index_images(corpus)], method=HashingMethod.RGB, hash_size=16)
+        found = [
+            {os.path.basename(path) for path in dups.cluster_paths(cluster_id)} for cluster_id in range(len(dups))
+        ]
+        for duplicate in manifest['duplicates']:
+            if duplicate['kind'] == 'exact':
+                self.assertIn({duplicate['path'], duplicate['original']}, found)
+        self.assertEqual(1.0, score(dups, corpus)['precision'])
+
+
+if __name__ == '__main__':
+    unittest.main()
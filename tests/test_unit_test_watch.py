@@ -0,0 +1,93 @@
+import unittest
+import sys
+import os
+import shutil
+import tempfile
+from os.path import dirname
+
+
+sys.path.append(os.path.join(dirname(__file__) + '/..', 'src/imdupes'))
+sys.path.append(os.path.join(dirname(__file__) + '/..', 'tests'))
+from watch import DupIndex, DupWatcher
+from utils.watcher import InotifyWatcher, PollingWatcher
+from utils.globs import HashingMethod
+from tests import DIR_DATA
+
+
+SOURCE_IMAGES = sorted(f for f in os.listdir(DIR_DATA) if os.path.isfile(os.path.join(DIR_DATA, f)))[:3]
+
+
+class Watch(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def copy(self, image: str, path: str) -> str:
+        path = os.path.join(self.tmp_dir, path)
+        os.makedirs(dirname(path), exist_ok=True)
+        shutil.copyfile(os.path.join(DIR_DATA, image), path)
+        return path
+
+    def test_index(self):
+        index = DupIndex(HashingMethod.BW, 8)
+        self.assertFalse(index.add('/a/1.jpg', b'x' * 16, 10, 10, 100, 'JPEG', 0, (100, 0, 1)))
+        self.assertFalse(index.add('/a/b/2.jpg', b'y' * 16, 20, 20, 100, 'JPEG', 0, (100, 0, 2)))
+        self.assertTrue(index.add('/a/b/3.jpg', b'x' * 16, 30, 30, 100, 'JPEG', 0, (100, 0, 3)))
+        self.assertEqual(['/a/b/3.jpg', '/a/1.jpg'], index.dup_results().cluster_paths(0))
+
+        # Changed images move to the group of their new digest
+        self.assertTrue(index.add('/a/b/2.jpg', b'x' * 16, 20, 20, 100, 'JPEG', 0, (100, 1, 2)))
+        self.assertEqual(3, index.dup_results([b'x' * 16]).file_count)
+        self.assertEqual(2, index.remove_tree('/a/b'))
+        self.assertEqual(0, len(index.dup_results()))
+        self.assertEqual(['/a/1.jpg'], index.paths())
+
+    def test_watchers(self):
+        self.copy(SOURCE_IMAGES[0], 'a.jpg')
+        watchers = [PollingWatcher(self.tmp_dir, recursive=True, interval=0.01)]
+        try:
+            watchers.append(InotifyWatcher(self.tmp_dir, recursive=True, settle_time=0.1))
+        except OSError:
+            pass  # Not available on this platform
+
+        try:
+            for watcher in watchers:
+                self.assertEqual(set(), watcher.wait(timeout=0))
+            added = self.copy(SOURCE_IMAGES[1], 'b.jpg')
+            os.remove(os.path.join(self.tmp_dir, 'a.jpg'))
+            for watcher in watchers:
+                self.assertEqual({added, os.path.join(self.tmp_dir, 'a.jpg')}, watcher.wait(timeout=5), watcher)
+        finally:
+            for watcher in watchers:
+                watcher.close()
+
+    def test_update(self):
+        original = self.copy(SOURCE_IMAGES[0], 'original.jpg')
+        self.copy(SOURCE_IMAGES[1], 'other.jpg')
+        dup_watcher = DupWatcher(self.tmp_dir, method=HashingMethod.BW, hash_size=16, recursive=True)
+        self.assertEqual(0, len(dup_watcher.build()))
+        self.assertEqual(2, len(dup_watcher.index))
+
+        copy = self.copy(SOURCE_IMAGES[0], os.path.join('sub', 'copy.jpg'))
+        dups = dup_watcher.update({copy})
+        self.assertEqual(1, len(dups))
+        self.assertCountEqual([original, copy], dups.cluster_paths(0))
+
+        # Directories moved or removed as a whole
+        shutil.move(os.path.join(self.tmp_dir, 'sub'), os.path.join(self.tmp_dir, 'moved'))
+        dups = dup_watcher.update({os.path.join(self.tmp_dir, 'sub'), os.path.join(self.tmp_dir, 'moved')})
+        self.assertCountEqual([original, os.path.join(self.tmp_dir, 'moved', 'copy.jpg')], dups.cluster_paths(0))
+        shutil.rmtree(os.path.join(self.tmp_dir, 'moved'))
+        self.assertEqual(0, len(dup_watcher.update({os.path.join(self.tmp_dir, 'moved')})))
+        self.assertEqual(2, len(dup_watcher.index))
+
+        # Lost events compare the whole directory to the index
+        self.copy(SOURCE_IMAGES[1], 'other_copy.jpg')
+        self.assertEqual(1, len(dup_watcher.update(None)))
+        self.assertEqual(3, len(dup_watcher.index))
+
+
+if __name__ == '__main__':
+    unittest.main()